@@ -0,0 +1,120 @@
+"""Synthetic documents for the benchmarks.  The text is generated from a fixed vocabulary, so the
+same arguments always give the same document."""
+
+import io
+import zipfile
+from typing import Literal
+
+_VOCABULARY = (
+    "the study enrolled patients with moderate disease who received treatment for twelve weeks "
+    "primary endpoint was change from baseline in symptom score secondary endpoints included "
+    "safety tolerability and quality of life adverse events were mild and resolved without "
+    "intervention results support further development of the compound in a larger trial"
+).split()
+
+_W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>"""
+
+_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+_DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+_STYLES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles {_W}>
+<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/></w:style>
+</w:styles>"""
+
+
+def words(count: int, offset: int = 0) -> str:
+    return " ".join(_VOCABULARY[(offset + _) % len(_VOCABULARY)] for _ in range(count))
+
+
+def section_title(ix: int) -> str:
+    return f"Section {ix + 1}"
+
+
+def make_docx(sections: int, words_per_section: int = 200) -> bytes:
+    """Returns a DOCX with the given number of top level sections, each with one paragraph."""
+
+    def paragraph(text: str, style: str | None = None) -> str:
+        properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+        return f"<w:p>{properties}<w:r><w:t>{text}</w:t></w:r></w:p>"
+
+    body = "".join(
+        paragraph(section_title(ix), "Heading1")
+        + paragraph(words(words_per_section, ix))
+        for ix in range(sections)
+    )
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f"<w:document {_W}><w:body>{body}</w:body></w:document>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        docx.writestr("_rels/.rels", _RELS)
+        docx.writestr("word/_rels/document.xml.rels", _DOCUMENT_RELS)
+        docx.writestr("word/document.xml", document)
+        docx.writestr("word/styles.xml", _STYLES)
+    return buffer.getvalue()
+
+
+def synthetic_markdown(shape: Literal["deep", "wide", "long"], size: int) -> str:
+    """Returns markdown of about size characters with the given shape:
+
+    - deep: every top level section has a full subtree down to level 6 headings
+    - wide: many top level sections with a short paragraph each
+    - long: a few sections, each with a lot of text
+    """
+    chunks = []
+    length = 0
+
+    def add(text: str):
+        nonlocal length
+        chunks.append(text)
+        length += len(text)
+
+    if shape == "long":
+        section_count = 8
+        for ix in range(section_count):
+            add(f"# {section_title(ix)}\n\n")
+            n = 0
+            while length < size * (ix + 1) / section_count:
+                add(words(20, n) + "\n\n")
+                n += 1
+    elif shape == "wide":
+        ix = 0
+        while length < size:
+            add(f"# {section_title(ix)}\n\n{words(50, ix)}\n\n")
+            ix += 1
+    elif shape == "deep":
+
+        def subtree(path: list[int]):
+            title = "Section " + ".".join(str(_ + 1) for _ in path)
+            add(f"{'#' * len(path)} {title}\n\n{words(10, len(chunks))}\n\n")
+            if len(path) < 6:
+                for ix in range(3):
+                    if length >= size:
+                        return
+                    subtree([*path, ix])
+
+        ix = 0
+        while length < size:
+            subtree([ix])
+            ix += 1
+    else:
+        raise ValueError(f"Unknown shape {shape}")
+    return "".join(chunks)
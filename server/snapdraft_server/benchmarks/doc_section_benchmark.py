@@ -0,0 +1,198 @@
+"""Micro-benchmarks of DocSection.
+
+Each operation is run on synthetic markdown of each shape (deep, wide and long, see
+synthetic_markdown) and size.  The time per call is the fastest of repeated runs, which is the
+least affected by other load on the machine.  The peak memory is measured with tracemalloc in a
+separate run, since tracing slows the code down.  Timings are compared with the baseline after scaling by a calibration run of plain Python code,
+so a busy or slower machine doesn't show up as a regression.
+
+Run with:
+
+    python -m snapdraft_server.benchmarks.doc_section_benchmark [--quick] [--update-baseline]
+
+The results are compared with the stored baseline and the run fails if any of them regressed.
+"""
+
+import argparse
+import copy
+import logging
+import statistics
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from pydantic import BaseModel, Field
+
+from snapdraft_server.benchmarks.corpus import synthetic_markdown
+from snapdraft_server.benchmarks.results import (
+    BenchmarkResult,
+    find_regressions,
+    format_results,
+    load_baseline,
+    save_baseline,
+)
+from snapdraft_server.core.doc_section import DocSection
+
+logger = logging.getLogger(__name__)
+
+BASELINE_PATH = Path(__file__).parent / "baselines" / "doc_section.json"
+CALIBRATION = "calibration"
+
+
+class DocSectionBenchmarkConfig(BaseModel):
+    shapes: list[str] = Field(default_factory=lambda: ["deep", "wide", "long"])
+    sizes: list[int] = Field(default_factory=lambda: [10_000, 1_000_000, 10_000_000])
+    """Sizes of the markdown, in characters."""
+    repeat: int = 5
+    """Number of timing samples, each is enough calls to take at least 0.2s."""
+    max_repeat_seconds: float = 2.0
+    """Operations slower than this are only timed once."""
+
+
+# A subset of the full run, so it can be compared with the same baseline.
+QUICK_CONFIG = DocSectionBenchmarkConfig(sizes=[10_000, 1_000_000])
+
+
+def size_name(size: int) -> str:
+    if size >= 1_000_000:
+        return f"{size // 1_000_000}MB"
+    return f"{size // 1_000}KB"
+
+
+def operations(markdown: str) -> dict[str, Callable[[], object]]:
+    """Returns the operations to benchmark on the markdown."""
+    doc = DocSection.parse_markdown("Benchmark", markdown)
+    # The last section is the slowest to find.
+    name = "\\".join(doc.get_title_path(doc.get_section_ids()[-1]))
+    return {
+        "parse_markdown": lambda: DocSection.parse_markdown("Benchmark", markdown),
+        "as_markdown": doc.as_markdown,
+        "find_section_by_name": lambda: doc.find_section_by_name(name),
+        "get_section_names": doc.get_section_names,
+        "get_section_ids": doc.get_section_ids,
+        "deepcopy": lambda: copy.deepcopy(doc),
+    }
+
+
+def measure(operation: Callable[[], object], config: DocSectionBenchmarkConfig):
+    """Returns the fastest seconds per call and the peak memory in bytes allocated by a call."""
+    timer = timeit.Timer(operation)
+    number, seconds = timer.autorange()
+    timings = [seconds / number]
+    if seconds < config.max_repeat_seconds:
+        timings.extend(_ / number for _ in timer.repeat(config.repeat - 1, number))
+
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(timings), peak
+
+
+class _Node:
+    def __init__(self, title: str, children: list["_Node"]):
+        self.title = title
+        self.children = children
+
+
+def calibrate() -> float:
+    """Returns the fastest seconds for a fixed workload of building and walking a tree of Python
+    objects, similar to what the DocSection operations do."""
+
+    def build(depth: int) -> _Node:
+        return _Node(
+            f"Node {depth}", [build(depth - 1) for _ in range(3)] if depth else []
+        )
+
+    def walk(node: _Node, path: str) -> list[str]:
+        path = f"{path}/{node.title}"
+        return [path, *(_ for child in node.children for _ in walk(child, path))]
+
+    def workload():
+        return sorted("\n".join(walk(build(6), "")).splitlines(), key=len)
+
+    timer = timeit.Timer(workload)
+    number, _ = timer.autorange()
+    return min(timer.repeat(5, number)) / number
+
+
+def run_doc_section_benchmark(
+    config: DocSectionBenchmarkConfig,
+) -> list[BenchmarkResult]:
+    # Calibrated before each document and the median is used, in case the load on the machine
+    # changes during the run.
+    calibrations = []
+    results = []
+    for shape in config.shapes:
+        for size in config.sizes:
+            calibrations.append(calibrate())
+            markdown = synthetic_markdown(shape, size)
+            for name, operation in operations(markdown).items():
+                seconds, peak = measure(operation, config)
+                results.append(
+                    BenchmarkResult(
+                        name=f"{name}/{shape}/{size_name(size)}",
+                        metrics={"time_ms": seconds * 1000, "peak_mb": peak / 1e6},
+                    )
+                )
+                logger.info("%s took %.3fms", results[-1].name, seconds * 1000)
+    calibration = BenchmarkResult(
+        name=CALIBRATION,
+        metrics={"calibration_ms": statistics.median(calibrations) * 1000},
+    )
+    return [calibration, *results]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--quick", action="store_true", help="Skip the largest documents"
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Save the results as the new baseline instead of comparing with it",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument(
+        "--min-change-ms",
+        type=float,
+        default=0.1,
+        help="Smaller changes in timings are ignored as noise",
+    )
+    parser.add_argument("--output", type=Path, help="Also write the results here")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    config = QUICK_CONFIG if args.quick else DocSectionBenchmarkConfig()
+    results = run_doc_section_benchmark(config)
+    print(format_results(results))
+    if args.output:
+        save_baseline(args.output, results)
+    if args.update_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+    baseline = load_baseline(args.baseline)
+    time_scale = 1.0
+    if CALIBRATION in baseline:
+        time_scale = (
+            results[0].metrics["calibration_ms"]
+            / baseline[CALIBRATION]["calibration_ms"]
+        )
+        print(f"Scaling baseline timings by {time_scale:.2f}")
+    regressions = find_regressions(
+        results, baseline, args.tolerance, time_scale, args.min_change_ms
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import pytest
+
+from snapdraft_server.benchmarks.corpus import synthetic_markdown
+from snapdraft_server.benchmarks.doc_section_benchmark import (
+    DocSectionBenchmarkConfig,
+    run_doc_section_benchmark,
+)
+from snapdraft_server.core.doc_section import DocSection
+
+
+@pytest.mark.parametrize(
+    "shape, max_depth, max_sections",
+    [("deep", 6, None), ("wide", 1, None), ("long", 1, 8)],
+)
+def test_synthetic_markdown(shape: str, max_depth: int, max_sections: int | None):
+    markdown = synthetic_markdown(shape, 50_000)
+    doc = DocSection.parse_markdown("Doc", markdown)
+
+    assert 50_000 <= len(markdown) < 51_000
+    assert markdown == synthetic_markdown(shape, 50_000)
+    assert max(len(_) for _ in doc.get_section_ids()) == max_depth
+    if max_sections:
+        assert len(doc.get_section_ids()) == max_sections + 1
+
+
+def test_run_doc_section_benchmark():
+    config = DocSectionBenchmarkConfig(shapes=["wide"], sizes=[2_000], repeat=1)
+
+    results = run_doc_section_benchmark(config)
+
+    assert [_.name for _ in results] == [
+        "calibration",
+        "parse_markdown/wide/2KB",
+        "as_markdown/wide/2KB",
+        "find_section_by_name/wide/2KB",
+        "get_section_names/wide/2KB",
+        "get_section_ids/wide/2KB",
+        "deepcopy/wide/2KB",
+    ]
+    assert all(_.metrics["peak_mb"] > 0 for _ in results[1:])
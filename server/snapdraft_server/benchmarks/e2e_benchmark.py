@@ -0,0 +1,265 @@
+"""End-to-end benchmarks of the API.
+
+Drives the real app through httpx.ASGITransport, like the route tests, with an in-memory Mongo,
+the mock GridFS and a FakeLM with a fixed latency.  For each document size and concurrency level
+the upload, preprocess, generate and list endpoints are called a number of times and their
+throughput and latency percentiles are recorded.  Preprocessing runs in a background task when a
+draft is created, which finishes before the create call returns.
+
+Run with:
+
+    python -m snapdraft_server.benchmarks.e2e_benchmark [--quick] [--update-baseline]
+
+The results are compared with the stored baseline and the run fails if any of them regressed.
+Baselines depend on the machine, so update them when moving to different hardware.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import dspy
+from httpx import ASGITransport, AsyncClient, Response
+from mongomock_motor import AsyncMongoMockClient
+from pydantic import BaseModel, Field
+
+from snapdraft_server.benchmarks.corpus import make_docx, section_title
+from snapdraft_server.benchmarks.fake_lm import FakeLM
+from snapdraft_server.benchmarks.results import (
+    BenchmarkResult,
+    find_regressions,
+    format_results,
+    load_baseline,
+    percentile,
+    save_baseline,
+)
+from snapdraft_server.core.lm_limiter import configure_lm_limiter
+from snapdraft_server.routes.app_setup import create_app
+from snapdraft_server.services.base.mock_gridfs import MockAsyncIOMotorGridFSBucket
+from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
+
+logger = logging.getLogger(__name__)
+
+BASELINE_PATH = Path(__file__).parent / "baselines" / "e2e.json"
+
+
+class E2eBenchmarkConfig(BaseModel):
+    document_sections: list[int] = Field(default_factory=lambda: [10, 100, 1000])
+    """Sizes of the source documents, in sections."""
+    concurrency: list[int] = Field(default_factory=lambda: [1, 8])
+    requests: int = 16
+    """Number of calls to each endpoint at each size and concurrency level."""
+    words_per_section: int = 200
+    template_sections: int = 3
+    """Number of generated sections, each is one LM call."""
+    lm_latency_seconds: float = 0.05
+
+
+# A subset of the full run, so it can be compared with the same baseline.
+QUICK_CONFIG = E2eBenchmarkConfig(document_sections=[10])
+
+
+async def run_e2e_benchmark(
+    config: E2eBenchmarkConfig, work_dir: Path
+) -> list[BenchmarkResult]:
+    mongo = SnapdraftMongo(
+        AsyncMongoMockClient(),
+        "snapdraft_benchmark",
+        MockAsyncIOMotorGridFSBucket(work_dir / "gridfs"),
+    )
+    local_cache_dir = work_dir / "local_cache"
+    local_cache_dir.mkdir(parents=True, exist_ok=True)
+    dspy_dir = work_dir / "dspy"
+    dspy_dir.mkdir(parents=True, exist_ok=True)
+    app = create_app([], mongo, local_cache_dir=local_cache_dir, dspy_dir=dspy_dir)
+
+    results = []
+    lm = FakeLM(latency_seconds=config.lm_latency_seconds)
+    with dspy.context(lm=lm):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://benchmark"
+        ) as client:
+            for sections in config.document_sections:
+                docx = make_docx(sections, config.words_per_section)
+                for concurrency in config.concurrency:
+                    results.extend(
+                        await _run_level(client, config, docx, sections, concurrency)
+                    )
+    await mongo.close()
+    logger.info("Made %d LM calls", lm.calls)
+    return results
+
+
+async def _run_level(
+    client: AsyncClient,
+    config: E2eBenchmarkConfig,
+    docx: bytes,
+    sections: int,
+    concurrency: int,
+) -> list[BenchmarkResult]:
+    """Runs every endpoint at one document size and concurrency level.  Each level gets its own
+    document type, so the list calls always return the same number of drafts."""
+    doc_id = await _create_doc_type(client, config, sections)
+    suffix = f"sections={sections}/concurrency={concurrency}"
+
+    def upload():
+        files = {"file": ("source.docx", docx, "application/octet-stream")}
+        return client.post("/files/upload/", files=files)
+
+    upload_result, responses = await _measure(
+        f"upload/{suffix}", [upload] * config.requests, concurrency
+    )
+    file_ids = [_.json()["id"] for _ in responses]
+
+    def create_draft(ix: int):
+        return lambda: client.post(
+            f"/document-types/{doc_id}/drafts/",
+            json={"name": f"Draft {ix}", "source_file_ids": {"source": file_ids[ix]}},
+        )
+
+    preprocess_result, responses = await _measure(
+        f"preprocess/{suffix}",
+        [create_draft(_) for _ in range(config.requests)],
+        concurrency,
+    )
+    draft_ids = [_.json()["id"] for _ in responses]
+
+    def generate(draft_id: str):
+        return lambda: client.post(
+            f"/document-types/{doc_id}/drafts/{draft_id}/generate"
+        )
+
+    generate_result, _ = await _measure(
+        f"generate/{suffix}", [generate(_) for _ in draft_ids], concurrency
+    )
+
+    def list_drafts():
+        return client.get(f"/document-types/{doc_id}/drafts/")
+
+    list_result, _ = await _measure(
+        f"list/{suffix}", [list_drafts] * config.requests, concurrency
+    )
+    return [upload_result, preprocess_result, generate_result, list_result]
+
+
+async def _create_doc_type(
+    client: AsyncClient, config: E2eBenchmarkConfig, sections: int
+) -> str:
+    template = {
+        "title": "Summary",
+        "template_md": "".join(
+            f"# Summary {ix + 1}\n\n" for ix in range(config.template_sections)
+        ),
+        "section_instructions": [
+            {
+                "section_id": [ix],
+                "source_sections": [
+                    {"doc_name": "source", "section_name": section_title(ix % sections)}
+                ],
+            }
+            for ix in range(config.template_sections)
+        ],
+    }
+    files = {"file": ("template.json", json.dumps(template), "application/json")}
+    response = await client.post("/files/upload/", files=files)
+    response = await client.post(
+        "/document-types/",
+        json={
+            "name": "Benchmark",
+            "sources": [{"name": "source", "description": "The source document"}],
+            "template_file_id": response.json()["id"],
+        },
+    )
+    return response.json()["id"]
+
+
+async def _measure(
+    name: str,
+    calls: list[Callable[[], Awaitable[Response]]],
+    concurrency: int,
+) -> tuple[BenchmarkResult, list[Response]]:
+    """Makes the calls with at most concurrency of them in flight.  Returns the result and the
+    responses in the order of the calls."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(call):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await call()
+            latencies.append(time.perf_counter() - start)
+            return response
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(timed(_) for _ in calls))
+    elapsed = time.perf_counter() - start
+    errors = [_ for _ in responses if _.status_code >= 400]
+    if errors:
+        logger.warning(
+            "%s had %d errors, the first was %d %s",
+            name,
+            len(errors),
+            errors[0].status_code,
+            errors[0].text,
+        )
+    return (
+        BenchmarkResult(
+            name=name,
+            metrics={
+                "throughput": len(calls) / elapsed,
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "errors": len(errors),
+            },
+        ),
+        responses,
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--quick", action="store_true", help="Run a small subset of the benchmarks"
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Save the results as the new baseline instead of comparing with it",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--output", type=Path, help="Also write the results here")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    # The provider limits don't apply to the fake LM.
+    configure_lm_limiter(
+        requests_per_minute=1e9, tokens_per_minute=1e12, max_concurrency=64
+    )
+    config = QUICK_CONFIG if args.quick else E2eBenchmarkConfig()
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = asyncio.run(run_e2e_benchmark(config, Path(work_dir)))
+    print(format_results(results))
+    if args.output:
+        save_baseline(args.output, results)
+    if args.update_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+    regressions = find_regressions(
+        results, load_baseline(args.baseline), args.tolerance
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
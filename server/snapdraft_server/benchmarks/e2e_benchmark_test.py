@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from snapdraft_server.benchmarks.e2e_benchmark import (
+    E2eBenchmarkConfig,
+    run_e2e_benchmark,
+)
+from snapdraft_server.benchmarks.results import BenchmarkResult, find_regressions
+
+
+async def test_run_e2e_benchmark(tmp_path: Path):
+    config = E2eBenchmarkConfig(
+        document_sections=[5], concurrency=[2], requests=2, lm_latency_seconds=0
+    )
+
+    results = await run_e2e_benchmark(config, tmp_path)
+
+    assert [_.name for _ in results] == [
+        "upload/sections=5/concurrency=2",
+        "preprocess/sections=5/concurrency=2",
+        "generate/sections=5/concurrency=2",
+        "list/sections=5/concurrency=2",
+    ]
+    assert all(_.metrics["errors"] == 0 for _ in results)
+
+
+def test_find_regressions():
+    baseline = {"generate": {"throughput": 10.0, "p95_ms": 100.0, "errors": 0}}
+    results = [
+        BenchmarkResult(
+            name="generate", metrics={"throughput": 9.0, "p95_ms": 150.0, "errors": 0}
+        ),
+        BenchmarkResult(name="list", metrics={"throughput": 1.0}),
+    ]
+
+    regressions = find_regressions(results, baseline, tolerance=0.25)
+
+    assert [(_.name, _.metric) for _ in regressions] == [("generate", "p95_ms")]
+    assert find_regressions(results, baseline, time_scale=1.5) == []
+    assert find_regressions(results, baseline, min_change_ms=60) == []
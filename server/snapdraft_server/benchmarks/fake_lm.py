@@ -0,0 +1,46 @@
+import threading
+import time
+
+from dspy.utils import DummyLM
+
+
+class FakeLM(DummyLM):
+    """A deterministic LM for benchmarks.  Answers every predictor the generator uses with fixed
+    text after a fixed latency, so the time spent outside the LM can be measured.
+
+    The predictor is recognized by its input fields in the prompt.  The reviser is checked first
+    because its prompt also has the authorer's context field."""
+
+    def __init__(self, latency_seconds: float = 0.0, markdown_words: int = 100):
+        markdown = " ".join(f"word{_ % 50}" for _ in range(markdown_words))
+        super().__init__(
+            {
+                "[[ ## previous_markdown ## ]]": {
+                    "reasoning": "Revised as requested.",
+                    "markdown": markdown,
+                    "explanation_of_changes": "Revised as requested.",
+                },
+                "[[ ## section_names ## ]]": {
+                    "reasoning": "No sections are affected.",
+                    "affected_section_names": [],
+                },
+                "[[ ## names ## ]]": {
+                    "reasoning": "Picked the first section.",
+                    "selected_name": "",
+                },
+                "[[ ## context ## ]]": {
+                    "reasoning": "Summarized the context.",
+                    "markdown": markdown,
+                },
+            }
+        )
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        # Calls are made from worker threads, so sleeping is like waiting on a real provider.
+        time.sleep(self.latency_seconds)
+        return super().forward(prompt=prompt, messages=messages, **kwargs)
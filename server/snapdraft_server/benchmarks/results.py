@@ -0,0 +1,104 @@
+"""Benchmark results and their comparison with stored baselines.
+
+Baselines are JSON files mapping each benchmark name to its metrics.  A metric regresses when it
+is worse than the baseline by more than the tolerance, a fraction of the baseline value.  Lower
+is better for every metric except those in HIGHER_IS_BETTER.
+
+Timings vary with the load on the machine, so they can be scaled by the ratio of a calibration
+run's time now to its time when the baseline was saved.  Metrics ending in _ms are timings.
+"""
+
+import json
+import math
+from pathlib import Path
+
+from pydantic import BaseModel
+
+HIGHER_IS_BETTER = {"throughput"}
+
+
+class BenchmarkResult(BaseModel):
+    name: str
+    metrics: dict[str, float]
+
+
+class Regression(BaseModel):
+    name: str
+    metric: str
+    baseline: float
+    value: float
+
+    @property
+    def change(self) -> float:
+        return self.value / self.baseline - 1 if self.baseline else math.inf
+
+    def __str__(self):
+        return f"{self.name} {self.metric}: {self.baseline:.4g} -> {self.value:.4g} ({self.change:+.0%})"
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest rank percentile, p is between 0 and 1."""
+    ordered = sorted(values)
+    return ordered[min(max(math.ceil(p * len(ordered)) - 1, 0), len(ordered) - 1)]
+
+
+def load_baseline(path: Path) -> dict[str, dict[str, float]]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_baseline(path: Path, results: list[BenchmarkResult]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps({_.name: _.metrics for _ in results}, indent=2, sort_keys=True)
+        + "\n"
+    )
+
+
+def find_regressions(
+    results: list[BenchmarkResult],
+    baseline: dict[str, dict[str, float]],
+    tolerance: float = 0.25,
+    time_scale: float = 1.0,
+    min_change_ms: float = 0.0,
+) -> list[Regression]:
+    """Compares the results with the baseline.  Benchmarks and metrics that aren't in the
+    baseline are skipped.  Baseline timings are multiplied by time_scale first, and timings that
+    changed by less than min_change_ms are within the noise, so they never regress."""
+    ret = []
+    for result in results:
+        for metric, value in result.metrics.items():
+            expected = baseline.get(result.name, {}).get(metric)
+            if expected is None:
+                continue
+            if metric.endswith("_ms"):
+                expected *= time_scale
+                if abs(value - expected) < min_change_ms:
+                    continue
+            if metric in HIGHER_IS_BETTER:
+                regressed = value < expected * (1 - tolerance)
+            else:
+                regressed = value > expected * (1 + tolerance)
+            if regressed:
+                ret.append(
+                    Regression(
+                        name=result.name, metric=metric, baseline=expected, value=value
+                    )
+                )
+    return ret
+
+
+def format_results(results: list[BenchmarkResult]) -> str:
+    metrics = list(dict.fromkeys(m for _ in results for m in _.metrics))
+    width = max([len(_.name) for _ in results] + [9])
+    lines = [f"{'benchmark':<{width}}" + "".join(f"{m:>14}" for m in metrics)]
+    for result in results:
+        lines.append(
+            f"{result.name:<{width}}"
+            + "".join(
+                f"{result.metrics[m]:>14.4g}" if m in result.metrics else " " * 14
+                for m in metrics
+            )
+        )
+    return "\n".join(lines)
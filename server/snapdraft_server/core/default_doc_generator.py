@@ -1,24 +1,40 @@
-import copy
+import functools
 import logging
+import re
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from tempfile import NamedTemporaryFile
+from typing import Callable, Literal
 
 import dspy
-import pymupdf4llm
+from dspy.evaluate.metrics import f1_score
 from pydantic import BaseModel, Field
 
-from snapdraft_server.core.doc_generator import DocGenerator, SourceFile, GeneratedDoc
-from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.doc_generator import (
+    DocGenerator,
+    SourceFile,
+    GeneratedDoc,
+    TrainingExample,
+    TrainingConfig,
+)
+from snapdraft_server.core.doc_section import DocSection, SectionTree
 from snapdraft_server.core.doc_template import (
     DocTemplate,
+    SectionAuthorer,
     SourceReference,
     SourceContext,
     SectionInstructions,
 )
+from snapdraft_server.core.docx_converter import convert_docx_to_markdown
+from snapdraft_server.core.lm_limiter import call_predictor
+from snapdraft_server.core.pdf_converter import convert_pdf_to_markdown
+from snapdraft_server.core.section_index import SectionIndex
+from snapdraft_server.core.token_budget import fit_to_budget, get_token_counter
+from snapdraft_server.core.tracing import span
 from snapdraft_server.dspy_helpers.typed_predictor_signature import (
     TypedPredictorSignature,
 )
+from snapdraft_server.logging_setup import Truncated
 
 logger = logging.getLogger(__name__)
 
@@ -31,29 +47,239 @@ class SectionSelector(BaseModel):
     class Output(BaseModel):
         selected_name: str
 
-    def select(self, section_title: str, names: list[str]) -> str:
+    @staticmethod
+    def create_predictor() -> dspy.Module:
         signature = TypedPredictorSignature.create(
             SectionSelector.Input, SectionSelector.Output
         )
-        cot = dspy.ChainOfThought(signature)
-        return cot(section_title=section_title, names=names).selected_name
+        return dspy.ChainOfThought(signature)
+
+    def select(
+        self,
+        section_title: str,
+        names: list[str],
+        predictor: dspy.Module | None = None,
+    ) -> str:
+        cot = predictor or self.create_predictor()
+        return call_predictor(
+            cot, section_title=section_title, names=names
+        ).selected_name
+
+
+class AffectedSectionSelector(BaseModel):
+    """Picks out the sections of a document that a user's change request applies to."""
+
+    class Input(BaseModel):
+        user_prompt: str
+        section_names: list[str]
+
+    class Output(BaseModel):
+        affected_section_names: list[str]
+
+    @staticmethod
+    def create_predictor() -> dspy.Module:
+        signature = TypedPredictorSignature.create(
+            AffectedSectionSelector.Input, AffectedSectionSelector.Output
+        )
+        return dspy.ChainOfThought(signature)
+
+    def select(self, user_prompt: str, section_names: list[str]) -> list[str]:
+        cot = self.create_predictor()
+        return call_predictor(
+            cot, user_prompt=user_prompt, section_names=section_names
+        ).affected_section_names
+
+
+class SectionReviser(BaseModel):
+    """Updates a previously generated section according to the user's prompt."""
+
+    class Input(BaseModel):
+        context: list[SourceContext]
+        previous_markdown: str
+        user_prompt: str
+
+    class Output(BaseModel):
+        markdown: str
+        explanation_of_changes: str
+
+    @staticmethod
+    def create_predictor() -> dspy.Module:
+        signature = TypedPredictorSignature.create(
+            SectionReviser.Input, SectionReviser.Output
+        )
+        return dspy.ChainOfThought(signature)
+
+    def revise(
+        self,
+        context: list[SourceContext],
+        previous_markdown: str,
+        user_prompt: str,
+    ) -> Output:
+        cot = self.create_predictor()
+        result = call_predictor(
+            cot,
+            context=context,
+            previous_markdown=previous_markdown,
+            user_prompt=user_prompt,
+        )
+        return SectionReviser.Output(
+            markdown=result.markdown,
+            explanation_of_changes=result.explanation_of_changes,
+        )
+
+
+class DocGenerationProgram(dspy.Module):
+    """The trainable DSPy program for the DefaultDocGenerator.  Holds the predictors used by the
+    SectionSelector and SectionAuthorer so that their state can be saved.  Only the authorer is
+    trained, see AuthorerTrainingProgram.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.selector = SectionSelector.create_predictor()
+        self.authorer = SectionAuthorer.create_predictor()
+
+
+class AuthorerTrainingProgram(dspy.Module):
+    """The part of the DocGenerationProgram that is compiled.  The selector isn't, since the
+    completed drafts used for training don't record which source section each section was
+    written from, so there are no examples to compile it with."""
+
+    def __init__(self, authorer: dspy.Module):
+        super().__init__()
+        self.authorer = authorer
+
+    def forward(self, context: list[SourceContext]):
+        return call_predictor(self.authorer, context=context)
+
+
+class GeneratedSectionText(BaseModel):
+    markdown: str
+    explanation_of_changes: str
+    context_tokens: int
+
+
+def section_match_metric(example: dspy.Example, prediction, trace=None) -> float:
+    """Scores a generated section by its token overlap with the section of the final draft."""
+    return f1_score(prediction.markdown, example.markdown)
 
 
 class DefaultDocGenerator(BaseModel):
     section_selector: SectionSelector = Field(default_factory=SectionSelector)
+    affected_section_selector: AffectedSectionSelector = Field(
+        default_factory=AffectedSectionSelector
+    )
+    section_reviser: SectionReviser = Field(default_factory=SectionReviser)
+    context_token_budget: int = 32000
+    """Maximum number of tokens of source material included in the context for a section."""
+    retrieval_top_k: int = 3
+    """Number of source sections retrieved from a source's index for each named section."""
+    pdf_pages_per_chunk: int = 8
+    """Number of PDF pages converted together by each worker process."""
+    docx_converter: Literal["python", "pandoc"] = "python"
+    """Converts DOCX files in process, or with pandoc.  The generator version depends on this,
+    so files preprocessed with one converter aren't reused by the other."""
 
     def get_version(self):
-        return "0.0.3"
+        return "0.0.4" if self.docx_converter == "python" else "0.0.3"
+
+    def create_program(self) -> DocGenerationProgram:
+        return DocGenerationProgram()
+
+    def train(
+        self,
+        doc_template: DocTemplate,
+        examples: list[TrainingExample],
+        config: TrainingConfig,
+        on_progress: Callable[[float], None] | None = None,
+    ) -> DocGenerationProgram:
+        """Compiles few-shot demos for the authorer of the generation program from completed
+        drafts.  Each section with instructions in the template becomes a separate training
+        example, with its context cut to config.demo_context_token_budget.
+        """
+        on_progress = on_progress or (lambda _: None)
+        program = self.create_program()
+        trainset = self._create_trainset(
+            doc_template, examples, program, config, on_progress
+        )
+        if not trainset:
+            raise ValueError(
+                "None of the training drafts had sections matching the template."
+            )
+        optimizer = dspy.BootstrapFewShot(
+            metric=section_match_metric,
+            metric_threshold=config.metric_threshold,
+            max_bootstrapped_demos=config.max_bootstrapped_demos,
+            max_labeled_demos=config.max_labeled_demos,
+        )
+        compiled = optimizer.compile(
+            AuthorerTrainingProgram(program.authorer), trainset=trainset
+        )
+        program.authorer = compiled.authorer
+        on_progress(1.0)
+        return program
+
+    def _create_trainset(
+        self,
+        doc_template: DocTemplate,
+        examples: list[TrainingExample],
+        program: DocGenerationProgram,
+        config: TrainingConfig,
+        on_progress: Callable[[float], None],
+    ) -> list[dspy.Example]:
+        """Builds the context for each templated section of each example.  Selecting source
+        sections calls the LM, so the examples are processed in parallel, bounded by
+        config.num_threads.  Reports progress up to half way, the rest is for compilation.
+        """
+
+        def create_examples(example: TrainingExample) -> list[dspy.Example]:
+            output_doc = DocSection.parse_markdown(
+                doc_template.title, example.output_markdown
+            )
+            ret = []
+            for si in doc_template.section_instructions:
+                title_path = doc_template.parsed_doc.get_title_path(si.section_id)
+                target = output_doc._find_section_by_name_parts(title_path)
+                if target is None:
+                    logger.debug("Training output has no section %s", title_path)
+                    continue
+                context = self._create_context(
+                    si.source_sections,
+                    example.sources,
+                    program,
+                    token_budget=config.demo_context_token_budget,
+                )
+                ret.append(
+                    dspy.Example(
+                        context=context, markdown=target.intro_text
+                    ).with_inputs("context")
+                )
+            return ret
+
+        trainset = []
+        with ThreadPoolExecutor(max_workers=config.num_threads) as executor:
+            for ix, section_examples in enumerate(
+                executor.map(create_examples, examples)
+            ):
+                trainset.extend(section_examples)
+                on_progress(0.5 * (ix + 1) / len(examples))
+        return trainset
 
     def parse_source_file(self, source_file: SourceFile) -> DocSection:
         extension = Path(source_file.original_filename).suffix
         match extension:
+            case ".docx" if self.docx_converter == "python":
+                markdown = convert_docx_to_markdown(source_file.path)
             case ".docx":
                 markdown = self._pandoc_convert_to_markdown(
                     source_file.path, extension[1:]
                 )
             case ".pdf":
-                markdown = pymupdf4llm.to_markdown(source_file.path)
+                markdown = convert_pdf_to_markdown(
+                    source_file.path,
+                    cache_dir=source_file.cache_dir,
+                    pages_per_chunk=self.pdf_pages_per_chunk,
+                )
             case _:
                 raise ValueError(f"File type `{extension}` is currently unsupported")
         return DocSection.parse_markdown(source_file.name, markdown)
@@ -61,75 +287,271 @@ class DefaultDocGenerator(BaseModel):
     def generate(
         self,
         doc_template: DocTemplate,
-        source_files: dict[str, DocSection],
+        source_files: dict[str, SectionTree],
         previous_version: str | None = None,
         user_prompt: str | None = None,
+        program: DocGenerationProgram | None = None,
+        changed_sources: list[str] | None = None,
+        source_indexes: dict[str, SectionIndex] | None = None,
     ):
         """Main method for the doc generator.  Generates an entirely new file from the source
-        docs."""
-        new_doc = copy.deepcopy(doc_template.parsed_doc)
+        docs, unless there is a previous version to update."""
+        source_indexes = source_indexes or {}
+        if previous_version is not None and (
+            user_prompt or changed_sources is not None
+        ):
+            previous_doc = DocSection.parse_markdown(
+                doc_template.title, previous_version
+            )
+            if self._has_template_sections(doc_template, previous_doc):
+                return self._update(
+                    doc_template,
+                    source_files,
+                    previous_doc,
+                    user_prompt,
+                    changed_sources or [],
+                    program,
+                    source_indexes,
+                )
+            logger.info(
+                "Previous version is missing sections from the template.  Regenerating all."
+            )
+        new_doc = doc_template.parsed_doc
+        context_tokens = {}
         for si in doc_template.section_instructions:
-            section_text = self._generate_section(
-                si, source_files, previous_version, user_prompt
+            name = self._section_name(doc_template, si)
+            with span("generate_section", section=name):
+                section = self._generate_section(
+                    si, source_files, program=program, source_indexes=source_indexes
+                )
+            new_doc = new_doc.with_intro_text(si.section_id, section.markdown)
+            context_tokens[name] = section.context_tokens
+        with span("as_markdown"):
+            new_markdown = new_doc.as_markdown()
+        logger.debug("Generated %s", Truncated(new_markdown))
+        return GeneratedDoc(
+            markdown=new_markdown,
+            explanation_of_changes="",
+            context_tokens=context_tokens,
+        )
+
+    def _update(
+        self,
+        doc_template: DocTemplate,
+        source_files: dict[str, SectionTree],
+        previous_doc: DocSection,
+        user_prompt: str | None,
+        changed_sources: list[str],
+        program: DocGenerationProgram | None,
+        source_indexes: dict[str, SectionIndex],
+    ) -> GeneratedDoc:
+        """Regenerates only the sections affected by the user prompt or by changes to their
+        sources.  All other sections of the previous version are kept as they are."""
+        title_paths = {
+            tuple(si.section_id): doc_template.parsed_doc.get_title_path(si.section_id)
+            for si in doc_template.section_instructions
+        }
+        names = {
+            tuple(si.section_id): self._section_name(doc_template, si)
+            for si in doc_template.section_instructions
+        }
+        prompted = set()
+        if user_prompt:
+            selected = self.affected_section_selector.select(
+                user_prompt, list(names.values())
+            )
+            prompted = {k for k, name in names.items() if name in selected}
+            logger.debug("Prompt affects sections %s", selected)
+
+        new_doc = previous_doc
+        explanations = []
+        context_tokens = {}
+        for si in doc_template.section_instructions:
+            key = tuple(si.section_id)
+            sources_changed = any(
+                ref.doc_name in changed_sources for ref in si.source_sections
             )
-            section = new_doc.find_section_by_id(si.section_id)
-            section.intro_text = section_text
-        new_markdown = new_doc.as_markdown()
-        logger.info(f"Generated:\n{new_markdown}")
-        return GeneratedDoc(markdown=new_markdown, explanation_of_changes="")
+            if key not in prompted and not sources_changed:
+                continue
+            previous_id = previous_doc.get_section_id(title_paths[key])
+            previous_markdown = previous_doc.find_section_by_id(previous_id).intro_text
+            with span("generate_section", section=names[key]):
+                section = self._generate_section(
+                    si,
+                    source_files,
+                    previous_markdown if key in prompted else None,
+                    user_prompt if key in prompted else None,
+                    program,
+                    source_indexes,
+                )
+            new_doc = new_doc.with_intro_text(previous_id, section.markdown)
+            explanations.append(f"{names[key]}: {section.explanation_of_changes}")
+            context_tokens[names[key]] = section.context_tokens
+        with span("as_markdown"):
+            new_markdown = new_doc.as_markdown()
+        return GeneratedDoc(
+            markdown=new_markdown,
+            explanation_of_changes=(
+                "\n".join(explanations) if explanations else "No sections changed."
+            ),
+            context_tokens=context_tokens,
+        )
+
+    @staticmethod
+    def _section_name(doc_template: DocTemplate, si: SectionInstructions) -> str:
+        return "\\".join(doc_template.parsed_doc.get_title_path(si.section_id))
+
+    @staticmethod
+    def _has_template_sections(doc_template: DocTemplate, doc: DocSection) -> bool:
+        return all(
+            doc.get_section_id(doc_template.parsed_doc.get_title_path(si.section_id))
+            is not None
+            for si in doc_template.section_instructions
+        )
 
     def _generate_section(
         self,
         section_instructions: SectionInstructions,
         source_files: dict[str, BaseModel],
-        previous_version: str | None,
-        user_prompt: str | None,
-    ):
+        previous_markdown: str | None = None,
+        user_prompt: str | None = None,
+        program: DocGenerationProgram | None = None,
+        source_indexes: dict[str, SectionIndex] | None = None,
+    ) -> GeneratedSectionText:
         """Generates a new version of this document section.
         Can do de novo generation using just the source files, or can do updates by taking in a
-        user_prompt and/or a previous version."""
-        # assert (
-        #     previous_version is None and user_prompt is None
-        # ), "Need to implement updates."
-        context = self._create_context(
-            section_instructions.source_sections, source_files
+        user_prompt and the previous version of the section."""
+        with span("create_context") as current_span:
+            context = self._create_context(
+                section_instructions.source_sections,
+                source_files,
+                program,
+                source_indexes,
+            )
+            context_tokens = sum(_.token_count for _ in context)
+            current_span.set_attribute("tokens", context_tokens)
+        if previous_markdown is not None and user_prompt:
+            result = self.section_reviser.revise(
+                context, previous_markdown, user_prompt
+            )
+            return GeneratedSectionText(
+                markdown=result.markdown + "\n",
+                explanation_of_changes=result.explanation_of_changes,
+                context_tokens=context_tokens,
+            )
+        result = section_instructions.authorer.generate(
+            context, predictor=program.authorer if program else None
+        )
+        return GeneratedSectionText(
+            markdown=result + "\n",
+            explanation_of_changes="Regenerated from the updated sources.",
+            context_tokens=context_tokens,
         )
-        result = section_instructions.authorer.generate(context)
-        return result + "\n"
 
     def _create_context(
         self,
         source_sections: list[SourceReference],
-        source_files: dict[str, DocSection],
+        source_files: dict[str, SectionTree],
+        program: DocGenerationProgram | None = None,
+        source_indexes: dict[str, SectionIndex] | None = None,
+        token_budget: int | None = None,
     ) -> list[SourceContext]:
-        """Pulls the relevant sections from the source files to create the context string."""
-        ret = []
+        """Pulls the relevant sections from the source files to create the context string.
+
+        Named sections are looked up in the source's index if there is one, with each match
+        included with its subsections.  If there's no index, or nothing in it matches the name,
+        the SectionSelector picks the section.
+
+        The context is kept within the token_budget, or the context_token_budget.  Named sections have priority over
+        whole documents, and each source gets an equal share of the budget that's left when its
+        turn comes, so any unused budget passes on to the sources after it.  Sources that don't
+        fit are truncated."""
+        source_indexes = source_indexes or {}
+        selected = []
         for reference in source_sections:
             source_file = source_files[reference.doc_name]
+            index = source_indexes.get(reference.doc_name)
+            section_ids = []
+            if reference.section_name is not None and index is not None:
+                section_ids = self._retrieve_sections(index, reference.section_name)
             if reference.section_name is None:
-                source_section = source_file
+                selected.append((reference, None, source_file))
+            elif section_ids:
+                # Overlapping matches were skipped, so no text is included twice.
+                for section_id in section_ids:
+                    selected.append(
+                        (
+                            reference,
+                            "\\".join(source_file.get_title_path(section_id)),
+                            source_file.find_section_by_id(section_id),
+                        )
+                    )
             else:
                 source_section = self._find_source_section(
-                    source_file, reference.section_name
-                )
-            markdown = source_section.as_markdown()
-            ret.append(
-                SourceContext(
-                    source_file_name=reference.doc_name,
-                    section_title=reference.section_name,
-                    markdown=markdown,
+                    source_file, reference.section_name, program
                 )
+                selected.append((reference, reference.section_name, source_section))
+
+        counter = get_token_counter()
+        priority_order = sorted(
+            range(len(selected)), key=lambda ix: selected[ix][0].section_name is None
+        )
+        remaining = self.context_token_budget if token_budget is None else token_budget
+        ret = [None] * len(selected)
+        for n, ix in enumerate(priority_order):
+            reference, section_title, source_section = selected[ix]
+            share = remaining // (len(selected) - n)
+            markdown, tokens = fit_to_budget(source_section, share, counter)
+            remaining -= tokens
+            logger.debug(
+                "Context from %s/%s used %d tokens",
+                reference.doc_name,
+                section_title,
+                tokens,
+            )
+            ret[ix] = SourceContext(
+                source_file_name=reference.doc_name,
+                section_title=section_title,
+                markdown=markdown,
+                token_count=tokens,
+            )
+        return ret
+
+    def _retrieve_sections(self, index: SectionIndex, query: str) -> list[list[int]]:
+        """Returns the ids of the top sections for the query.  Sections nested in, or containing,
+        a better match are skipped so the same text isn't included twice."""
+        ret = []
+        for section_id, _ in index.search(query, len(index.sections)):
+            overlaps = any(
+                section_id[: len(_)] == _ or _[: len(section_id)] == section_id
+                for _ in ret
             )
+            if not overlaps:
+                ret.append(section_id)
+                if len(ret) == self.retrieval_top_k:
+                    break
+        logger.debug("Retrieved sections %s for %s", ret, Truncated(query))
         return ret
 
-    def _find_source_section(self, source_file: DocSection, section_title: str):
+    def _find_source_section(
+        self,
+        source_file: SectionTree,
+        section_title: str,
+        program: DocGenerationProgram | None = None,
+    ):
         """Finds the section of the source document that best corresponds with the section title."""
-        names = source_file.get_section_names()
+        with span("get_section_names"):
+            names = source_file.get_section_names()
         selected_section = self.section_selector.select(
-            section_title=section_title, names=names
+            section_title=section_title,
+            names=names,
+            predictor=program.selector if program else None,
         )
         logger.debug(
-            f"Selected section {selected_section} for {section_title} from {names}"
+            "Selected section %s for %s from %s",
+            selected_section,
+            section_title,
+            Truncated(names),
         )
         ret = source_file.find_section_by_name(selected_section)
         return ret
@@ -137,21 +559,35 @@ class DefaultDocGenerator(BaseModel):
     @staticmethod
     def _pandoc_convert_to_markdown(input_file: Path, file_type: str):
         """
-        Converts a DOCX file to Markdown format using Pandoc.
+        Converts a DOCX file to Markdown format using Pandoc.  The output is read from stdout.
+        Pandoc 2.11.2 replaced --atx-headers with --markdown-headings=atx, so the option is
+        picked by the installed version.
         """
-        with NamedTemporaryFile() as output_file:
-            command = [
-                "pandoc",
-                "-f",
-                file_type,
-                "-t",
-                "markdown",
-                "--atx-headers",
-                input_file,
-                "-o",
-                output_file.name,
-            ]
-            subprocess.run(command, check=True)
-            with open(output_file.name, "rt") as f:
-                markdown = f.read()
-                return markdown
+        if _pandoc_version() < (2, 11, 2):
+            headings_option = "--atx-headers"
+        else:
+            headings_option = "--markdown-headings=atx"
+        command = [
+            "pandoc",
+            "-f",
+            file_type,
+            "-t",
+            "markdown",
+            headings_option,
+            input_file,
+        ]
+        result = subprocess.run(
+            command, check=True, capture_output=True, encoding="utf-8"
+        )
+        return result.stdout
+
+
+@functools.cache
+def _pandoc_version() -> tuple[int, ...]:
+    result = subprocess.run(
+        ["pandoc", "--version"], check=True, capture_output=True, encoding="utf-8"
+    )
+    match = re.match(r"pandoc(?:\.exe)? (\d+(?:\.\d+)*)", result.stdout)
+    if match is None:
+        raise ValueError(f"Unexpected pandoc version: {result.stdout}")
+    return tuple(int(_) for _ in match[1].split("."))
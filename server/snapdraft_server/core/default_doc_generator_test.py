@@ -1,11 +1,21 @@
 import os
 
 import dspy
+from dspy.utils import DummyLM
 
 from snapdraft_server.core.default_doc_generator import DefaultDocGenerator
-from snapdraft_server.core.doc_generator import DocGenerator
+from snapdraft_server.core.doc_generator import (
+    DocGenerator,
+    TrainingExample,
+    TrainingConfig,
+)
 from snapdraft_server.core.doc_section import DocSection
-from snapdraft_server.core.doc_template import DocTemplate, SectionInstructions
+from snapdraft_server.core.doc_template import (
+    DocTemplate,
+    SectionInstructions,
+    SourceReference,
+)
+from snapdraft_server.core.section_index import SectionIndex
 
 
 def get_basedir() -> str:
@@ -95,3 +105,125 @@ It was a 5
     generated = result.as_markdown()
     assert "An autogenerated movie review" in generated
     assert "## Average Rating" in generated
+
+
+def test_train_compiles_demos_from_examples():
+    template = DocTemplate(
+        title="Summary",
+        template_md="""
+# Findings
+""",
+        section_instructions=[
+            SectionInstructions(
+                section_id=[0],
+                source_sections=[SourceReference(doc_name="Report")],
+            ),
+        ],
+    )
+    examples = [
+        TrainingExample(
+            sources={
+                "Report": DocSection.parse_markdown("Report", f"Result {ix} found\n")
+            },
+            output_markdown=f"# Findings\nResult {ix} found\n",
+        )
+        for ix in range(3)
+    ]
+    lm = DummyLM([{"reasoning": "r", "markdown": "Result found"}] * 10)
+    progress = []
+    with dspy.context(lm=lm):
+        program = DefaultDocGenerator().train(
+            template, examples, TrainingConfig(num_threads=2), progress.append
+        )
+
+    assert len(program.authorer.predict.demos) == 2
+    assert program.selector.predict.demos == []
+    assert progress[-1] == 1.0
+    state = DefaultDocGenerator().create_program()
+    state.load_state(program.dump_state())
+    assert len(state.authorer.predict.demos) == 2
+
+
+def test_generate_only_revises_sections_affected_by_prompt():
+    template = DocTemplate(
+        title="Summary",
+        template_md="""
+# Findings
+
+# Conclusion
+""",
+        section_instructions=[
+            SectionInstructions(
+                section_id=[0], source_sections=[SourceReference(doc_name="Report")]
+            ),
+            SectionInstructions(
+                section_id=[1], source_sections=[SourceReference(doc_name="Report")]
+            ),
+        ],
+    )
+    source_files = {"Report": DocSection.parse_markdown("Report", "Result found\n")}
+    previous_version = """
+# Findings
+Old findings
+# Conclusion
+Old conclusion
+"""
+    lm = DummyLM(
+        [
+            {"reasoning": "r", "affected_section_names": '["Conclusion"]'},
+            {
+                "reasoning": "r",
+                "markdown": "New conclusion",
+                "explanation_of_changes": "Made it shorter",
+            },
+        ]
+    )
+    with dspy.context(lm=lm):
+        result = DefaultDocGenerator().generate(
+            template,
+            source_files,
+            previous_version=previous_version,
+            user_prompt="Shorten the conclusion",
+        )
+
+    assert "Old findings" in result.markdown
+    assert "New conclusion" in result.markdown
+    assert "Old conclusion" not in result.markdown
+    assert result.explanation_of_changes == "Conclusion: Made it shorter"
+
+
+report = DocSection.parse_markdown(
+    "Report",
+    """# Methods
+Samples were taken.
+# Results
+## Efficacy
+The drug worked.
+## Safety
+No adverse events.
+""",
+)
+
+
+def test_context_includes_subsections_of_matched_section():
+    context = DefaultDocGenerator()._create_context(
+        [SourceReference(doc_name="Report", section_name="Results")],
+        {"Report": report},
+        source_indexes={"Report": SectionIndex.build(report)},
+    )
+
+    assert [_.section_title for _ in context] == ["Results"]
+    assert "The drug worked." in context[0].markdown
+    assert "No adverse events." in context[0].markdown
+
+
+def test_context_falls_back_to_selector_without_matches():
+    lm = DummyLM([{"reasoning": "r", "selected_name": "Methods"}])
+    with dspy.context(lm=lm):
+        context = DefaultDocGenerator()._create_context(
+            [SourceReference(doc_name="Report", section_name="Sampling approach")],
+            {"Report": report},
+            source_indexes={"Report": SectionIndex.build(report)},
+        )
+
+    assert [_.markdown for _ in context] == ["Samples were taken.\n"]
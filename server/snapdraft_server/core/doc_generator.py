@@ -1,11 +1,13 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Protocol
+from typing import Protocol, Callable
 
-from pydantic import BaseModel
+import dspy
+from pydantic import BaseModel, Field
 
-from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.doc_section import DocSection, SectionTree
+from snapdraft_server.core.section_index import SectionIndex
 from snapdraft_server.core.doc_template import (
     DocTemplate,
 )
@@ -15,11 +17,37 @@ class SourceFile(BaseModel):
     name: str
     original_filename: str
     path: Path
+    cache_dir: Path | None = None
+    """A directory the generator can use to cache intermediate results of the conversion."""
 
 
 class GeneratedDoc(BaseModel):
     markdown: str
     explanation_of_changes: str
+    context_tokens: dict[str, int] = Field(default_factory=dict)
+    """The number of context tokens used to generate each section, keyed by section name."""
+
+
+class TrainingExample(BaseModel):
+    """A completed draft used to train a generator."""
+
+    sources: dict[str, DocSection]
+    """The preprocessed source files, keyed by source name."""
+    output_markdown: str
+    """The final version of the document written for these sources."""
+
+
+class TrainingConfig(BaseModel):
+    max_bootstrapped_demos: int = Field(default=2, ge=0, le=4)
+    max_labeled_demos: int = Field(default=2, ge=0, le=4)
+    """The demos are sent with every generation call, so there are only a few of them."""
+    demo_context_token_budget: int = Field(default=2000, gt=0)
+    """Token budget of the context of each demo, which is much smaller than when generating
+    to keep the compiled prompts small."""
+    metric_threshold: float = 0.5
+    """Minimum score for a bootstrapped demo to be kept."""
+    num_threads: int = Field(default=4, ge=1)
+    """Maximum number of LM calls made in parallel while preparing the training set."""
 
 
 class DocGenerator(Protocol):
@@ -44,9 +72,38 @@ class DocGenerator(Protocol):
     def generate(
         self,
         doc_template: DocTemplate,
-        source_files: dict[str, DocSection],
+        source_files: dict[str, SectionTree],
         previous_version: str | None = None,
         user_prompt: str | None = None,
+        program: dspy.Module | None = None,
+        changed_sources: list[str] | None = None,
+        source_indexes: dict[str, SectionIndex] | None = None,
     ) -> GeneratedDoc:
-        """Generates a new document"""
+        """Generates a new document.  If a trained program (from train) is passed in, it is used
+        instead of the untrained defaults.
+
+        If the previous version is passed in along with a user prompt or the names of the sources
+        that changed since it was generated, only the sections they affect are regenerated.
+
+        source_indexes are the indexes built for the source files when they were preprocessed.
+        If present they are used to look up source sections.
+        """
+        ...
+
+    def create_program(self) -> dspy.Module:
+        """Creates an untrained version of the DSPy program used by this generator.  Used to load
+        the state of trained models."""
+        ...
+
+    def train(
+        self,
+        doc_template: DocTemplate,
+        examples: list[TrainingExample],
+        config: TrainingConfig,
+        on_progress: Callable[[float], None] | None = None,
+    ) -> dspy.Module:
+        """Optimizes the generator's DSPy program using completed drafts.
+
+        on_progress is called with the fraction of the training that has been completed.
+        """
         ...
@@ -2,28 +2,17 @@ from __future__ import annotations
 
 import logging
 import re
+from typing import Iterator
 
 from pydantic import BaseModel, model_validator, field_validator
 
 logger = logging.getLogger(__name__)
 
 
-class DocSection(BaseModel):
-    title: str
-    """The header for this section (or the title of the document for the root section)"""
-    intro_text: str
-    """The text that appears before the first section identifier"""
-    subsections: list[DocSection]
-    """A list of child sections."""
-
-    @field_validator("subsections", mode="after")
-    @classmethod
-    def validate_unique_subsection_titles(cls, subsections):
-        """Ensure subsection titles are unique."""
-        titles = [section.title for section in subsections]
-        if len(titles) != len(set(titles)):
-            raise ValueError(f"Subsections of didn't have unique titles. {titles}")
-        return subsections
+class SectionTree:
+    """The read methods of a document's tree of sections, shared by DocSection and
+    DocSectionView.  They only use the title, intro_text and subsections of each section, which
+    the classes provide."""
 
     def get_section_names(self):
         """Returns the names of the sections in this document.  Each name is fully qualified, it
@@ -41,6 +30,26 @@ class DocSection(BaseModel):
         else:
             return self
 
+    def get_title_path(self, section_id: list[int]) -> list[str]:
+        """Returns the titles of each section on the way down to the section with this id."""
+        if section_id:
+            subsection = self.subsections[section_id[0]]
+            return [subsection.title, *subsection.get_title_path(section_id[1:])]
+        else:
+            return []
+
+    def get_section_id(self, title_path: list[str]) -> list[int] | None:
+        """Returns the id of the section with these titles, the inverse of get_title_path.  Returns
+        None if there is no such section."""
+        if title_path:
+            for ix, s in enumerate(self.subsections):
+                if s.title == title_path[0]:
+                    section_id = s.get_section_id(title_path[1:])
+                    return None if section_id is None else [ix, *section_id]
+            return None
+        else:
+            return []
+
     def find_section_by_name(self, name: str):
         """Finds a section using a backslash separated version of the name."""
         return self._find_section_by_name_parts(name.split("\\"))
@@ -67,7 +76,6 @@ class DocSection(BaseModel):
     def _recurse_ids(self, current_list: list[int]) -> list[list[int]]:
         """Returns the names of the sections in this document.  Each name is fully qualified, it
         returns the names of all the parent sections, separated by backslashes."""
-        logger.info(f"{self.title}, {current_list}")
         return [
             current_list,
             *(
@@ -77,15 +85,57 @@ class DocSection(BaseModel):
             ),
         ]
 
-    def as_markdown(self, level=0) -> str:
-        """Returns this section (and subsections) formatted as a markdown string."""
+    def walk(self, level=0) -> Iterator[tuple[int, SectionTree]]:
+        """Yields this section and all its subsections, in document order, with their levels."""
+        yield level, self
+        for ss in self.subsections:
+            yield from ss.walk(level + 1)
+
+    def heading(self, level: int) -> str:
+        """Returns the markdown header line for this section at the given level."""
         if level == 0 or not self.title:
-            title = ""
+            return ""
         else:
-            title = f"{'#'*level} {self.title}\n"
+            return f"{'#'*level} {self.title}\n"
+
+    def as_markdown(self, level=0) -> str:
+        """Returns this section (and subsections) formatted as a markdown string."""
+        title = self.heading(level)
         subsections = "".join(_.as_markdown(level + 1) for _ in self.subsections)
         return f"{title}{self.intro_text}{subsections}"
 
+
+class DocSection(SectionTree, BaseModel):
+    title: str
+    """The header for this section (or the title of the document for the root section)"""
+    intro_text: str
+    """The text that appears before the first section identifier"""
+    subsections: list[DocSection]
+    """A list of child sections."""
+
+    @field_validator("subsections", mode="after")
+    @classmethod
+    def validate_unique_subsection_titles(cls, subsections):
+        """Ensure subsection titles are unique."""
+        titles = [section.title for section in subsections]
+        if len(titles) != len(set(titles)):
+            raise ValueError(f"Subsections of didn't have unique titles. {titles}")
+        return subsections
+
+    def with_intro_text(self, section_id: list[int], intro_text: str) -> DocSection:
+        """Returns a copy of this document with the intro text of one section replaced.  Only the
+        sections on the path to the replaced section are copied, the rest are shared with this
+        document, so neither should be modified in place afterward."""
+        if section_id:
+            ix = section_id[0]
+            subsections = list(self.subsections)
+            subsections[ix] = subsections[ix].with_intro_text(
+                section_id[1:], intro_text
+            )
+            return self.model_copy(update={"subsections": subsections})
+        else:
+            return self.model_copy(update={"intro_text": intro_text})
+
     @staticmethod
     def parse_markdown(title: str, md: str) -> "DocSection":
         # Split the markdown into lines
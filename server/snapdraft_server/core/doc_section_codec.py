@@ -0,0 +1,149 @@
+"""Compact binary format for caching preprocessed DocSection trees.
+
+The layout is:
+
+    magic (4 bytes) | version (uint16) | header length (uint32) | header (JSON) | text
+
+The sections are stored as flat arrays in document order (a pre-order walk of the tree).  The
+header holds each section's title and the size of its subtree (itself plus all descendants).  The
+text is the document rendered by as_markdown, in UTF-8, and the header holds the byte offsets of
+each section's heading and of its intro text in it.  A section's intro text runs from its intro
+offset to the next section's heading, and its subtree from its heading to the heading of the
+section after the subtree.  So the whole document can be sent as is, and a single section or
+subtree can be read without building the rest of the document.
+
+Version 1 files, which are still read, hold only the concatenated intro texts and their offsets
+in "text_offsets".
+"""
+
+import json
+import struct
+from typing import Callable
+
+from snapdraft_server.core.doc_section import DocSection
+
+MAGIC = b"SDDS"
+VERSION = 2
+_READ_VERSIONS = {1, 2}
+_prefix = struct.Struct("<4sHI")
+
+
+def encode_doc_section(doc: DocSection) -> bytes:
+    titles = []
+    subtree_sizes = []
+    heading_offsets = []
+    intro_offsets = []
+    texts = []
+    offset = 0
+    for level, section in doc.walk():
+        titles.append(section.title)
+        subtree_sizes.append(0)
+        heading = section.heading(level).encode()
+        text = section.intro_text.encode()
+        texts += [heading, text]
+        heading_offsets.append(offset)
+        intro_offsets.append(offset + len(heading))
+        offset += len(heading) + len(text)
+    heading_offsets.append(offset)
+    _fill_subtree_sizes(doc, subtree_sizes, 0)
+    header = json.dumps(
+        {
+            "titles": titles,
+            "subtree_sizes": subtree_sizes,
+            "heading_offsets": heading_offsets,
+            "intro_offsets": intro_offsets,
+        },
+        separators=(",", ":"),
+    ).encode()
+    return _prefix.pack(MAGIC, VERSION, len(header)) + header + b"".join(texts)
+
+
+def _fill_subtree_sizes(section: DocSection, sizes: list[int], ix: int) -> int:
+    size = 1
+    for ss in section.subsections:
+        size += _fill_subtree_sizes(ss, sizes, ix + size)
+    sizes[ix] = size
+    return size
+
+
+def is_encoded_doc_section(data: bytes) -> bool:
+    return data[:4] == MAGIC
+
+
+def decode_doc_section(
+    data: bytes, section_id: list[int] | None = None, validate: bool = False
+) -> DocSection:
+    """Decodes a DocSection, or just the subtree for section_id if it's passed in.
+
+    The data is trusted by default, so sections are constructed without running pydantic
+    validation.  Pass validate=True for data that didn't come from encode_doc_section.
+    """
+    header, text = read_header(data)
+    subtree_sizes = header["subtree_sizes"]
+
+    ix = 0
+    for child_number in section_id or []:
+        ix += 1
+        for _ in range(child_number):
+            ix += subtree_sizes[ix]
+
+    if validate:
+        tree = _build(header, text, ix, dict)
+        return DocSection.model_validate(tree)
+    return _build(header, text, ix, DocSection.model_construct)
+
+
+def read_header(data) -> tuple[dict, memoryview]:
+    """Returns the header of the encoded data and a view of the text that follows it.  The data
+    can be any buffer, such as bytes or an mmap."""
+    magic, version, header_length = _prefix.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Data isn't an encoded DocSection.")
+    if version not in _READ_VERSIONS:
+        raise ValueError(f"Unsupported encoded DocSection version {version}")
+    header_end = _prefix.size + header_length
+    data = memoryview(data)
+    header = json.loads(bytes(data[_prefix.size : header_end]))
+    return header, data[header_end:]
+
+
+def child_indices(header: dict, ix: int) -> list[int]:
+    """Returns the indices in the header arrays of the children of the section at ix."""
+    sizes = header["subtree_sizes"]
+    ret = []
+    child = ix + 1
+    end = ix + sizes[ix]
+    while child < end:
+        ret.append(child)
+        child += sizes[child]
+    return ret
+
+
+def intro_range(header: dict, ix: int) -> tuple[int, int]:
+    """Returns the start and end in the text of the intro text of the section at ix."""
+    if "text_offsets" in header:
+        offsets = header["text_offsets"]
+        return offsets[ix], offsets[ix + 1]
+    return header["intro_offsets"][ix], header["heading_offsets"][ix + 1]
+
+
+def markdown_range(header: dict, ix: int) -> tuple[int, int] | None:
+    """Returns the start and end in the text of the markdown of the section at ix and its
+    subsections, with the headings at their level in the document.  Returns None for version 1
+    data, which doesn't hold the markdown."""
+    if "heading_offsets" not in header:
+        return None
+    offsets = header["heading_offsets"]
+    return offsets[ix], offsets[ix + header["subtree_sizes"][ix]]
+
+
+def _build(header: dict, text: memoryview, ix: int, factory: Callable):
+    subsections = [
+        _build(header, text, child, factory) for child in child_indices(header, ix)
+    ]
+    start, end = intro_range(header, ix)
+    return factory(
+        title=header["titles"][ix],
+        intro_text=str(text[start:end], "utf-8"),
+        subsections=subsections,
+    )
@@ -0,0 +1,82 @@
+import json
+import struct
+
+import pytest
+
+from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.doc_section_codec import (
+    encode_doc_section,
+    decode_doc_section,
+    is_encoded_doc_section,
+    markdown_range,
+    read_header,
+)
+
+doc = DocSection.parse_markdown(
+    "Report",
+    """Préface
+# Intro
+Intro text
+# Methods
+## Sampling
+Samples were taken.
+### Storage
+Frozen
+## Analysis
+# Results
+Everything worked ✓
+""",
+)
+
+
+def test_round_trip():
+    data = encode_doc_section(doc)
+
+    assert is_encoded_doc_section(data)
+    assert decode_doc_section(data) == doc
+    assert decode_doc_section(data, validate=True) == doc
+    assert decode_doc_section(data).as_markdown() == doc.as_markdown()
+
+
+def test_decode_subtree():
+    data = encode_doc_section(doc)
+
+    assert decode_doc_section(data, [1]) == doc.find_section_by_id([1])
+    assert decode_doc_section(data, [1, 0, 0]) == doc.find_section_by_id([1, 0, 0])
+    assert decode_doc_section(data, [2]) == doc.find_section_by_id([2])
+
+
+def test_decode_rejects_other_data():
+    with pytest.raises(ValueError):
+        decode_doc_section(b'{"title": "Report"}')
+
+
+def test_markdown_ranges():
+    header, text = read_header(encode_doc_section(doc))
+
+    assert str(text, "utf-8") == doc.as_markdown()
+    start, end = markdown_range(header, 2)
+    assert (
+        str(text[start:end], "utf-8")
+        == "# Methods\n## Sampling\nSamples were taken.\n### Storage\nFrozen\n## Analysis\n"
+    )
+
+
+def test_decode_version_1():
+    v2_header, _ = read_header(encode_doc_section(doc))
+    texts = [section.intro_text.encode() for _, section in doc.walk()]
+    offsets = [0]
+    for text in texts:
+        offsets.append(offsets[-1] + len(text))
+    header = json.dumps(
+        {
+            "titles": v2_header["titles"],
+            "subtree_sizes": v2_header["subtree_sizes"],
+            "text_offsets": offsets,
+        }
+    ).encode()
+    data = struct.pack("<4sHI", b"SDDS", 1, len(header)) + header + b"".join(texts)
+
+    assert decode_doc_section(data) == doc
+    assert decode_doc_section(data, [1, 0, 0]) == doc.find_section_by_id([1, 0, 0])
+    assert markdown_range(read_header(data)[0], 0) is None
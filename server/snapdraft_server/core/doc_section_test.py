@@ -211,3 +211,15 @@ intro
     names = DocSection.parse_markdown("title", markdown).get_section_names()
     logger.info(names)
     assert names == ["TITLE PAGE", "SUMMARY"]
+
+
+def test_with_intro_text_copies_only_the_changed_path(example_doc_section):
+    updated = example_doc_section.with_intro_text([1, 0], "new text\n")
+
+    assert updated.find_section_by_id([1, 0]).intro_text == "new text\n"
+    assert example_doc_section.find_section_by_id([1, 0]).intro_text == "some text\n"
+    assert updated.subsections[0] is example_doc_section.subsections[0]
+    assert updated.subsections[2] is example_doc_section.subsections[2]
+    assert updated.find_section_by_id(
+        [1, 0, 0]
+    ) is example_doc_section.find_section_by_id([1, 0, 0])
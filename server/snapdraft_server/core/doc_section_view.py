@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import mmap
+from pathlib import Path
+
+from snapdraft_server.core.doc_section import DocSection, SectionTree
+from snapdraft_server.core.doc_section_codec import (
+    child_indices,
+    intro_range,
+    markdown_range,
+    read_header,
+)
+
+
+class DocSectionView(SectionTree):
+    """A read-only view of a DocSection saved with encode_doc_section, backed by a memory mapped
+    file.
+
+    The titles and structure of the document are loaded when it's opened, but the intro text of
+    each section is only decoded from the file when it is accessed.  This keeps large source
+    documents out of memory when only a few of their sections are used.  Supports the read
+    methods of DocSection, so it can be used in place of one when generating.
+
+    A view opened from a file keeps it mapped until it's closed, which can be done by using it
+    as a context manager.  Its sections can't be read after that.
+
+    The file holds the document's markdown, so a section rendered at its level in the document
+    is sliced from it rather than built from its subsections.
+    """
+
+    def __init__(self, header: dict, text: memoryview, ix: int = 0, level: int = 0):
+        self._mmap: mmap.mmap | None = None
+        self._header = header
+        self._text = text
+        self._ix = ix
+        self._level = level
+        self.title: str = header["titles"][ix]
+        self.subsections: list[DocSectionView] = [
+            DocSectionView(header, text, child, level + 1)
+            for child in child_indices(header, ix)
+        ]
+
+    @staticmethod
+    def open(path: Path) -> DocSectionView:
+        with path.open("rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header, text = read_header(data)
+        view = DocSectionView(header, text)
+        view._mmap = data
+        return view
+
+    def close(self):
+        """Unmaps the file the view was opened from.  Fails with BufferError while memoryviews
+        returned by markdown_bytes are still in use."""
+        if self._mmap is not None:
+            self._text.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> DocSectionView:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def intro_text(self) -> str:
+        start, end = intro_range(self._header, self._ix)
+        return str(self._text[start:end], "utf-8")
+
+    def markdown_bytes(self) -> memoryview | None:
+        """Returns the UTF-8 markdown of this section as rendered at its level in the document,
+        without copying it from the file.  Returns None for files saved without it."""
+        span = markdown_range(self._header, self._ix)
+        if span is None:
+            return None
+        return self._text[span[0] : span[1]]
+
+    def as_markdown(self, level=0) -> str:
+        if level == self._level:
+            data = self.markdown_bytes()
+            if data is not None:
+                return str(data, "utf-8")
+        return super().as_markdown(level)
+
+    def to_doc_section(self) -> DocSection:
+        return DocSection.model_construct(
+            title=self.title,
+            intro_text=self.intro_text,
+            subsections=[_.to_doc_section() for _ in self.subsections],
+        )
@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import pytest
+
+from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.doc_section_codec import encode_doc_section
+from snapdraft_server.core.doc_section_view import DocSectionView
+
+doc = DocSection.parse_markdown(
+    "Report",
+    """Préface
+# Intro
+Intro text
+# Methods
+## Sampling
+Samples were taken.
+# Results
+Everything worked ✓
+""",
+)
+
+
+def test_view_matches_doc_section(tmp_path: Path):
+    path = tmp_path / "report.sdds"
+    path.write_bytes(encode_doc_section(doc))
+
+    view = DocSectionView.open(path)
+
+    assert view.as_markdown() == doc.as_markdown()
+    assert view.get_section_names() == doc.get_section_names()
+    assert view.find_section_by_id([1, 0]).intro_text == "Samples were taken.\n"
+    assert view.find_section_by_name("Results").intro_text == "Everything worked ✓\n"
+    assert view.to_doc_section() == doc
+
+
+def test_view_slices_markdown(tmp_path: Path):
+    path = tmp_path / "report.sdds"
+    path.write_bytes(encode_doc_section(doc))
+
+    view = DocSectionView.open(path)
+    methods = view.find_section_by_id([1])
+
+    assert bytes(view.markdown_bytes()) == doc.as_markdown().encode()
+    assert methods.as_markdown(1) == "# Methods\n## Sampling\nSamples were taken.\n"
+    # Rendered at another level, the headings differ from the saved markdown.
+    assert methods.as_markdown() == doc.find_section_by_id([1]).as_markdown()
+
+
+def test_close(tmp_path: Path):
+    path = tmp_path / "report.sdds"
+    path.write_bytes(encode_doc_section(doc))
+
+    with DocSectionView.open(path) as view:
+        results = view.find_section_by_name("Results")
+        assert results.intro_text == "Everything worked ✓\n"
+
+    with pytest.raises(ValueError):
+        results.intro_text
@@ -7,6 +7,7 @@ import dspy
 from pydantic import BaseModel, model_validator, field_validator, Field
 
 from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.lm_limiter import call_predictor
 from snapdraft_server.dspy_helpers.typed_predictor_signature import (
     TypedPredictorSignature,
 )
@@ -63,6 +64,8 @@ class SourceContext(BaseModel):
     source_file_name: str
     section_title: str | None
     markdown: str
+    token_count: int = Field(default=0, exclude=True)
+    """Number of tokens in the markdown.  Excluded so that it isn't sent to the LM."""
 
 
 class SectionAuthorer(BaseModel):
@@ -74,12 +77,20 @@ class SectionAuthorer(BaseModel):
     class Output(BaseModel):
         markdown: str
 
-    def generate(self, context: list[SourceContext]):
+    @staticmethod
+    def create_predictor() -> dspy.Module:
         signature = TypedPredictorSignature.create(
             SectionAuthorer.Input, SectionAuthorer.Output
         )
-        cot = dspy.ChainOfThought(signature)
-        return cot(context=context).markdown
+        return dspy.ChainOfThought(signature)
+
+    def generate(
+        self, context: list[SourceContext], predictor: dspy.Module | None = None
+    ):
+        """Generates the section markdown.  If a (possibly trained) predictor is passed in it is
+        used, otherwise a new zero-shot predictor is created."""
+        cot = predictor or self.create_predictor()
+        return call_predictor(cot, context=context).markdown
 
 
 class SourceReference(BaseModel):
@@ -0,0 +1,255 @@
+"""Converts DOCX files to markdown in process, without running pandoc.
+
+Only the parts of the document that matter for drafting are converted: headings (from the
+paragraph styles), paragraphs with bold and italic text, links, lists and tables.  Headings keep
+their levels so DocSection.parse_markdown gives the same section structure as pandoc's output.
+"""
+
+import re
+import zipfile
+from pathlib import Path
+from xml.etree import ElementTree
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+_heading_style_regex = re.compile(r"heading\s*(\d)", re.IGNORECASE)
+_escape_regex = re.compile(r"([\\`*_\[\]])")
+
+
+def convert_docx_to_markdown(path: Path) -> str:
+    with zipfile.ZipFile(path) as docx:
+        document = ElementTree.fromstring(docx.read("word/document.xml"))
+        names = set(docx.namelist())
+        styles = (
+            ElementTree.fromstring(docx.read("word/styles.xml"))
+            if "word/styles.xml" in names
+            else None
+        )
+        numbering = (
+            ElementTree.fromstring(docx.read("word/numbering.xml"))
+            if "word/numbering.xml" in names
+            else None
+        )
+        rels = (
+            ElementTree.fromstring(docx.read("word/_rels/document.xml.rels"))
+            if "word/_rels/document.xml.rels" in names
+            else None
+        )
+    converter = _DocxConverter(
+        _heading_levels(styles), _bullet_lists(numbering), _links(rels)
+    )
+    body = document.find(f"{_W}body")
+    blocks = converter.convert_blocks(body) if body is not None else []
+    return "".join(f"{_}\n\n" for _ in blocks if _)
+
+
+def _heading_levels(styles: ElementTree.Element | None) -> dict[str, int]:
+    """Returns the heading level of each paragraph style that is a heading, following basedOn
+    so custom styles built on the built in headings are headings too."""
+    if styles is None:
+        return {}
+    levels = {}
+    based_on = {}
+    for style in styles.iter(f"{_W}style"):
+        style_id = style.get(f"{_W}styleId")
+        name = style.find(f"{_W}name")
+        match = _heading_style_regex.fullmatch(
+            name.get(f"{_W}val", "") if name is not None else ""
+        )
+        outline = style.find(f"{_W}pPr/{_W}outlineLvl")
+        if match:
+            levels[style_id] = int(match.group(1))
+        elif outline is not None and int(outline.get(f"{_W}val")) < 9:
+            levels[style_id] = int(outline.get(f"{_W}val")) + 1
+        parent = style.find(f"{_W}basedOn")
+        if parent is not None:
+            based_on[style_id] = parent.get(f"{_W}val")
+    for style_id in based_on:
+        parent = based_on[style_id]
+        while style_id not in levels and parent is not None:
+            if parent in levels:
+                levels[style_id] = levels[parent]
+            parent = based_on.get(parent)
+    return {k: min(v, 6) for k, v in levels.items()}
+
+
+def _bullet_lists(numbering: ElementTree.Element | None) -> set[tuple[str, str]]:
+    """Returns the (numId, ilvl) pairs that are bulleted rather than numbered."""
+    if numbering is None:
+        return set()
+    abstract_bullets = {}
+    for abstract in numbering.iter(f"{_W}abstractNum"):
+        abstract_bullets[abstract.get(f"{_W}abstractNumId")] = {
+            lvl.get(f"{_W}ilvl")
+            for lvl in abstract.iter(f"{_W}lvl")
+            if lvl.find(f"{_W}numFmt") is not None
+            and lvl.find(f"{_W}numFmt").get(f"{_W}val") == "bullet"
+        }
+    ret = set()
+    for num in numbering.iter(f"{_W}num"):
+        abstract_id = num.find(f"{_W}abstractNumId").get(f"{_W}val")
+        for ilvl in abstract_bullets.get(abstract_id, ()):
+            ret.add((num.get(f"{_W}numId"), ilvl))
+    return ret
+
+
+def _links(rels: ElementTree.Element | None) -> dict[str, str]:
+    if rels is None:
+        return {}
+    return {
+        rel.get("Id"): rel.get("Target")
+        for rel in rels.iter(f"{_RELS}Relationship")
+        if rel.get("TargetMode") == "External"
+    }
+
+
+class _DocxConverter:
+    def __init__(
+        self,
+        heading_levels: dict[str, int],
+        bullet_lists: set[tuple[str, str]],
+        links: dict[str, str],
+    ):
+        self.heading_levels = heading_levels
+        self.bullet_lists = bullet_lists
+        self.links = links
+
+    def convert_blocks(self, parent: ElementTree.Element) -> list[str]:
+        blocks = []
+        for element in parent:
+            if element.tag == f"{_W}p":
+                blocks.append(self.convert_paragraph(element))
+            elif element.tag == f"{_W}tbl":
+                blocks.append(self.convert_table(element))
+            elif element.tag == f"{_W}sdt":
+                content = element.find(f"{_W}sdtContent")
+                if content is not None:
+                    blocks.extend(self.convert_blocks(content))
+        return blocks
+
+    def convert_paragraph(self, paragraph: ElementTree.Element) -> str:
+        style = paragraph.find(f"{_W}pPr/{_W}pStyle")
+        style_id = style.get(f"{_W}val") if style is not None else None
+        level = self.heading_levels.get(style_id)
+        if level:
+            # Headings are plain text, formatting in them would end up in the section titles.
+            text = " ".join(self.plain_text(paragraph).split())
+            return f"{'#' * level} {text}" if text else ""
+
+        text = self.inline_text(paragraph).strip()
+        if not text:
+            return ""
+        if text.startswith("#"):
+            text = "\\" + text
+        num = paragraph.find(f"{_W}pPr/{_W}numPr")
+        if num is not None and num.find(f"{_W}numId") is not None:
+            num_id = num.find(f"{_W}numId").get(f"{_W}val")
+            ilvl_element = num.find(f"{_W}ilvl")
+            ilvl = ilvl_element.get(f"{_W}val") if ilvl_element is not None else "0"
+            marker = "-" if (num_id, ilvl) in self.bullet_lists else "1."
+            return f"{'    ' * int(ilvl)}{marker} {text}"
+        return text
+
+    def convert_table(self, table: ElementTree.Element) -> str:
+        rows = []
+        for tr in table.findall(f"{_W}tr"):
+            cells = []
+            for tc in tr.findall(f"{_W}tc"):
+                text = " ".join(
+                    self.inline_text(p).strip() for p in tc.iter(f"{_W}p")
+                ).strip()
+                cells.append(text.replace("|", "\\|").replace("\n", " "))
+            rows.append(cells)
+        if not rows:
+            return ""
+        width = max(len(_) for _ in rows)
+        rows = [_ + [""] * (width - len(_)) for _ in rows]
+        lines = [
+            "| " + " | ".join(rows[0]) + " |",
+            "|" + "---|" * width,
+            *("| " + " | ".join(_) + " |" for _ in rows[1:]),
+        ]
+        return "\n".join(lines)
+
+    def plain_text(self, element: ElementTree.Element) -> str:
+        return "".join(self.run_text(r) for r in element.iter(f"{_W}r"))
+
+    def inline_text(self, paragraph: ElementTree.Element) -> str:
+        return "".join(
+            _format(marker, text) for marker, text in self.inline_runs(paragraph)
+        )
+
+    def inline_runs(self, paragraph: ElementTree.Element) -> list[tuple[str, str]]:
+        """Returns the escaped text in the paragraph split into runs with the same formatting.
+        Adjacent runs with the same formatting are merged, so the markers aren't repeated.
+        """
+        runs = []
+        for child in paragraph:
+            if child.tag == f"{_W}r":
+                runs.append(
+                    (
+                        self.run_marker(child),
+                        _escape_regex.sub(r"\\\1", self.run_text(child)),
+                    )
+                )
+            elif child.tag == f"{_W}hyperlink":
+                text = self.inline_text(child)
+                target = self.links.get(child.get(f"{_R}id"))
+                runs.append(("", f"[{text}]({target})" if target and text else text))
+            elif child.tag in (
+                f"{_W}ins",
+                f"{_W}smartTag",
+                f"{_W}sdt",
+                f"{_W}sdtContent",
+            ):
+                runs.extend(self.inline_runs(child))
+        merged = []
+        for marker, text in runs:
+            if merged and merged[-1][0] == marker:
+                merged[-1] = (marker, merged[-1][1] + text)
+            else:
+                merged.append((marker, text))
+        return merged
+
+    @staticmethod
+    def run_marker(run: ElementTree.Element) -> str:
+        properties = run.find(f"{_W}rPr")
+        marker = ""
+        if properties is not None:
+            if _is_on(properties.find(f"{_W}b")):
+                marker += "**"
+            if _is_on(properties.find(f"{_W}i")):
+                marker += "*"
+        return marker
+
+    @staticmethod
+    def run_text(run: ElementTree.Element) -> str:
+        parts = []
+        for child in run:
+            if child.tag == f"{_W}t":
+                parts.append(child.text or "")
+            elif child.tag == f"{_W}tab":
+                parts.append("\t")
+            elif child.tag in (f"{_W}br", f"{_W}cr"):
+                parts.append("\n")
+        return "".join(parts)
+
+
+def _format(marker: str, text: str) -> str:
+    stripped = text.strip()
+    if not marker or not stripped:
+        return text
+    # Markers have to be next to the text, so whitespace is kept outside of them.
+    leading = text[: len(text) - len(text.lstrip())]
+    trailing = text[len(text.rstrip()) :]
+    return f"{leading}{marker}{stripped}{marker[::-1]}{trailing}"
+
+
+def _is_on(element: ElementTree.Element | None) -> bool:
+    return element is not None and element.get(f"{_W}val", "true") not in (
+        "0",
+        "false",
+        "off",
+    )
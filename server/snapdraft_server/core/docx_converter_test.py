@@ -0,0 +1,109 @@
+import re
+import shutil
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from snapdraft_server.core.default_doc_generator import DefaultDocGenerator
+from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.docx_converter import convert_docx_to_markdown
+
+W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>"""
+
+RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+STYLES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles {W}>
+<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/></w:style>
+<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/></w:style>
+<w:style w:type="paragraph" w:styleId="Appendix"><w:name w:val="Appendix"/><w:basedOn w:val="Heading1"/></w:style>
+</w:styles>"""
+
+
+def _paragraph(text: str, style: str | None = None, bold: bool = False) -> str:
+    style = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    properties = "<w:rPr><w:b/></w:rPr>" if bold else ""
+    return f'<w:p>{style}<w:r>{properties}<w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+
+
+def _write_docx(path: Path, body: str):
+    document = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {W}><w:body>{body}</w:body></w:document>'
+    with zipfile.ZipFile(path, "w") as docx:
+        docx.writestr("[Content_Types].xml", CONTENT_TYPES)
+        docx.writestr("_rels/.rels", RELS)
+        docx.writestr("word/_rels/document.xml.rels", DOCUMENT_RELS)
+        docx.writestr("word/document.xml", document)
+        docx.writestr("word/styles.xml", STYLES)
+
+
+@pytest.fixture
+def docx_path(tmp_path: Path) -> Path:
+    path = tmp_path / "source.docx"
+    _write_docx(
+        path,
+        _paragraph("Summary of the study.")
+        + _paragraph("Introduction", "Heading1")
+        + _paragraph("Background", "Heading2")
+        + _paragraph("Important", bold=True)
+        + _paragraph(" results_final")
+        + _paragraph("Methods", "Heading1")
+        + "<w:tbl><w:tr><w:tc>"
+        + _paragraph("Arm")
+        + "</w:tc><w:tc>"
+        + _paragraph("N")
+        + "</w:tc></w:tr><w:tr><w:tc>"
+        + _paragraph("A")
+        + "</w:tc><w:tc>"
+        + _paragraph("12")
+        + "</w:tc></w:tr></w:tbl>"
+        + _paragraph("Listings", "Appendix"),
+    )
+    return path
+
+
+def test_convert_docx(docx_path: Path):
+    markdown = convert_docx_to_markdown(docx_path)
+
+    assert markdown == (
+        "Summary of the study.\n\n"
+        "# Introduction\n\n"
+        "## Background\n\n"
+        "**Important**\n\n"
+        "results\\_final\n\n"
+        "# Methods\n\n"
+        "| Arm | N |\n|---|---|\n| A | 12 |\n\n"
+        "# Listings\n\n"
+    )
+
+
+@pytest.mark.skipif(shutil.which("pandoc") is None, reason="pandoc isn't installed")
+def test_same_sections_as_pandoc(docx_path: Path):
+    python_doc = DocSection.parse_markdown(
+        "Source", convert_docx_to_markdown(docx_path)
+    )
+    pandoc_doc = DocSection.parse_markdown(
+        "Source", DefaultDocGenerator._pandoc_convert_to_markdown(docx_path, "docx")
+    )
+
+    # Pandoc adds attributes like {#listings .Appendix} to headings with custom styles.
+    pandoc_names = [
+        re.sub(r" \{[^}]*\}$", "", _) for _ in pandoc_doc.get_section_names()
+    ]
+    assert python_doc.get_section_names() == pandoc_names
@@ -0,0 +1,219 @@
+"""Deadlines, hedging and fallback for LM calls.
+
+A call runs as one or more attempts in worker threads while the caller waits for the first one
+to succeed:
+
+- A hedge, a duplicate of the call, is started if the call runs longer than the given percentile
+  of the recent latencies of calls to the same predictor.
+- If a fallback LM is configured, an attempt with it is started once a fraction of the deadline
+  has passed, or right away if the other attempts fail.
+- The call fails with LmDeadlineExceeded if nothing succeeds before the deadline.
+
+Hedges and fallbacks can be gated by an admit function, which the rate limiter uses to only start
+them when it has room.  An attempt that isn't admitted is tried again shortly.
+
+Attempts that lose are abandoned.  They can't be cancelled, so they finish in the background and
+their results are dropped.  Every call and its attempts are kept in a short history for
+analysis.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import datetime
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Literal, TypeVar
+
+import dspy
+from pydantic import BaseModel, ConfigDict, Field
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LATENCY_HISTORY_SIZE = 200
+ADMIT_RETRY_SECONDS = 0.25
+CALL_HISTORY_SIZE = 500
+
+
+class LmDeadlineExceeded(TimeoutError):
+    pass
+
+
+class LmCallPolicy(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    deadline_seconds: float | None = 180
+    hedge_percentile: float | None = 0.95
+    """Latency percentile after which a hedge is started.  None disables hedging."""
+    hedge_min_samples: int = 20
+    """Calls to a predictor aren't hedged until this many latencies have been seen."""
+    hedge_min_seconds: float = 1.0
+    max_hedges: int = 1
+    fallback_lm: dspy.BaseLM | None = None
+    fallback_after_fraction: float = 0.75
+    """Fraction of the deadline after which the fallback LM is tried."""
+
+
+class LmAttempt(BaseModel):
+    kind: Literal["primary", "hedge", "fallback"]
+    started_seconds: float
+    """Time since the start of the call."""
+    duration_seconds: float | None = None
+    outcome: Literal["running", "success", "error", "abandoned"] = "running"
+    error: str | None = None
+
+
+class LmCallRecord(BaseModel):
+    predictor: str
+    started_at: datetime.datetime = Field(default_factory=datetime.datetime.now)
+    duration_seconds: float | None = None
+    outcome: Literal["running", "success", "error", "deadline_exceeded"] = "running"
+    attempts: list[LmAttempt] = Field(default_factory=list)
+
+
+_policy = LmCallPolicy()
+_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="lm-call")
+_lock = threading.Lock()
+_latencies: dict[str, deque[float]] = {}
+_history: deque[LmCallRecord] = deque(maxlen=CALL_HISTORY_SIZE)
+
+
+def get_lm_call_policy() -> LmCallPolicy:
+    return _policy
+
+
+def configure_lm_call_policy(**kwargs) -> LmCallPolicy:
+    """Replaces the process-wide policy, taking the same arguments as LmCallPolicy."""
+    global _policy
+    _policy = LmCallPolicy(**kwargs)
+    return _policy
+
+
+def get_recent_lm_calls() -> list[LmCallRecord]:
+    with _lock:
+        return list(_history)
+
+
+def latency_percentile(predictor: str, percentile: float) -> float | None:
+    """Returns the latency percentile of the recent successful calls to the predictor, or None
+    if there aren't any."""
+    with _lock:
+        latencies = sorted(_latencies.get(predictor, ()))
+    if not latencies:
+        return None
+    return latencies[min(int(percentile * len(latencies)), len(latencies) - 1)]
+
+
+def run_with_policy(
+    call: Callable[[], T], predictor: str, admit: Callable[[], bool] | None = None
+) -> T:
+    """Runs call following the process-wide LmCallPolicy.  The predictor name groups calls for
+    the latency percentiles and the call history.  If admit is passed, it's called before each
+    hedge or fallback is started, and they're only started if it returns True."""
+    policy = _policy
+    record = LmCallRecord(predictor=predictor)
+    with _lock:
+        _history.append(record)
+        sample_count = len(_latencies.get(predictor, ()))
+    hedge_at = None
+    if policy.hedge_percentile is not None and sample_count >= policy.hedge_min_samples:
+        hedge_at = max(
+            latency_percentile(predictor, policy.hedge_percentile),
+            policy.hedge_min_seconds,
+        )
+    fallback_at = None
+    if policy.fallback_lm is not None and policy.deadline_seconds is not None:
+        fallback_at = policy.deadline_seconds * policy.fallback_after_fraction
+
+    start = time.monotonic()
+    pending: dict[Future, LmAttempt] = {}
+
+    def submit(kind: str, lm: dspy.BaseLM | None = None) -> bool:
+        if kind != "primary" and admit is not None and not admit():
+            return False
+        attempt = LmAttempt(kind=kind, started_seconds=time.monotonic() - start)
+        record.attempts.append(attempt)
+
+        def run():
+            if lm is None:
+                return call()
+            with dspy.context(lm=lm):
+                return call()
+
+        # Copied so the attempt sees the caller's DSPy settings and LM priority.
+        context = contextvars.copy_context()
+        pending[_executor.submit(context.run, run)] = attempt
+        if kind != "primary":
+            logger.info("Started %s attempt for %s", kind, predictor)
+        return True
+
+    def finish(outcome: str) -> float:
+        record.duration_seconds = time.monotonic() - start
+        record.outcome = outcome
+        for attempt in pending.values():
+            attempt.outcome = "abandoned"
+        return record.duration_seconds
+
+    submit("primary")
+    hedges = 0
+    fallback_used = False
+    last_error = None
+    while True:
+        elapsed = time.monotonic() - start
+        events = [policy.deadline_seconds]
+        if hedge_at is not None and hedges < policy.max_hedges:
+            events.append(hedge_at)
+        if fallback_at is not None and not fallback_used:
+            events.append(fallback_at)
+        next_event = min((_ for _ in events if _ is not None), default=None)
+        timeout = None if next_event is None else max(next_event - elapsed, 0)
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            attempt = pending.pop(future)
+            attempt.duration_seconds = (
+                time.monotonic() - start - attempt.started_seconds
+            )
+            try:
+                result = future.result()
+            except Exception as e:
+                attempt.outcome = "error"
+                attempt.error = f"{type(e).__name__}: {e}"
+                last_error = e
+                continue
+            attempt.outcome = "success"
+            finish("success")
+            if attempt.kind != "fallback":
+                with _lock:
+                    _latencies.setdefault(
+                        predictor, deque(maxlen=LATENCY_HISTORY_SIZE)
+                    ).append(attempt.duration_seconds)
+            return result
+
+        elapsed = time.monotonic() - start
+        if policy.deadline_seconds is not None and elapsed >= policy.deadline_seconds:
+            finish("deadline_exceeded")
+            raise LmDeadlineExceeded(
+                f"LM call to {predictor} didn't finish within {policy.deadline_seconds}s"
+            )
+        if not pending:
+            if policy.fallback_lm is None or fallback_used:
+                finish("error")
+                raise last_error
+            fallback_at = elapsed
+        if fallback_at is not None and not fallback_used and elapsed >= fallback_at:
+            if submit("fallback", policy.fallback_lm):
+                fallback_used = True
+            else:
+                fallback_at = elapsed + ADMIT_RETRY_SECONDS
+        elif (
+            hedge_at is not None and hedges < policy.max_hedges and elapsed >= hedge_at
+        ):
+            if submit("hedge"):
+                hedges += 1
+            else:
+                hedge_at = elapsed + ADMIT_RETRY_SECONDS
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import dspy
+import pytest
+from dspy.utils import DummyLM
+
+from snapdraft_server.core.lm_call_policy import (
+    LmDeadlineExceeded,
+    configure_lm_call_policy,
+    get_recent_lm_calls,
+    run_with_policy,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_policy():
+    yield
+    configure_lm_call_policy()
+
+
+def test_hedges_slow_calls():
+    configure_lm_call_policy(hedge_min_samples=1, hedge_min_seconds=0.05)
+    run_with_policy(lambda: "fast", "hedge test")
+    calls = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            calls.append(None)
+            first = len(calls) == 1
+        if first:
+            time.sleep(1)
+        return len(calls)
+
+    assert run_with_policy(call, "hedge test") == 2
+    record = get_recent_lm_calls()[-1]
+    assert [(_.kind, _.outcome) for _ in record.attempts] == [
+        ("primary", "abandoned"),
+        ("hedge", "success"),
+    ]
+
+
+def test_deadline():
+    configure_lm_call_policy(deadline_seconds=0.05)
+
+    with pytest.raises(LmDeadlineExceeded):
+        run_with_policy(lambda: time.sleep(0.5), "deadline test")
+    assert get_recent_lm_calls()[-1].outcome == "deadline_exceeded"
+
+
+def test_falls_back_when_the_call_fails():
+    fallback_lm = DummyLM([])
+    configure_lm_call_policy(fallback_lm=fallback_lm)
+
+    def call():
+        if dspy.settings.lm is not fallback_lm:
+            raise ValueError("Primary failed")
+        return "fallback"
+
+    assert run_with_policy(call, "fallback test") == "fallback"
+    record = get_recent_lm_calls()[-1]
+    assert [(_.kind, _.outcome) for _ in record.attempts] == [
+        ("primary", "error"),
+        ("fallback", "success"),
+    ]
@@ -0,0 +1,310 @@
+"""Process-wide limits on the LM calls made by the generator.
+
+All predictor calls go through call_predictor, which waits for the LmRateLimiter before calling
+the LM.  The limiter keeps token buckets for requests and tokens per minute and caps the number of
+calls in flight.  Waiting calls are served in priority order, so interactive generation isn't
+stuck behind a batch job.  When the provider rate limits a call anyway, the limiter backs off by
+pausing and lowering its rates, then slowly recovers as calls succeed.
+
+Predictor calls are synchronous and run in worker threads, so the limiter blocks the calling
+thread rather than the event loop.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Iterator
+
+import dspy
+from pydantic import BaseModel
+
+from snapdraft_server.core.lm_call_policy import run_with_policy
+from snapdraft_server.core.token_budget import TokenCounter, get_token_counter
+from snapdraft_server.core.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_retry_after_regex = re.compile(r"try again in (\d+(?:\.\d+)?)\s*(ms|s)", re.IGNORECASE)
+
+
+class LmPriority(IntEnum):
+    """Lower values are served first."""
+
+    INTERACTIVE = 0
+    BATCH = 1
+    TRAINING = 2
+
+
+_priority: contextvars.ContextVar[LmPriority] = contextvars.ContextVar(
+    "lm_priority", default=LmPriority.INTERACTIVE
+)
+
+
+@contextmanager
+def lm_priority(priority: LmPriority) -> Iterator[None]:
+    """Sets the priority of the LM calls made in this context.  Threads started with
+    asyncio.to_thread inherit it."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class QueueWaitStats(BaseModel):
+    calls: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+
+class LmRateLimiter:
+    def __init__(
+        self,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 150_000,
+        max_concurrency: int = 16,
+        min_rate_fraction: float = 0.1,
+        recovery_per_success: float = 0.05,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_rate_fraction = min_rate_fraction
+        self.recovery_per_success = recovery_per_success
+
+        self.rate_fraction = 1.0
+        """Fraction of the configured rates currently allowed, lowered when rate limited."""
+        self.in_flight = 0
+        self.rate_limited_count = 0
+        self.wait_stats = {_: QueueWaitStats() for _ in LmPriority}
+        self._request_tokens = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def share(self, fraction: float) -> dict:
+        """The arguments for a limiter allowed the fraction of this one's rates and concurrency,
+        for calls made from another process."""
+        return dict(
+            requests_per_minute=self.requests_per_minute * fraction,
+            tokens_per_minute=self.tokens_per_minute * fraction,
+            max_concurrency=max(1, int(self.max_concurrency * fraction)),
+            min_rate_fraction=self.min_rate_fraction,
+            recovery_per_success=self.recovery_per_success,
+        )
+
+    def acquire(self, tokens: int, priority: LmPriority = LmPriority.INTERACTIVE):
+        """Blocks until the call can be made.  Calls must be followed by release."""
+        # A call larger than the whole bucket waits for a full bucket rather than forever.
+        tokens = min(tokens, self.tokens_per_minute)
+        ticket = (priority, next(self._sequence))
+        start = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                wait = self._time_until_available(ticket, tokens)
+                if wait == 0:
+                    break
+                self._condition.wait(wait)
+            heapq.heappop(self._waiting)
+            waited = self._take(tokens, priority, start)
+        if waited > 1:
+            logger.info("LM call waited %.1fs for the rate limiter", waited)
+
+    def try_acquire(
+        self, tokens: int, priority: LmPriority = LmPriority.INTERACTIVE
+    ) -> bool:
+        """Acquires the call only if it can be made now, without going ahead of any waiting
+        call.  Returns whether it was acquired, in which case it must be followed by release.
+        """
+        tokens = min(tokens, self.tokens_per_minute)
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            if self._waiting:
+                return False
+            self._waiting.append(ticket)
+            wait = self._time_until_available(ticket, tokens)
+            self._waiting.pop()
+            if wait != 0:
+                return False
+            self._take(tokens, priority, time.monotonic())
+        return True
+
+    def _take(self, tokens: int, priority: LmPriority, start: float) -> float:
+        """Takes the call's share of the limits and returns how long it waited.  Called with the
+        condition held."""
+        self._request_tokens -= 1
+        self._tokens -= tokens
+        self.in_flight += 1
+        waited = time.monotonic() - start
+        stats = self.wait_stats[priority]
+        stats.calls += 1
+        stats.total_wait_seconds += waited
+        stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+        # The next waiter may be able to go too.
+        self._condition.notify_all()
+        return waited
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self.rate_fraction = min(
+                1.0, self.rate_fraction + self.recovery_per_success
+            )
+
+    def on_rate_limited(self, retry_after: float | None = None):
+        """Backs off after the provider rejected a call.  New calls are paused for retry_after
+        seconds (or a second if it isn't known) and the rates are halved."""
+        with self._condition:
+            self.rate_limited_count += 1
+            self.rate_fraction = max(self.min_rate_fraction, self.rate_fraction / 2)
+            self._paused_until = max(
+                self._paused_until, time.monotonic() + (retry_after or 1.0)
+            )
+            # Drop the tokens that are left so the reduced rate takes effect right away.
+            self._request_tokens = min(self._request_tokens, 0)
+            self._tokens = min(self._tokens, 0)
+        logger.warning(
+            "LM calls rate limited, reducing rates to %.0f%%", self.rate_fraction * 100
+        )
+
+    def _time_until_available(self, ticket: tuple[int, int], tokens: int) -> float:
+        """Returns 0 if the ticket can go now, otherwise the longest time to wait before checking
+        again.  Waiters are woken up early whenever a call is released."""
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        per_second = self.rate_fraction / 60
+        self._request_tokens = min(
+            self.requests_per_minute,
+            self._request_tokens + elapsed * self.requests_per_minute * per_second,
+        )
+        self._tokens = min(
+            self.tokens_per_minute,
+            self._tokens + elapsed * self.tokens_per_minute * per_second,
+        )
+        if self._waiting[0] != ticket or self.in_flight >= self.max_concurrency:
+            return 1.0
+        if now < self._paused_until:
+            return self._paused_until - now
+        return max(
+            (1 - self._request_tokens) / (self.requests_per_minute * per_second),
+            (tokens - self._tokens) / (self.tokens_per_minute * per_second),
+            0,
+        )
+
+
+_limiter = LmRateLimiter()
+
+
+def get_lm_limiter() -> LmRateLimiter:
+    return _limiter
+
+
+def configure_lm_limiter(**kwargs) -> LmRateLimiter:
+    """Replaces the process-wide limiter, taking the same arguments as LmRateLimiter."""
+    global _limiter
+    _limiter = LmRateLimiter(**kwargs)
+    return _limiter
+
+
+def call_predictor(
+    predictor: dspy.Module,
+    expected_output_tokens: int = 1000,
+    max_rate_limited_retries: int = 5,
+    **inputs,
+) -> dspy.Prediction:
+    """Calls the predictor once the limiter allows it.  The tokens used are estimated from the
+    inputs and the predictor's demos plus expected_output_tokens.  Calls the provider rate limits are retried once the
+    limiter has backed off.
+
+    The call follows the LmCallPolicy once the limiter allows it, so the deadline and the
+    latencies the hedges are based on don't include the wait.  Hedges and fallbacks only start
+    when the limiter has room for them without waiting, so they don't add to a queue."""
+    counter = get_token_counter()
+    input_tokens = counter.count(str(inputs)) + _demo_tokens(predictor, counter)
+    tokens = input_tokens + expected_output_tokens
+    limiter = get_lm_limiter()
+    priority = _priority.get()
+
+    def limited_call():
+        # The attempt acquired the limiter before it started.
+        try:
+            for attempt in range(max_rate_limited_retries + 1):
+                try:
+                    result = predictor(**inputs)
+                except Exception as e:
+                    if attempt == max_rate_limited_retries or not is_rate_limit_error(
+                        e
+                    ):
+                        raise
+                    limiter.on_rate_limited(_retry_after(e))
+                    limiter.release()
+                    with span("wait_for_limiter"):
+                        limiter.acquire(tokens, priority)
+                else:
+                    limiter.on_success()
+                    return result
+        finally:
+            limiter.release()
+
+    name = _predictor_name(predictor)
+    with span("lm_call", predictor=name, input_tokens=input_tokens) as current_span:
+        with span("wait_for_limiter"):
+            limiter.acquire(tokens, priority)
+        result = run_with_policy(
+            limited_call, name, admit=lambda: limiter.try_acquire(tokens, priority)
+        )
+        current_span.set_attribute("output_tokens", counter.count(str(result)))
+    return result
+
+
+def _demo_tokens(predictor, counter: TokenCounter) -> int:
+    """Tokens of the few-shot demos a trained predictor sends with each call."""
+    if not isinstance(predictor, dspy.Module):
+        return 0
+    demos = [_ for p in predictor.predictors() for _ in p.demos]
+    return counter.count(str(demos)) if demos else 0
+
+
+def _predictor_name(predictor) -> str:
+    """Names the predictor by its signature, so calls for the same task share latency stats."""
+    predict = getattr(predictor, "predict", predictor)
+    signature = getattr(predict, "signature", None)
+    if signature is not None:
+        return signature.signature
+    return getattr(predictor, "__name__", type(predictor).__name__)
+
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    """Checks the exception and its causes for a 429 from the provider.  The error may be
+    wrapped by DSPy, so the type isn't checked directly."""
+    while e is not None:
+        if getattr(e, "status_code", None) == 429 or "RateLimit" in type(e).__name__:
+            return True
+        e = e.__cause__ or e.__context__
+    return False
+
+
+def _retry_after(e: BaseException) -> float | None:
+    """Reads the wait time from a message like OpenAI's "Please try again in 350ms"."""
+    match = _retry_after_regex.search(str(e))
+    if match is None:
+        return None
+    value = float(match.group(1))
+    return value / 1000 if match.group(2).lower() == "ms" else value
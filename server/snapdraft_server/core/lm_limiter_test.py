@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+from snapdraft_server.core.lm_call_policy import (
+    configure_lm_call_policy,
+    get_recent_lm_calls,
+)
+from snapdraft_server.core.lm_limiter import (
+    LmPriority,
+    LmRateLimiter,
+    call_predictor,
+    configure_lm_limiter,
+)
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+@pytest.fixture
+def limiter():
+    yield configure_lm_limiter(requests_per_minute=6000, tokens_per_minute=10**7)
+    configure_lm_limiter()
+
+
+def test_retries_rate_limited_calls(limiter):
+    calls = []
+
+    def predictor(**inputs):
+        calls.append(inputs)
+        if len(calls) == 1:
+            raise RateLimitError("Rate limit reached.  Please try again in 10ms.")
+        return "done"
+
+    assert call_predictor(predictor, context="text") == "done"
+    assert len(calls) == 2
+    assert limiter.rate_limited_count == 1
+    assert limiter.rate_fraction == pytest.approx(0.55)
+    assert limiter.in_flight == 0
+    assert limiter.wait_stats[LmPriority.INTERACTIVE].calls == 2
+
+
+def test_share():
+    limiter = LmRateLimiter(
+        requests_per_minute=400, tokens_per_minute=100_000, max_concurrency=2
+    )
+
+    shared = LmRateLimiter(**limiter.share(0.25))
+
+    assert shared.requests_per_minute == 100
+    assert shared.tokens_per_minute == 25_000
+    assert shared.max_concurrency == 1
+
+
+def test_waiters_served_in_priority_order():
+    limiter = LmRateLimiter(max_concurrency=1)
+    limiter.acquire(10)
+    order = []
+
+    def call(priority: LmPriority):
+        limiter.acquire(10, priority)
+        order.append(priority)
+        limiter.release()
+
+    threads = []
+    for priority in [LmPriority.TRAINING, LmPriority.BATCH, LmPriority.INTERACTIVE]:
+        threads.append(threading.Thread(target=call, args=(priority,)))
+        threads[-1].start()
+        while len(limiter._waiting) < len(threads):
+            time.sleep(0.01)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+
+    assert order == [LmPriority.INTERACTIVE, LmPriority.BATCH, LmPriority.TRAINING]
+
+
+def test_policy_starts_once_limiter_acquired():
+    limiter = configure_lm_limiter(
+        requests_per_minute=6000, tokens_per_minute=10**7, max_concurrency=1
+    )
+    configure_lm_call_policy(
+        deadline_seconds=0.25, hedge_min_samples=1, hedge_min_seconds=0.05
+    )
+    calls = []
+
+    def predictor(**inputs):
+        calls.append(inputs)
+        if len(calls) > 1:
+            time.sleep(0.1)
+        return "done"
+
+    try:
+        call_predictor(predictor, context="text")
+        # Another call holds the only slot for longer than the deadline.
+        limiter.acquire(10)
+        threading.Timer(0.3, limiter.release).start()
+
+        assert call_predictor(predictor, context="text") == "done"
+    finally:
+        configure_lm_call_policy()
+        configure_lm_limiter()
+
+    record = get_recent_lm_calls()[-1]
+    # The call ran past the hedge time, but there was no room for a hedge.
+    assert [_.kind for _ in record.attempts] == ["primary"]
+    assert record.duration_seconds < 0.25
+    assert limiter.in_flight == 0
@@ -0,0 +1,196 @@
+"""Detection of event loop lag and of callbacks that block the loop.
+
+A thread schedules a heartbeat on the loop at each interval.  The time the heartbeat waits to
+run is the loop's lag.  If it hasn't run after the threshold, the loop is stuck in a callback,
+so the thread records the stack of the loop thread at that point, which shows the code doing
+sync work on the loop.
+
+LoopWatchdog runs for the life of the app.  It counts the lag and blocking calls in the metrics,
+logs the blocking calls at DEBUG and keeps the most recent ones.  In tests, wrap the calls in
+assert_loop_not_blocked to fail when a route blocks the loop.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import AsyncIterator
+
+from pydantic import BaseModel
+
+from snapdraft_server.core.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram(
+    "snapdraft_event_loop_lag_seconds",
+    "Time the watchdog's heartbeats waited to run on the event loop.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+BLOCKING_CALLS = REGISTRY.counter(
+    "snapdraft_event_loop_blocking_calls_total",
+    "Callbacks that blocked the event loop for longer than the watchdog's threshold.",
+)
+
+
+class BlockingCall(BaseModel):
+    duration_ms: float
+    stack: list[str]
+    """The loop thread's stack when the call was found, outermost frame first."""
+
+
+_frame_names: dict[CodeType, str] = {}
+
+
+def frame_name(code: CodeType) -> str:
+    name = _frame_names.get(code)
+    if name is None:
+        name = f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+        _frame_names[code] = name
+    return name
+
+
+def stack_names(frame: FrameType | None) -> list[str]:
+    """Returns the names of the frames in the stack, outermost first."""
+    ret = []
+    while frame is not None:
+        ret.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    ret.reverse()
+    return ret
+
+
+class BlockingDetector:
+    """Sends heartbeats to the loop and checks that they run, called from another thread at
+    each interval.  Blocking calls are updated in place with their duration until the loop
+    runs again."""
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        thread_id: int,
+        threshold_seconds: float,
+    ):
+        self.loop = loop
+        self.thread_id = thread_id
+        self.threshold_seconds = threshold_seconds
+        self._lock = threading.Lock()
+        self._beat_time: float | None = None
+        self._beat_sent: float | None = None
+        self._blocking: BlockingCall | None = None
+
+    def _beat(self):
+        with self._lock:
+            self._beat_time = time.perf_counter()
+
+    def check(
+        self, frame: FrameType | None = None
+    ) -> tuple[float | None, BlockingCall | None]:
+        """Returns the lag of the last heartbeat if it ran since the last check, and the
+        blocking call if one was found in this check.  frame is the loop thread's current frame
+        if the caller already has it.  Raises RuntimeError if the loop was closed."""
+        now = time.perf_counter()
+        with self._lock:
+            beat_time, self._beat_time = self._beat_time, None
+        if self._beat_sent is None or beat_time is not None:
+            lag = None
+            blocking = None
+            if beat_time is not None:
+                lag = beat_time - self._beat_sent
+                if self._blocking is not None:
+                    self._blocking.duration_ms = lag * 1000
+                elif lag >= self.threshold_seconds:
+                    # It ended between checks, so its stack wasn't seen.
+                    blocking = BlockingCall(duration_ms=lag * 1000, stack=[])
+            self._blocking = None
+            self._beat_sent = now
+            self.loop.call_soon_threadsafe(self._beat)
+            return lag, blocking
+        if now - self._beat_sent < self.threshold_seconds:
+            return None, None
+        if self._blocking is not None:
+            self._blocking.duration_ms = (now - self._beat_sent) * 1000
+            return None, None
+        if frame is None:
+            frame = sys._current_frames().get(self.thread_id)
+        self._blocking = BlockingCall(
+            duration_ms=(now - self._beat_sent) * 1000, stack=stack_names(frame)
+        )
+        return None, self._blocking
+
+
+class LoopWatchdog:
+    """Measures the lag of the loop it was started on until stopped."""
+
+    def __init__(
+        self,
+        interval_seconds: float = 0.05,
+        threshold_seconds: float = 0.1,
+        max_blocking_calls: int = 100,
+    ):
+        self.interval_seconds = interval_seconds
+        self.threshold_seconds = threshold_seconds
+        self.blocking_calls: deque[BlockingCall] = deque(maxlen=max_blocking_calls)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Starts watching the running loop, so it must be called from the loop."""
+        detector = BlockingDetector(
+            asyncio.get_running_loop(), threading.get_ident(), self.threshold_seconds
+        )
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(detector,), name="snapdraft-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, detector: BlockingDetector):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                lag, blocking = detector.check()
+            except RuntimeError:
+                # The loop was closed.
+                break
+            if lag is not None:
+                LOOP_LAG.observe(lag)
+            if blocking is not None:
+                BLOCKING_CALLS.inc()
+                self.blocking_calls.append(blocking)
+                logger.debug(
+                    "Event loop blocked for over %.0fms in:\n  %s",
+                    blocking.duration_ms,
+                    "\n  ".join(blocking.stack),
+                )
+
+
+@asynccontextmanager
+async def assert_loop_not_blocked(max_ms: float) -> AsyncIterator[LoopWatchdog]:
+    """Fails if the loop is blocked for longer than max_ms in the block, for tests."""
+    watchdog = LoopWatchdog(
+        interval_seconds=min(max_ms / 4000, 0.01), threshold_seconds=max_ms / 1000
+    )
+    watchdog.start()
+    try:
+        yield watchdog
+        # Lets the watchdog see a block at the end of the block.
+        await asyncio.sleep(watchdog.threshold_seconds + watchdog.interval_seconds)
+    finally:
+        watchdog.stop()
+    assert not watchdog.blocking_calls, "Event loop blocked:\n" + "\n".join(
+        f"{_.duration_ms:.0f}ms in {' > '.join(_.stack[-8:])}"
+        for _ in watchdog.blocking_calls
+    )
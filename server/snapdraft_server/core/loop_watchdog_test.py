@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+import pytest
+
+from snapdraft_server.core.loop_watchdog import (
+    BLOCKING_CALLS,
+    LOOP_LAG,
+    LoopWatchdog,
+    assert_loop_not_blocked,
+)
+
+
+def _block_loop(seconds: float):
+    time.sleep(seconds)
+
+
+async def test_watchdog_records_blocking_calls():
+    blocking_count = BLOCKING_CALLS.get()
+    lag_count = LOOP_LAG.get_count()
+    watchdog = LoopWatchdog(interval_seconds=0.01, threshold_seconds=0.05)
+    watchdog.start()
+    try:
+        await asyncio.sleep(0.05)
+        _block_loop(0.2)
+        await asyncio.sleep(0.05)
+    finally:
+        watchdog.stop()
+
+    [blocking] = watchdog.blocking_calls
+    assert 150 <= blocking.duration_ms < 1000
+    assert any(_.startswith("_block_loop ") for _ in blocking.stack)
+    assert BLOCKING_CALLS.get() == blocking_count + 1
+    assert LOOP_LAG.get_count() > lag_count
+
+
+async def test_assert_loop_not_blocked():
+    async with assert_loop_not_blocked(max_ms=100):
+        await asyncio.sleep(0.05)
+        await asyncio.to_thread(_block_loop, 0.2)
+
+    with pytest.raises(AssertionError, match="_block_loop"):
+        async with assert_loop_not_blocked(max_ms=50):
+            _block_loop(0.2)
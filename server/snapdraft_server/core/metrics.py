@@ -0,0 +1,244 @@
+"""Process-wide metrics, served in the Prometheus text format.
+
+Counters, gauges and histograms are created once at module level with their label names, and
+updated with the label values:
+
+    requests = REGISTRY.counter("snapdraft_requests_total", "Requests handled.", ["route"])
+    requests.inc(route="/files/")
+
+Values that are cheaper to read when scraped than to keep up to date, like cache sizes, are set
+on gauges by the metrics route just before rendering.
+
+The timings, cache hits and token counts recorded on tracing spans are turned into metrics by
+SpanMetricsExporter, so code that is traced doesn't need separate metrics calls.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from typing import Iterable
+
+from snapdraft_server.core.tracing import Span, SpanExporter, add_span_exporter
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelValues = tuple[str, ...]
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"{self.name} takes labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[_]) for _ in self.label_names)
+
+    def _format_labels(self, key: LabelValues, extra: dict[str, str] = None) -> str:
+        pairs = [*zip(self.label_names, key), *(extra or {}).items()]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._render_samples(),
+        ]
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str] = ()):
+        super().__init__(name, help, label_names)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        """Sets the total for counts that are kept elsewhere and read when scraped."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{self._format_labels(k)} {_format_value(v)}"
+            for k, v in sorted(values.items())
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        self.set_total(value, **labels)
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # For each label value: the count in each bucket, then the sum and the total count.
+        self._values: dict[LabelValues, tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for ix, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[ix] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def get_count(self, **labels) -> int:
+        return self._values.get(self._key(labels), ([], 0.0, 0))[2]
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = {k: (list(c), s, n) for k, (c, s, n) in self._values.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = self._format_labels(key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = self._format_labels(key, {"le": "+Inf"})
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def counter(self, name: str, help: str, label_names: Iterable[str] = ()):
+        return self._register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: Iterable[str] = ()):
+        return self._register(Gauge(name, help, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        label_names: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        return self._register(Histogram(name, help, label_names, buckets))
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "".join(
+            "\n".join(metric.render()) + "\n" for metric in self._metrics.values()
+        )
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "snapdraft_stage_duration_seconds",
+    "Duration of each traced stage of request handling.",
+    ["stage"],
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "snapdraft_cache_requests_total",
+    "Lookups in each cache, by whether they hit.",
+    ["cache", "result"],
+)
+LM_CALLS = REGISTRY.counter(
+    "snapdraft_lm_calls_total", "LM calls by predictor.", ["predictor", "outcome"]
+)
+LM_CALL_DURATION = REGISTRY.histogram(
+    "snapdraft_lm_call_duration_seconds",
+    "Duration of LM calls, including waiting for the rate limiter.",
+    ["predictor"],
+)
+LM_TOKENS = REGISTRY.counter(
+    "snapdraft_lm_tokens_total",
+    "Estimated tokens sent to and received from the LM.",
+    ["predictor", "direction"],
+)
+
+
+class SpanMetricsExporter(SpanExporter):
+    """Records the duration of every span, the cache hits of spans with a cache_hit attribute
+    and the calls and tokens of lm_call spans."""
+
+    def export(self, spans: list[Span]):
+        for span in spans:
+            seconds = span.duration_ms / 1000
+            STAGE_DURATION.observe(seconds, stage=span.name)
+            if "cache_hit" in span.attributes:
+                CACHE_REQUESTS.inc(
+                    cache=span.name,
+                    result="hit" if span.attributes["cache_hit"] else "miss",
+                )
+            if span.name == "lm_call":
+                predictor = span.attributes.get("predictor", "")
+                outcome = "error" if "error" in span.attributes else "success"
+                LM_CALLS.inc(predictor=predictor, outcome=outcome)
+                LM_CALL_DURATION.observe(seconds, predictor=predictor)
+                for direction in ["input", "output"]:
+                    tokens = span.attributes.get(f"{direction}_tokens")
+                    if tokens:
+                        LM_TOKENS.inc(tokens, predictor=predictor, direction=direction)
+
+
+_span_metrics_exporter = SpanMetricsExporter()
+add_span_exporter(_span_metrics_exporter)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,54 @@
+import pytest
+
+from snapdraft_server.core.metrics import CACHE_REQUESTS, MetricsRegistry
+from snapdraft_server.core.tracing import span
+
+
+def test_render():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ["route"])
+    in_flight = registry.gauge("in_flight", "In flight.")
+    latency = registry.histogram(
+        "latency_seconds", "Latency.", ["route"], buckets=[0.1, 1]
+    )
+    requests.inc(route="/files/")
+    requests.inc(2, route='/a"b')
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    latency.observe(0.05, route="/files/")
+    latency.observe(0.5, route="/files/")
+    latency.observe(5, route="/files/")
+
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{route="/a\\"b"} 2\n'
+        'requests_total{route="/files/"} 1\n'
+        "# HELP in_flight In flight.\n"
+        "# TYPE in_flight gauge\n"
+        "in_flight 1\n"
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{route="/files/",le="0.1"} 1\n'
+        'latency_seconds_bucket{route="/files/",le="1"} 2\n'
+        'latency_seconds_bucket{route="/files/",le="+Inf"} 3\n'
+        'latency_seconds_sum{route="/files/"} 5.55\n'
+        'latency_seconds_count{route="/files/"} 3\n'
+    )
+    with pytest.raises(ValueError):
+        requests.inc(path="/files/")
+    with pytest.raises(ValueError):
+        registry.counter("requests_total", "Requests.")
+
+
+def test_cache_hits_from_spans():
+    hits = CACHE_REQUESTS.get(cache="test_cache", result="hit")
+    misses = CACHE_REQUESTS.get(cache="test_cache", result="miss")
+    with span("test_cache", cache_hit=True):
+        pass
+    with span("test_cache") as lookup:
+        lookup.set_attribute("cache_hit", False)
+
+    assert CACHE_REQUESTS.get(cache="test_cache", result="hit") == hits + 1
+    assert CACHE_REQUESTS.get(cache="test_cache", result="miss") == misses + 1
@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from importlib.metadata import version
+from pathlib import Path
+
+import pymupdf
+import pymupdf4llm
+from pymupdf4llm.helpers.pymupdf_rag import IdentifyHeaders
+
+logger = logging.getLogger(__name__)
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    """PDF pages are converted in worker processes, since pymupdf4llm is CPU bound and holds the
+    GIL.  The pool is shared by all conversions."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def convert_pdf_to_markdown(
+    path: Path,
+    cache_dir: Path | None = None,
+    pages_per_chunk: int = 8,
+    executor: Executor | None = None,
+) -> str:
+    """Converts a PDF to markdown, splitting the pages into chunks that are converted in
+    parallel.  Gives the same result as calling pymupdf4llm.to_markdown on the whole file.
+
+    If cache_dir is passed, the markdown for each page is saved there, keyed by the contents of
+    the file and the pymupdf4llm version.  Converting the file again, for example after the
+    generator version changes, only converts the pages that aren't already cached.
+    """
+    file_hash = hashlib.sha256(path.read_bytes()).hexdigest()
+    with pymupdf.open(path) as doc:
+        page_count = doc.page_count
+    page_paths = [
+        _page_cache_path(cache_dir, file_hash, pno) for pno in range(page_count)
+    ]
+    pages: list[str | None] = [
+        p.read_text(encoding="utf-8") if p and p.exists() else None for p in page_paths
+    ]
+    missing = [pno for pno, page in enumerate(pages) if page is None]
+    if missing:
+        logger.info(
+            "Converting %d of %d pages of %s, %d were cached",
+            len(missing),
+            page_count,
+            path.name,
+            page_count - len(missing),
+        )
+        # Headers are identified from the font sizes used in the whole document, so it's done
+        # once here rather than separately for each chunk.
+        hdr_info = IdentifyHeaders(str(path))
+        chunks = [
+            missing[i : i + pages_per_chunk]
+            for i in range(0, len(missing), pages_per_chunk)
+        ]
+        executor = executor or get_pdf_executor()
+        results = executor.map(
+            _convert_pages, [str(path)] * len(chunks), chunks, [hdr_info] * len(chunks)
+        )
+        for chunk, texts in zip(chunks, results):
+            for pno, text in zip(chunk, texts):
+                pages[pno] = text
+                if page_paths[pno]:
+                    page_paths[pno].parent.mkdir(parents=True, exist_ok=True)
+                    page_paths[pno].write_text(text, encoding="utf-8")
+    return "".join(pages)
+
+
+def _convert_pages(path: str, pages: list[int], hdr_info: IdentifyHeaders) -> list[str]:
+    chunks = pymupdf4llm.to_markdown(
+        path, pages=pages, hdr_info=hdr_info, page_chunks=True
+    )
+    return [_["text"] for _ in chunks]
+
+
+def _page_cache_path(cache_dir: Path | None, file_hash: str, pno: int) -> Path | None:
+    if cache_dir is None:
+        return None
+    return cache_dir / f"{file_hash}-{version('pymupdf4llm')}" / f"{pno}.md"
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pymupdf
+import pymupdf4llm
+
+from snapdraft_server.core.pdf_converter import convert_pdf_to_markdown
+
+
+def _write_pdf(path: Path, page_count: int):
+    doc = pymupdf.open()
+    for pno in range(page_count):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Chapter {pno + 1}", fontsize=20)
+        page.insert_text((72, 110), f"Text on page {pno + 1}.", fontsize=11)
+    doc.save(path)
+
+
+def test_matches_whole_file_conversion(tmp_path: Path):
+    path = tmp_path / "source.pdf"
+    _write_pdf(path, 5)
+
+    with ThreadPoolExecutor(2) as executor:
+        markdown = convert_pdf_to_markdown(path, pages_per_chunk=2, executor=executor)
+
+    assert markdown == pymupdf4llm.to_markdown(path)
+    assert "# Chapter 5" in markdown
+
+
+def test_reuses_cached_pages(tmp_path: Path):
+    path = tmp_path / "source.pdf"
+    _write_pdf(path, 3)
+    cache_dir = tmp_path / "cache"
+
+    with ThreadPoolExecutor(2) as executor:
+        first = convert_pdf_to_markdown(path, cache_dir, 2, executor)
+        cached_page = next(cache_dir.glob("*/1.md"))
+        cached_page.write_text("Cached page 2\n", encoding="utf-8")
+        second = convert_pdf_to_markdown(path, cache_dir, 2, executor)
+
+    assert "Text on page 2." in first
+    assert "Cached page 2" in second
+    assert "Text on page 3." in second
@@ -0,0 +1,152 @@
+"""Statistical profiling of the event loop thread.
+
+A Profiler samples the stack of the thread running the event loop from a background thread, so
+the profiled code isn't slowed down by tracing.  Samples are counted by their folded stack,
+outermost frame first, which is the input format of flamegraph.pl and speedscope.  Samples where
+the loop is waiting for I/O are counted as idle rather than kept.
+
+The profiler also finds callbacks that block the loop for longer than slow_callback_seconds,
+with a BlockingDetector, and records the stack of the loop thread while they blocked.
+
+The loop thread's stack includes every task running on it, so a profile of one request also
+shows the requests handled at the same time.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from types import FrameType
+
+from pydantic import BaseModel, Field
+
+from snapdraft_server.core.loop_watchdog import (
+    BlockingCall,
+    BlockingDetector,
+    stack_names,
+)
+
+IDLE_MODULES = {"selectors.py"}
+
+
+class Profile(BaseModel):
+    id: str
+    started_at: datetime
+    duration_seconds: float = 0.0
+    interval_seconds: float
+    sample_count: int = 0
+    idle_sample_count: int = 0
+    stacks: dict[str, int] = Field(default_factory=dict)
+    """Number of samples of each folded stack, with frames separated by semicolons."""
+    blocking_calls: list[BlockingCall] = Field(default_factory=list)
+
+    def folded(self) -> str:
+        """Returns the samples in the folded stack format, one stack and its count per line."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+def is_idle(frame: FrameType | None) -> bool:
+    return frame is None or Path(frame.f_code.co_filename).name in IDLE_MODULES
+
+
+class Profiler:
+    """Samples the stack of the thread running the loop until stopped.  Only one profiler runs
+    at a time, since each costs a little on every sample."""
+
+    _session = threading.Lock()
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        thread_id: int,
+        profile_id: str | None = None,
+        interval_seconds: float = 0.005,
+        slow_callback_seconds: float = 0.1,
+    ):
+        self.loop = loop
+        self.thread_id = thread_id
+        self.interval_seconds = interval_seconds
+        self.slow_callback_seconds = slow_callback_seconds
+        self.profile = Profile(
+            id=profile_id or uuid.uuid4().hex,
+            started_at=datetime.now(timezone.utc),
+            interval_seconds=interval_seconds,
+        )
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def for_running_loop(cls, **kwargs) -> Profiler:
+        """Returns a profiler of the loop that this is called from."""
+        return cls(asyncio.get_running_loop(), threading.get_ident(), **kwargs)
+
+    def start(self) -> bool:
+        """Starts sampling.  Returns False if another profiler is running."""
+        if not Profiler._session.acquire(blocking=False):
+            return False
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="snapdraft-profiler", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def stop(self) -> Profile:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.profile.duration_seconds = time.perf_counter() - self._start
+            Profiler._session.release()
+        return self.profile
+
+    def _run(self):
+        profile = self.profile
+        detector = BlockingDetector(
+            self.loop, self.thread_id, self.slow_callback_seconds
+        )
+        while not self._stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            profile.sample_count += 1
+            if is_idle(frame):
+                profile.idle_sample_count += 1
+            else:
+                stack = ";".join(stack_names(frame))
+                profile.stacks[stack] = profile.stacks.get(stack, 0) + 1
+            try:
+                _, blocking = detector.check(frame)
+            except RuntimeError:
+                # The loop was closed.
+                break
+            if blocking is not None:
+                profile.blocking_calls.append(blocking)
+
+
+class ProfileStore:
+    """Keeps the most recent profiles, so they can be fetched after they were taken."""
+
+    def __init__(self, max_profiles: int = 20):
+        self.max_profiles = max_profiles
+        self._profiles: OrderedDict[str, Profile] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles[profile.id] = profile
+            self._profiles.move_to_end(profile.id)
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Profile | None:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> list[Profile]:
+        with self._lock:
+            return list(self._profiles.values())
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from snapdraft_server.core.profiler import Profiler, ProfileStore
+
+
+def _block_loop():
+    time.sleep(0.3)
+
+
+async def test_profiler_finds_blocking_calls():
+    profiler = Profiler.for_running_loop(
+        interval_seconds=0.005, slow_callback_seconds=0.1
+    )
+    assert profiler.start()
+    assert not Profiler.for_running_loop().start()
+    await asyncio.sleep(0.05)
+    _block_loop()
+    await asyncio.sleep(0.05)
+    profile = profiler.stop()
+
+    assert profile.sample_count > 0
+    assert profile.idle_sample_count > 0
+    assert any("_block_loop" in _ for _ in profile.stacks)
+    assert profile.folded().splitlines()[0].rsplit(" ", 1)[1].isdigit()
+    [blocking] = profile.blocking_calls
+    assert 200 <= blocking.duration_ms < 1000
+    assert any(_.startswith("_block_loop ") for _ in blocking.stack)
+
+    # The session is released when stopped.
+    other = Profiler.for_running_loop()
+    assert other.start()
+    other.stop()
+
+
+def test_profile_store_keeps_recent_profiles():
+    store = ProfileStore(max_profiles=2)
+    profiles = [Profiler(None, 0, profile_id=str(_)).profile for _ in range(3)]
+    for profile in profiles:
+        store.add(profile)
+
+    assert store.get("0") is None
+    assert store.list() == profiles[1:]
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+
+from pydantic import BaseModel
+
+from snapdraft_server.core.doc_section import DocSection
+
+_term_regex = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return _term_regex.findall(text.lower())
+
+
+class IndexedSection(BaseModel):
+    section_id: list[int]
+    term_counts: dict[str, int]
+    length: int
+
+
+class SectionIndex(BaseModel):
+    """A BM25 index over the sections of a preprocessed source document.
+
+    Each section is indexed by its titles (including the titles of its parents) and its own intro
+    text, so searches return the specific sections that match rather than whole chapters.  Built
+    once when the source is preprocessed and saved alongside it.
+    """
+
+    sections: list[IndexedSection]
+    document_frequencies: dict[str, int]
+    average_length: float
+    k1: float = 1.5
+    b: float = 0.75
+
+    @staticmethod
+    def build(doc: DocSection) -> SectionIndex:
+        sections = []
+        document_frequencies = Counter()
+        for section_id in doc.get_section_ids():
+            if not section_id:
+                continue
+            section = doc.find_section_by_id(section_id)
+            titles = " ".join(doc.get_title_path(section_id))
+            terms = tokenize(titles) + tokenize(section.intro_text)
+            term_counts = Counter(terms)
+            document_frequencies.update(term_counts.keys())
+            sections.append(
+                IndexedSection(
+                    section_id=section_id,
+                    term_counts=dict(term_counts),
+                    length=len(terms),
+                )
+            )
+        average_length = (
+            sum(_.length for _ in sections) / len(sections) if sections else 0.0
+        )
+        return SectionIndex(
+            sections=sections,
+            document_frequencies=dict(document_frequencies),
+            average_length=average_length,
+        )
+
+    def search(self, query: str, k: int) -> list[tuple[list[int], float]]:
+        """Returns the ids and scores of the top k sections matching the query, best first.
+        Sections with no terms in common with the query aren't returned."""
+        query_terms = set(tokenize(query))
+        n = len(self.sections)
+        scored = []
+        for section in self.sections:
+            score = 0.0
+            for term in query_terms:
+                count = section.term_counts.get(term, 0)
+                if count == 0:
+                    continue
+                df = self.document_frequencies[term]
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                norm = 1 - self.b + self.b * section.length / (self.average_length or 1)
+                score += idf * count * (self.k1 + 1) / (count + self.k1 * norm)
+            if score > 0:
+                scored.append((section.section_id, score))
+        scored.sort(key=lambda _: _[1], reverse=True)
+        return scored[:k]
@@ -0,0 +1,32 @@
+from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.section_index import SectionIndex
+
+source = DocSection.parse_markdown(
+    "Report",
+    """
+# Study Design
+Randomized, double blind trial.
+# Results
+## Efficacy
+The primary endpoint was met.
+## Adverse Events
+Headache was the most common adverse event.
+""",
+)
+
+
+def test_search_ranks_matching_sections_first():
+    index = SectionIndex.build(source)
+
+    results = index.search("adverse events", k=2)
+
+    assert results[0][0] == [1, 1]
+    assert len(results) == 1
+
+
+def test_index_round_trips_through_json():
+    index = SectionIndex.build(source)
+
+    loaded = SectionIndex.model_validate_json(index.model_dump_json())
+
+    assert loaded.search("study design", k=1) == index.search("study design", k=1)
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import logging
+import re
+from functools import lru_cache
+
+import tiktoken
+
+from snapdraft_server.core.doc_section import SectionTree
+
+logger = logging.getLogger(__name__)
+
+# Space kept back from the budget for the note listing the sections that didn't fit.
+TRUNCATION_NOTE_TOKENS = 64
+
+_approximate_token_regex = re.compile(r"\w+|[^\w\s]")
+
+
+class TokenCounter:
+    """Counts tokens locally, without calling the LM provider.
+
+    Uses a tiktoken encoding when it is available.  tiktoken downloads its encodings on first
+    use, so if that isn't possible the counts fall back to an approximation of one token per
+    word or punctuation character.
+    """
+
+    def __init__(self, encoding_name: str = "o200k_base"):
+        try:
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            logger.warning(
+                "Couldn't load tiktoken encoding %s.  Approximating token counts.",
+                encoding_name,
+            )
+            self.encoding = None
+
+    def count(self, text: str) -> int:
+        if self.encoding:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return len(_approximate_token_regex.findall(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Returns the start of the text, up to max_tokens long."""
+        if max_tokens <= 0:
+            return ""
+        if self.encoding:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return self.encoding.decode(tokens[:max_tokens])
+        matches = _approximate_token_regex.finditer(text)
+        for ix, match in enumerate(matches):
+            if ix == max_tokens:
+                return text[: match.start()]
+        return text
+
+
+@lru_cache
+def get_token_counter(encoding_name: str = "o200k_base") -> TokenCounter:
+    return TokenCounter(encoding_name)
+
+
+def fit_to_budget(
+    section: SectionTree, budget: int, counter: TokenCounter
+) -> tuple[str, int]:
+    """Renders the section as markdown, cutting it off to fit within the token budget.
+
+    Subsections are included in document order until the budget runs out.  The section that
+    overflows is truncated and the titles of the sections after it are listed in a note at the
+    end, unless the budget is too small to hold the note.  The text of the section is only read
+    and counted up to the budget, so a large document costs no more than the part included.
+    Returns the markdown and its token count.
+    """
+    pieces = []
+    counts = []
+    used = 0
+    for level, subsection in section.walk():
+        piece = subsection.heading(level) + subsection.intro_text
+        pieces.append(piece)
+        counts.append(counter.count(piece))
+        used += counts[-1]
+        if used > budget:
+            break
+    else:
+        markdown = "".join(pieces)
+        return markdown, counter.count(markdown)
+
+    note_budget = TRUNCATION_NOTE_TOKENS if budget > TRUNCATION_NOTE_TOKENS else 0
+    text_budget = budget - note_budget
+    parts = []
+    used = 0
+    full = False
+    omitted = []
+    # The pieces counted above run past the budget, so the text budget runs out among them.
+    for ix, (level, subsection) in enumerate(section.walk()):
+        if full:
+            if not note_budget:
+                break
+            if subsection.title:
+                omitted.append(subsection.title)
+            continue
+        piece = pieces[ix]
+        piece_tokens = counts[ix]
+        if text_budget - used <= 1 or used + piece_tokens > text_budget:
+            # Leaves room for the newline.
+            piece = counter.truncate(piece, text_budget - used - 1) + "\n"
+            piece_tokens = counter.count(piece)
+            full = True
+        parts.append(piece)
+        used += piece_tokens
+
+    if note_budget:
+        note = "[Truncated to fit the context."
+        if omitted:
+            note += f"  Omitted sections: {', '.join(omitted)}"
+        note = counter.truncate(note, note_budget - 2) + "]\n"
+        parts.append(note)
+        used += counter.count(note)
+    return "".join(parts), used
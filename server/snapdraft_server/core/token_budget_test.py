@@ -0,0 +1,65 @@
+from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.token_budget import TokenCounter, fit_to_budget
+
+source = DocSection.parse_markdown(
+    "Report",
+    """Summary of results
+# Methods
+"""
+    + "Measured the sample. " * 50
+    + """
+# Results
+Everything worked.
+# Discussion
+More text.
+""",
+)
+
+
+def test_fit_to_budget_keeps_sections_that_fit():
+    counter = TokenCounter()
+    markdown, tokens = fit_to_budget(source, 10000, counter)
+
+    assert markdown == source.as_markdown()
+    assert tokens == counter.count(markdown)
+
+
+def test_fit_to_budget_truncates_and_lists_omitted_sections():
+    counter = TokenCounter()
+    markdown, tokens = fit_to_budget(source, 120, counter)
+
+    assert tokens <= 120
+    assert counter.count(markdown) <= 120
+    assert markdown.startswith("Summary of results\n# Methods\nMeasured the sample.")
+    assert "Omitted sections: Results, Discussion" in markdown
+
+
+def test_fit_to_budget_drops_note_that_does_not_fit():
+    counter = TokenCounter()
+    markdown, tokens = fit_to_budget(source, 20, counter)
+
+    assert tokens <= 20
+    assert counter.count(markdown) <= 20
+    assert "Truncated" not in markdown
+    assert markdown.startswith("Summary of results\n# Methods\n")
+
+
+def test_fit_to_budget_only_counts_what_fits():
+    class RecordingCounter(TokenCounter):
+        def __init__(self):
+            super().__init__()
+            self.counted = []
+
+        def count(self, text: str) -> int:
+            self.counted.append(text)
+            return super().count(text)
+
+    document = DocSection.parse_markdown(
+        "Book", "".join(f"# Chapter {ix}\nSome text.\n" for ix in range(1000))
+    )
+    counter = RecordingCounter()
+    markdown, tokens = fit_to_budget(document, 200, counter)
+
+    assert tokens <= 200
+    assert "Omitted sections: " in markdown
+    assert sum(len(_) for _ in counter.counted) < len(document.as_markdown()) / 10
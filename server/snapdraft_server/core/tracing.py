@@ -0,0 +1,222 @@
+"""Timing spans for the stages of a request.
+
+Code wraps each stage in `with span("name", attribute=value)`.  Spans nest, and record their
+duration and attributes like token counts and cache hits.  The spans in a start_trace block are
+collected, so they can be returned to the caller, and passed to the registered SpanExporters when
+the block ends.  Spans outside of a trace, or that end after it, like those of abandoned LM call
+attempts, are exported as soon as they end.
+
+The spans of a request share a trace id, generated in the OpenTelemetry format.  The request's id
+is kept in the request_id attribute of its root spans, since the caller can choose it.
+
+The context is kept in contextvars, so spans started in threads from asyncio.to_thread or
+contextvars.copy_context are nested under the span that started the thread.
+
+The spans follow the OpenTelemetry data model.  If opentelemetry is installed, each span is also
+started as an OpenTelemetry span, so they are sent wherever the OpenTelemetry SDK is configured
+to send them.  Without an SDK they cost next to nothing.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from typing import Iterator
+
+from pydantic import BaseModel, Field, PrivateAttr, computed_field
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+AttributeValue = str | int | float | bool
+
+
+class Span(BaseModel):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: str | None = None
+    start_time_unix_nano: int
+    end_time_unix_nano: int | None = None
+    attributes: dict[str, AttributeValue] = Field(default_factory=dict)
+    _start: float = PrivateAttr(default=0.0)
+    _otel_span: object = PrivateAttr(default=None)
+
+    @computed_field
+    @property
+    def duration_ms(self) -> float | None:
+        if self.end_time_unix_nano is None:
+            return None
+        return (self.end_time_unix_nano - self.start_time_unix_nano) / 1e6
+
+    def set_attribute(self, key: str, value: AttributeValue):
+        self.attributes[key] = value
+        if self._otel_span is not None:
+            self._otel_span.set_attribute(key, value)
+
+
+class SpanExporter:
+    """Receives finished spans, like OpenTelemetry's SpanExporter."""
+
+    def export(self, spans: list[Span]):
+        raise NotImplementedError()
+
+
+class InMemorySpanExporter(SpanExporter):
+    """Keeps every exported span, for tests."""
+
+    def __init__(self):
+        self._spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, spans: list[Span]):
+        with self._lock:
+            self._spans.extend(spans)
+
+    def get_finished_spans(self) -> list[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class _Trace:
+    """The spans collected by a start_trace block."""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: list[Span] = []
+        self.ended = False
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> bool:
+        """Adds the span, unless the trace has ended.  Returns whether it was added."""
+        with self._lock:
+            if self.ended:
+                return False
+            self.spans.append(span)
+            return True
+
+    def end(self):
+        with self._lock:
+            self.ended = True
+
+
+_request_id: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "request_id", default=None
+)
+_trace_id: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "trace_id", default=None
+)
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+_trace: contextvars.ContextVar[_Trace | None] = contextvars.ContextVar(
+    "trace", default=None
+)
+_exporters: list[SpanExporter] = []
+_tracer = otel_trace.get_tracer(__name__) if otel_trace is not None else None
+
+
+def add_span_exporter(exporter: SpanExporter):
+    _exporters.append(exporter)
+
+
+def remove_span_exporter(exporter: SpanExporter):
+    _exporters.remove(exporter)
+
+
+def get_request_id() -> str | None:
+    return _request_id.get()
+
+
+@contextmanager
+def request_id_context(request_id: str) -> Iterator[None]:
+    """Sets the id of the request being handled, and starts a trace id for its spans."""
+    token = _request_id.set(request_id)
+    trace_token = _trace_id.set(_new_trace_id())
+    try:
+        yield
+    finally:
+        _trace_id.reset(trace_token)
+        _request_id.reset(token)
+
+
+@contextmanager
+def start_trace() -> Iterator[list[Span]]:
+    """Collects the spans started in this block.  The list is filled in as the spans end, spans
+    that end after the block are exported on their own."""
+    trace = _Trace(_trace_id.get() or _new_trace_id())
+    token = _trace.set(trace)
+    try:
+        yield trace.spans
+    finally:
+        _trace.reset(token)
+        trace.end()
+        _export(trace.spans)
+
+
+@contextmanager
+def span(name: str, **attributes: AttributeValue) -> Iterator[Span]:
+    parent = _current_span.get()
+    trace = _trace.get()
+    if parent is not None:
+        trace_id = parent.trace_id
+    else:
+        if trace is not None:
+            trace_id = trace.trace_id
+        else:
+            trace_id = _trace_id.get() or _new_trace_id()
+        request_id = get_request_id()
+        if request_id is not None:
+            attributes = {"request_id": request_id, **attributes}
+    current = Span(
+        name=name,
+        trace_id=trace_id,
+        span_id=uuid.uuid4().hex[:16],
+        parent_span_id=parent.span_id if parent else None,
+        start_time_unix_nano=time.time_ns(),
+        attributes=attributes,
+    )
+    current._start = time.perf_counter()
+    token = _current_span.set(current)
+    with ExitStack() as stack:
+        if _tracer is not None:
+            current._otel_span = stack.enter_context(
+                _tracer.start_as_current_span(name, attributes=attributes)
+            )
+        try:
+            yield current
+        except BaseException as e:
+            current.set_attribute("error", f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            # The duration comes from the monotonic clock, the wall clock can jump.
+            current.end_time_unix_nano = current.start_time_unix_nano + int(
+                (time.perf_counter() - current._start) * 1e9
+            )
+            _current_span.reset(token)
+            if trace is None or not trace.add(current):
+                _export([current])
+
+
+def _new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _export(spans: list[Span]):
+    for exporter in _exporters:
+        try:
+            exporter.export(spans)
+        except Exception:
+            logger.exception("Problem exporting spans with %s", type(exporter).__name__)
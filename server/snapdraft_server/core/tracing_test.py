@@ -0,0 +1,79 @@
+import asyncio
+import contextvars
+import re
+import threading
+
+import pytest
+
+from snapdraft_server.core.tracing import (
+    InMemorySpanExporter,
+    add_span_exporter,
+    remove_span_exporter,
+    request_id_context,
+    span,
+    start_trace,
+)
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemorySpanExporter()
+    add_span_exporter(exporter)
+    yield exporter
+    remove_span_exporter(exporter)
+
+
+async def test_spans_nest_across_threads(exporter):
+    def convert():
+        with span("convert", pages=3):
+            pass
+
+    with request_id_context("request-1"), start_trace() as spans:
+        with span("regenerate") as root:
+            await asyncio.to_thread(convert)
+            with span("get_local_path") as lookup:
+                lookup.set_attribute("cache_hit", True)
+
+    assert [_.name for _ in spans] == ["convert", "get_local_path", "regenerate"]
+    [trace_id] = {_.trace_id for _ in spans}
+    assert re.fullmatch("[0-9a-f]{32}", trace_id)
+    assert root.attributes == {"request_id": "request-1"}
+    assert [_.parent_span_id for _ in spans] == [root.span_id, root.span_id, None]
+    assert spans[0].attributes == {"pages": 3}
+    assert spans[1].attributes == {"cache_hit": True}
+    assert all(_.duration_ms >= 0 for _ in spans)
+    assert exporter.get_finished_spans() == spans
+
+
+def test_records_errors(exporter):
+    with pytest.raises(ValueError):
+        with span("parse"):
+            raise ValueError("bad markdown")
+
+    [parse] = exporter.get_finished_spans()
+    assert parse.attributes["error"] == "ValueError: bad markdown"
+
+
+def test_exports_spans_ending_after_trace(exporter):
+    started = threading.Event()
+    finish = threading.Event()
+
+    def abandoned_attempt():
+        with span("lm_call"):
+            started.set()
+            finish.wait()
+
+    with start_trace() as spans:
+        thread = threading.Thread(
+            target=contextvars.copy_context().run, args=(abandoned_attempt,)
+        )
+        thread.start()
+        started.wait()
+    assert spans == []
+    assert exporter.get_finished_spans() == []
+
+    finish.set()
+    thread.join()
+    assert spans == []
+    [late] = exporter.get_finished_spans()
+    assert late.name == "lm_call"
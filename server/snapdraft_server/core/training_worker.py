@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable
+
+import dspy
+from pydantic_core import to_jsonable_python
+
+from snapdraft_server.core.doc_generator import (
+    DocGenerator,
+    TrainingConfig,
+    TrainingExample,
+)
+from snapdraft_server.core.doc_template import DocTemplate
+from snapdraft_server.core.lm_limiter import (
+    LmPriority,
+    configure_lm_limiter,
+    get_lm_limiter,
+    lm_priority,
+)
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_POLL_SECONDS = 1.0
+TRAINING_LM_SHARE = 0.25
+"""Fraction of the server's LM limits the worker process may use, the rest is left for
+generation."""
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def get_training_executor() -> ProcessPoolExecutor:
+    """Training runs in a separate worker process so the optimizer doesn't block the server.
+    Only one model is trained at a time, additional jobs wait in the executor's queue.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+async def run_training(
+    generator: DocGenerator,
+    doc_template: DocTemplate,
+    examples: list[TrainingExample],
+    config: TrainingConfig,
+    on_progress: Callable[[float], Awaitable[None]],
+) -> str:
+    """Trains the generator's program in the worker process and returns its saved state as
+    JSON.  Progress reported by the worker is forwarded to on_progress.
+
+    The worker process has its own LmRateLimiter, which is given a share of the server's limits
+    so training doesn't use up the provider's rate limits."""
+    loop = asyncio.get_running_loop()
+    # The queue is a proxy to the manager process, so starting the manager and reading the queue
+    # are blocking calls, which are made in threads.
+    manager = await asyncio.to_thread(multiprocessing.get_context("spawn").Manager)
+    try:
+        progress_queue = await asyncio.to_thread(manager.Queue)
+        future = loop.run_in_executor(
+            get_training_executor(),
+            _train,
+            generator,
+            doc_template,
+            examples,
+            config,
+            dspy.settings.lm,
+            get_lm_limiter().share(TRAINING_LM_SHARE),
+            progress_queue,
+        )
+        while not future.done():
+            await asyncio.wait([future], timeout=PROGRESS_POLL_SECONDS)
+            progress = await asyncio.to_thread(_latest_progress, progress_queue)
+            if progress is not None:
+                await on_progress(progress)
+        return await future
+    finally:
+        await asyncio.to_thread(manager.shutdown)
+
+
+def _latest_progress(progress_queue) -> float | None:
+    """Empties the queue, returning the last progress in it."""
+    progress = None
+    while not progress_queue.empty():
+        progress = progress_queue.get_nowait()
+    return progress
+
+
+def _train(
+    generator: DocGenerator,
+    doc_template: DocTemplate,
+    examples: list[TrainingExample],
+    config: TrainingConfig,
+    lm: dspy.LM,
+    lm_limits: dict,
+    progress_queue,
+) -> str:
+    """Entry point in the worker process."""
+    if lm is None:
+        raise ValueError("No LM is configured for training.")
+    # Configured globally, rather than with dspy.context, so that the threads used to make
+    # parallel LM calls see it.
+    dspy.configure(lm=lm)
+    configure_lm_limiter(**lm_limits)
+    with lm_priority(LmPriority.TRAINING):
+        program = generator.train(
+            doc_template, examples, config, on_progress=progress_queue.put
+        )
+    return json.dumps(to_jsonable_python(program.dump_state()))
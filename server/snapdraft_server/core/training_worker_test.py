@@ -0,0 +1,63 @@
+import json
+
+import dspy
+import pytest
+from dspy.utils import DummyLM
+
+from snapdraft_server.core.default_doc_generator import DefaultDocGenerator
+from snapdraft_server.core.doc_generator import TrainingConfig, TrainingExample
+from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.doc_template import (
+    DocTemplate,
+    SectionInstructions,
+    SourceReference,
+)
+from snapdraft_server.core.token_budget import get_token_counter
+from snapdraft_server.core.training_worker import run_training
+
+
+@pytest.mark.asyncio
+async def test_run_training():
+    template = DocTemplate(
+        title="Summary",
+        template_md="# Findings\n",
+        section_instructions=[
+            SectionInstructions(
+                section_id=[0],
+                source_sections=[SourceReference(doc_name="Report")],
+            ),
+        ],
+    )
+    examples = [
+        TrainingExample(
+            sources={
+                "Report": DocSection.parse_markdown(
+                    "Report", f"Result {ix} found\n" + "Details of the study. " * 500
+                )
+            },
+            output_markdown=f"# Findings\nResult {ix} found\n",
+        )
+        for ix in range(4)
+    ]
+    config = TrainingConfig(num_threads=2, demo_context_token_budget=100)
+    lm = DummyLM([{"reasoning": "r", "markdown": "Result found"}] * 10)
+
+    async def on_progress(value: float):
+        pass
+
+    # Trained in the worker process.
+    with dspy.context(lm=lm):
+        program_json = await run_training(
+            DefaultDocGenerator(), template, examples, config, on_progress
+        )
+
+    state = json.loads(program_json)
+    assert state["selector.predict"]["demos"] == []
+    demos = state["authorer.predict"]["demos"]
+    assert len(demos) == 2
+    counter = get_token_counter()
+    for demo in demos:
+        assert sum(counter.count(_["markdown"]) for _ in demo["context"]) <= 100
+    program = DefaultDocGenerator().create_program()
+    program.load_state(state)
+    assert len(program.authorer.predict.demos) == 2
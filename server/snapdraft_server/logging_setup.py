@@ -1,13 +1,109 @@
 import json
 import logging
 import logging.config
+import logging.handlers
+import threading
+import time
 from pathlib import Path
 
+from snapdraft_server.core.tracing import get_request_id
+
+MAX_SAMPLED_TEMPLATES = 1000
+
 
 def setup_logging():
     with open(Path(__file__).parent / "logging_config.json", "r") as f:
         log_config = json.load(f)
     logging.config.dictConfig(log_config)
+    # dictConfig creates the queue handler's listener, but leaves starting it to the caller.
+    logging.getHandlerByName("queue").listener.start()
+
+
+class Truncated:
+    """Wraps a log argument that might be large, like a generated document.  It is only turned
+    into a string if the record is emitted, and then cut to at most limit characters.
+
+        logger.debug("Generated %s", Truncated(markdown))
+    """
+
+    def __init__(self, value, limit: int = 500):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text) - self.limit} more characters)"
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the id of the request being handled to each record, as request_id."""
+
+    def filter(self, record):
+        record.request_id = get_request_id() or "-"
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Passes at most burst records below WARNING for each message template in each period.  The
+    next record that passes after some were dropped says how many were, so loops that log each
+    item keep a sample of their logs."""
+
+    def __init__(self, burst: int = 20, period_seconds: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.period_seconds = period_seconds
+        # For each template: the start of its period, the records passed and dropped in it.
+        self._counts: dict[tuple[str, object], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        # Objects logged as the message, rather than a format string, are counted by type.
+        template = record.msg if isinstance(record.msg, str) else type(record.msg)
+        key = (record.name, template)
+        now = time.monotonic()
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None or now - counts[0] >= self.period_seconds:
+                dropped = counts[2] if counts else 0
+                if counts is None and len(self._counts) >= MAX_SAMPLED_TEMPLATES:
+                    self._forget_expired(now)
+                counts = self._counts[key] = [now, 0, dropped]
+            if counts[1] >= self.burst:
+                counts[2] += 1
+                return False
+            counts[1] += 1
+            dropped, counts[2] = counts[2], 0
+        if dropped:
+            record.msg = f"{record.msg} (dropped {dropped} similar messages)"
+        return True
+
+    def _forget_expired(self, now: float):
+        for key, counts in list(self._counts.items()):
+            if now - counts[0] >= self.period_seconds and not counts[2]:
+                del self._counts[key]
+
+
+class NonBlockingHandler(logging.handlers.QueueHandler):
+    """Puts records on a queue, and a listener thread passes them to the handlers.  Writing to
+    the handlers' streams can block, which would stall the event loop.
+
+    dictConfig creates the queue and the listener from the handler's "handlers" key, and
+    setup_logging starts the listener.  Messages are still formatted before they are queued,
+    since the arguments might change after the call.  Filters on this handler run in the thread
+    that logs, so they see its context.
+    """
+
+    def close(self):
+        # Emits the queued records before the handlers are closed.
+        if self.listener is not None:
+            if self.listener._thread is not None:
+                self.listener.stop()
+            self.listener = None
+        super().close()
 
 
 # ANSI escape codes for colors
@@ -0,0 +1,85 @@
+import logging
+import queue
+
+from snapdraft_server.core.tracing import request_id_context
+from snapdraft_server.logging_setup import (
+    NonBlockingHandler,
+    RequestIdFilter,
+    SamplingFilter,
+    Truncated,
+    setup_logging,
+)
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _record(msg: object, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, msg, None, None)
+
+
+def test_truncated():
+    assert str(Truncated("short")) == "short"
+    assert str(Truncated("x" * 30, limit=10)) == "xxxxxxxxxx... (20 more characters)"
+
+
+def test_sampling_filter():
+    sampling = SamplingFilter(burst=2, period_seconds=60)
+    passed = [sampling.filter(_record("Item %s")) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert sampling.filter(_record("Other %s"))
+    assert sampling.filter(_record("Item %s", logging.WARNING))
+    assert sampling.filter(_record(["not", "a", "string"]))
+
+    sampling.period_seconds = 0
+    record = _record("Item %s")
+    assert sampling.filter(record)
+    assert record.msg == "Item %s (dropped 3 similar messages)"
+
+
+def test_non_blocking_handler():
+    target = _ListHandler()
+    handler = NonBlockingHandler(queue.Queue())
+    handler.listener = logging.handlers.QueueListener(handler.queue, target)
+    handler.listener.start()
+    handler.addFilter(RequestIdFilter())
+    logger = logging.getLogger("snapdraft_server.logging_setup_test.non_blocking")
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        with request_id_context("request-1"):
+            logger.warning("Generated %s", Truncated("x" * 30, limit=10))
+    finally:
+        logger.removeHandler(handler)
+        # Waits for the queued records.
+        handler.close()
+
+    assert [_.getMessage() for _ in target.records] == [
+        "Generated xxxxxxxxxx... (20 more characters)"
+    ]
+    assert target.records[0].request_id == "request-1"
+
+
+def test_setup_logging(monkeypatch):
+    setup_logging()
+    try:
+        handler = logging.getHandlerByName("queue")
+        console = logging.getHandlerByName("console")
+        assert logging.getLogger().handlers == [handler]
+        assert handler.listener.handlers == (console,)
+        records = []
+        monkeypatch.setattr(console, "emit", records.append)
+
+        logging.getLogger("snapdraft_server.logging_setup_test").warning("Started")
+        # Waits for the queued records.
+        handler.close()
+
+        assert [_.getMessage() for _ in records] == ["Started"]
+    finally:
+        setup_logging()
@@ -6,6 +6,8 @@ import dspy
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from snapdraft_server.core.lm_call_policy import configure_lm_call_policy
+from snapdraft_server.core.lm_limiter import configure_lm_limiter
 from snapdraft_server.logging_setup import setup_logging
 from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
 from snapdraft_server.routes.app_setup import create_app
@@ -13,8 +15,23 @@ from snapdraft_server.routes.app_setup import create_app
 load_dotenv()
 setup_logging()
 
-llm = dspy.LM(model="gpt-4o", max_tokens=4096)
+# LiteLLM doesn't retry, rate limited calls are retried by the LmRateLimiter as it backs off.
+llm = dspy.LM(model="gpt-4o", max_tokens=4096, num_retries=0)
 dspy.settings.configure(lm=llm)
+configure_lm_limiter(
+    requests_per_minute=float(os.getenv("LM_REQUESTS_PER_MINUTE", "500")),
+    tokens_per_minute=float(os.getenv("LM_TOKENS_PER_MINUTE", "150000")),
+    max_concurrency=int(os.getenv("LM_MAX_CONCURRENCY", "16")),
+)
+fallback_model = os.getenv("LM_FALLBACK_MODEL")
+configure_lm_call_policy(
+    deadline_seconds=float(os.getenv("LM_CALL_DEADLINE_SECONDS", "180")),
+    fallback_lm=(
+        dspy.LM(model=fallback_model, max_tokens=4096, num_retries=0)
+        if fallback_model
+        else None
+    ),
+)
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DATABASE_NAME = "snapdraft"
@@ -30,8 +47,19 @@ local_cache_dir = Path("output/local_cache")
 local_cache_dir.mkdir(parents=True, exist_ok=True)
 dspy_dir = Path("output/dspy")
 dspy_dir.mkdir(parents=True, exist_ok=True)
+# Callbacks that block the event loop for longer are counted and logged at DEBUG.
+blocking_threshold_ms = float(os.getenv("LOOP_BLOCKING_THRESHOLD_MS", "100"))
 app = create_app(
-    origins, mongo_client, local_cache_dir=local_cache_dir, dspy_dir=dspy_dir
+    origins,
+    mongo_client,
+    local_cache_dir=local_cache_dir,
+    dspy_dir=dspy_dir,
+    # Enables the admin routes, like profiling, for requests with this token.
+    admin_token=os.getenv("SNAPDRAFT_ADMIN_TOKEN"),
+    blocking_threshold_seconds=blocking_threshold_ms / 1000,
+    metrics_enabled=os.getenv("SNAPDRAFT_METRICS_ENABLED", "true").lower() == "true",
+    # Scrapers need to send this as a bearer token, if it's set.
+    metrics_token=os.getenv("SNAPDRAFT_METRICS_TOKEN"),
 )
 
 # Run with: poetry run uvicorn snapdraft_server.main:app --reload
@@ -0,0 +1,87 @@
+import asyncio
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from snapdraft_server.core.profiler import Profile, Profiler, ProfileStore
+from snapdraft_server.routes.dependencies import get_admin_token, get_profile_store
+
+
+def verify_admin_token(
+    authorization: str | None = Header(None),
+    admin_token: str | None = Depends(get_admin_token),
+):
+    if admin_token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if authorization is None or not secrets.compare_digest(
+        authorization.encode(), f"Bearer {admin_token}".encode()
+    ):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+router = APIRouter(dependencies=[Depends(verify_admin_token)])
+
+
+@router.post(
+    "/profiles",
+    response_model=Profile,
+    operation_id="create_profile",
+)
+async def create_profile(
+    seconds: float = Query(10.0, gt=0, le=300),
+    interval_seconds: float = Query(0.005, ge=0.001, le=1),
+    slow_callback_seconds: float = Query(0.1, gt=0),
+    profile_store: ProfileStore = Depends(get_profile_store),
+):
+    """Profiles the worker's event loop for the given number of seconds."""
+    profiler = Profiler.for_running_loop(
+        interval_seconds=interval_seconds, slow_callback_seconds=slow_callback_seconds
+    )
+    if not profiler.start():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile = profiler.stop()
+        profile_store.add(profile)
+    return profile
+
+
+@router.get(
+    "/profiles",
+    response_model=list[Profile],
+    operation_id="read_all_profiles",
+)
+async def read_all_profiles(profile_store: ProfileStore = Depends(get_profile_store)):
+    return profile_store.list()
+
+
+@router.get(
+    "/profiles/{profile_id}",
+    response_model=Profile,
+    operation_id="read_profile",
+)
+async def read_profile(
+    profile_id: str, profile_store: ProfileStore = Depends(get_profile_store)
+):
+    return _get_profile(profile_store, profile_id)
+
+
+@router.get(
+    "/profiles/{profile_id}/folded",
+    response_class=PlainTextResponse,
+    operation_id="read_profile_folded",
+)
+async def read_profile_folded(
+    profile_id: str, profile_store: ProfileStore = Depends(get_profile_store)
+):
+    """Returns the samples as folded stacks, for flamegraph.pl or speedscope."""
+    return _get_profile(profile_store, profile_id).folded()
+
+
+def _get_profile(profile_store: ProfileStore, profile_id: str) -> Profile:
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return profile
@@ -0,0 +1,50 @@
+import pytest
+
+from snapdraft_server.routes.app_fixture import ADMIN_TOKEN, admin_client, client
+
+ADMIN_HEADERS = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
+
+
+@pytest.mark.asyncio
+async def test_admin_routes_disabled_without_token(client):
+    async with client as ac:
+        response = await ac.post("/admin/profiles", params={"seconds": 0.01})
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_create_profile(admin_client):
+    async with admin_client as ac:
+        response = await ac.post("/admin/profiles", params={"seconds": 0.01})
+        assert response.status_code == 403
+
+        response = await ac.post(
+            "/admin/profiles", params={"seconds": 0.05}, headers=ADMIN_HEADERS
+        )
+        assert response.status_code == 200
+        profile = response.json()
+        assert profile["sample_count"] > 0
+
+        response = await ac.get(
+            f"/admin/profiles/{profile['id']}/folded", headers=ADMIN_HEADERS
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+
+
+@pytest.mark.asyncio
+async def test_profile_request(admin_client):
+    async with admin_client as ac:
+        response = await ac.get(
+            "/generators/read_all_generators",
+            headers={"X-Snapdraft-Profile": ADMIN_TOKEN},
+        )
+        assert response.status_code == 200
+        request_id = response.headers["X-Request-ID"]
+
+        response = await ac.get(f"/admin/profiles/{request_id}", headers=ADMIN_HEADERS)
+        assert response.status_code == 200
+        assert response.json()["id"] == request_id
+
+        response = await ac.get("/admin/profiles", headers=ADMIN_HEADERS)
+        assert [_["id"] for _ in response.json()] == [request_id]
@@ -13,8 +13,28 @@ from snapdraft_server.routes.app_setup import create_app
 logger = logging.getLogger(__name__)
 
 
+ADMIN_TOKEN = "test-admin-token"
+METRICS_TOKEN = "test-metrics-token"
+
+
 @pytest.fixture()
 def client(mongodb):
+    yield from _client()
+
+
+@pytest.fixture()
+def admin_client(mongodb):
+    """A client of an app with the admin routes enabled, for ADMIN_TOKEN."""
+    yield from _client(admin_token=ADMIN_TOKEN)
+
+
+@pytest.fixture()
+def metrics_token_client(mongodb):
+    """A client of an app that requires METRICS_TOKEN for /metrics."""
+    yield from _client(metrics_token=METRICS_TOKEN)
+
+
+def _client(admin_token: str | None = None, metrics_token: str | None = None):
     snapdraft_mongo = SnapdraftMongo(
         AsyncMongoMockClient(),
         "snapdraft_unittest",
@@ -32,7 +52,12 @@ def client(mongodb):
     shutil.rmtree(dspy_dir, ignore_errors=True)
     dspy_dir.mkdir(parents=True, exist_ok=True)
     app = create_app(
-        origins, snapdraft_mongo, local_cache_dir=local_cache_dir, dspy_dir=dspy_dir
+        origins,
+        snapdraft_mongo,
+        local_cache_dir=local_cache_dir,
+        dspy_dir=dspy_dir,
+        admin_token=admin_token,
+        metrics_token=metrics_token,
     )
 
     yield AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
@@ -1,27 +1,45 @@
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, Request, BackgroundTasks
 from fastapi.responses import JSONResponse
 from starlette.middleware.cors import CORSMiddleware
 
+from snapdraft_server.core.loop_watchdog import LoopWatchdog
+from snapdraft_server.core.profiler import ProfileStore
 from snapdraft_server.routes import generator_routes
+from snapdraft_server.routes.profiling import ProfilingMiddleware
+from snapdraft_server.routes.request_id import RequestIdMiddleware
+from snapdraft_server.routes.request_metrics import RequestMetricsMiddleware
+from snapdraft_server.services.base.background_job import fail_interrupted_jobs
+from snapdraft_server.services.batch_generation_service import BatchGenerationService
 from snapdraft_server.services.draft_service import DraftService
 from snapdraft_server.services.doc_type_service import DocumentTypeService
 from snapdraft_server.services.base.snapdraft_mongo import (
     SnapdraftMongo,
 )
 from snapdraft_server.routes.dependencies import (
+    get_admin_token,
+    get_metrics_token,
+    get_batch_generation_service,
     get_dspy_dir,
     get_doc_type_service,
     get_draft_service,
     get_mongo_client,
     get_file_service,
+    get_ingest_service,
     get_local_cache_dir,
     get_model_service,
+    get_profile_store,
 )
 from snapdraft_server.services.file_service import FileService
+from snapdraft_server.services.ingest_service import IngestService
 from snapdraft_server.services.model_service import ModelService
+from snapdraft_server.services.prefetcher import Prefetcher
+from snapdraft_server.services.program_cache import ProgramCache
+from snapdraft_server.services.source_cache import SourceCache
+from snapdraft_server.services.template_cache import TemplateCache
 
 logger = logging.getLogger(__name__)
 
@@ -31,11 +49,37 @@ def create_app(
     mongo_client: SnapdraftMongo,
     local_cache_dir: Path = None,
     dspy_dir: Path = None,
+    admin_token: str | None = None,
+    blocking_threshold_seconds: float | None = 0.1,
+    metrics_enabled: bool = True,
+    metrics_token: str | None = None,
 ) -> FastAPI:
+    """Creates the app.  The admin routes, including profiling, are only enabled with an
+    admin_token.  While the app runs, callbacks that block the event loop for longer than
+    blocking_threshold_seconds are counted and logged, unless it's None.  /metrics is served
+    if metrics_enabled, and requires metrics_token as a bearer token if it's set."""
+    from snapdraft_server.routes import admin_routes
     from snapdraft_server.routes import document_type_routes
     from snapdraft_server.routes import file_routes
-
-    app = FastAPI()
+    from snapdraft_server.routes import metrics_routes
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        watchdog = None
+        if blocking_threshold_seconds is not None:
+            watchdog = LoopWatchdog(threshold_seconds=blocking_threshold_seconds)
+            watchdog.start()
+        # Jobs left running by a server that stopped would otherwise show as running forever.
+        for collection_name in ["ingest_job", "batch_generation_job"]:
+            await fail_interrupted_jobs(mongo_client.db[collection_name])
+        try:
+            yield
+        finally:
+            await prefetcher.close()
+            if watchdog is not None:
+                watchdog.stop()
+
+    app = FastAPI(lifespan=lifespan)
 
     # Add CORS middleware to allow your frontend to access the API
     app.add_middleware(
@@ -44,7 +88,16 @@ def create_app(
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Request-ID"],
     )
+    profile_store = ProfileStore()
+    if admin_token:
+        # Inside RequestIdMiddleware, so profiles are stored under the request id.
+        app.add_middleware(
+            ProfilingMiddleware, admin_token=admin_token, profile_store=profile_store
+        )
+    app.add_middleware(RequestIdMiddleware)
+    app.add_middleware(RequestMetricsMiddleware)
 
     @app.exception_handler(Exception)
     async def custom_exception_handler(request: Request, exc: Exception):
@@ -73,6 +126,18 @@ def create_app(
         prefix="/files",
         tags=["files"],
     )
+    if admin_token:
+        app.include_router(
+            admin_routes.router,
+            prefix="/admin",
+            tags=["admin"],
+        )
+    if metrics_enabled:
+        app.include_router(
+            metrics_routes.router,
+            prefix="/metrics",
+            tags=["metrics"],
+        )
 
     def override_get_local_cache_dir():
         return local_cache_dir
@@ -90,11 +155,16 @@ def create_app(
         return mongo_client
 
     app.dependency_overrides[get_mongo_client] = override_get_mongo_client
+    app.dependency_overrides[get_admin_token] = lambda: admin_token or None
+    app.dependency_overrides[get_metrics_token] = lambda: metrics_token or None
+    app.dependency_overrides[get_profile_store] = lambda: profile_store
 
-    def override_get_doc_type_service():
-        return DocumentTypeService(mongo_client)
-
-    app.dependency_overrides[get_doc_type_service] = override_get_doc_type_service
+    # Shared across requests so that templates, trained programs and sources are only loaded
+    # once.
+    template_cache = TemplateCache()
+    program_cache = ProgramCache()
+    source_cache = SourceCache()
+    prefetcher = Prefetcher()
 
     def override_get_file_service():
         local_cache_dir = override_get_local_cache_dir()
@@ -102,11 +172,24 @@ def create_app(
 
     app.dependency_overrides[get_file_service] = override_get_file_service
 
+    def override_get_doc_type_service():
+        return DocumentTypeService(
+            mongo_client, override_get_file_service(), template_cache
+        )
+
+    app.dependency_overrides[get_doc_type_service] = override_get_doc_type_service
+
     def override_get_draft_service(background_tasks: BackgroundTasks):
         doc_type_service = override_get_doc_type_service()
         file_service = override_get_file_service()
         return DraftService(
-            mongo_client, doc_type_service, file_service, background_tasks
+            mongo_client,
+            doc_type_service,
+            file_service,
+            program_cache,
+            source_cache,
+            prefetcher,
+            background_tasks,
         )
 
     app.dependency_overrides[get_draft_service] = override_get_draft_service
@@ -117,9 +200,31 @@ def create_app(
             doc_type_service=override_get_doc_type_service(),
             file_service=override_get_file_service(),
             draft_service=override_get_draft_service(background_tasks),
+            program_cache=program_cache,
             background_tasks=background_tasks,
         )
 
     app.dependency_overrides[get_model_service] = override_get_model_service
 
+    def override_get_ingest_service(background_tasks: BackgroundTasks):
+        return IngestService(
+            mongo_client,
+            draft_service=override_get_draft_service(background_tasks),
+            file_service=override_get_file_service(),
+            background_tasks=background_tasks,
+        )
+
+    app.dependency_overrides[get_ingest_service] = override_get_ingest_service
+
+    def override_get_batch_generation_service(background_tasks: BackgroundTasks):
+        return BatchGenerationService(
+            mongo_client,
+            draft_service=override_get_draft_service(background_tasks),
+            background_tasks=background_tasks,
+        )
+
+    app.dependency_overrides[get_batch_generation_service] = (
+        override_get_batch_generation_service
+    )
+
     return app
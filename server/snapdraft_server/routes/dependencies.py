@@ -4,10 +4,13 @@ from typing import Generator
 from fastapi import BackgroundTasks
 
 from snapdraft_server.core.default_doc_generator import DefaultDocGenerator
+from snapdraft_server.core.profiler import ProfileStore
+from snapdraft_server.services.batch_generation_service import BatchGenerationService
 from snapdraft_server.services.doc_type_service import DocumentTypeService
 from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
 from snapdraft_server.services.draft_service import DraftService
 from snapdraft_server.services.file_service import FileService
+from snapdraft_server.services.ingest_service import IngestService
 from snapdraft_server.services.model_service import ModelService
 
 
@@ -23,6 +26,20 @@ def get_mongo_client() -> Generator[SnapdraftMongo, any, None]:
     raise AssertionError("get_db should be overridden in the app dependencies.")
 
 
+def get_admin_token() -> str | None:
+    """The token for the admin routes, they are disabled without one."""
+    return None
+
+
+def get_metrics_token() -> str | None:
+    """The bearer token /metrics requires, it's open to anyone without one."""
+    return None
+
+
+def get_profile_store() -> ProfileStore:
+    raise AssertionError("should be overridden in the app dependencies.")
+
+
 def get_doc_type_service() -> DocumentTypeService:
     raise AssertionError("should be overridden in the app dependencies.")
 
@@ -39,6 +56,16 @@ def get_model_service(background_tasks: BackgroundTasks) -> ModelService:
     raise AssertionError("should be overridden in the app dependencies.")
 
 
+def get_ingest_service(background_tasks: BackgroundTasks) -> IngestService:
+    raise AssertionError("should be overridden in the app dependencies.")
+
+
+def get_batch_generation_service(
+    background_tasks: BackgroundTasks,
+) -> BatchGenerationService:
+    raise AssertionError("should be overridden in the app dependencies.")
+
+
 def get_generator_name():
     return "DefaultGenerator"
 
@@ -1,30 +1,44 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import logging
+from typing import AsyncIterator
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, File, UploadFile
+from starlette.responses import StreamingResponse
 
 from snapdraft_server.services.draft_model import (
     DraftCreate,
     Draft,
     GenerateDraftResult,
     RegeneratedDraftResult,
+    WarmDraftResult,
 )
 from snapdraft_server.services.doc_type_model import DocumentType
 from snapdraft_server.services.doc_type_service import DocumentTypeService
 from snapdraft_server.routes.dependencies import (
+    get_batch_generation_service,
     get_doc_type_service,
     get_draft_service,
     get_model_service,
     get_file_service,
+    get_ingest_service,
     get_generator,
     get_generator_name,
 )
 from snapdraft_server.services.base.result_list import ResultList
+from snapdraft_server.services.batch_generation_model import (
+    BatchGenerationCreate,
+    BatchGenerationJob,
+)
+from snapdraft_server.services.batch_generation_service import BatchGenerationService
 from snapdraft_server.services.draft_service import (
     DraftService,
 )
 from snapdraft_server.services.file_service import FileService
+from snapdraft_server.services.ingest_model import IngestJob
+from snapdraft_server.services.ingest_service import IngestService
 from snapdraft_server.services.model_model import Model, ModelCreate
 from snapdraft_server.services.model_service import ModelService
 
@@ -111,11 +125,34 @@ async def read_draft(
     draft_id: str,
     draft_service: DraftService = Depends(get_draft_service),
 ):
-    return await draft_service.get(draft_id)
+    """Starts warming the caches for the draft, since it's likely to be generated next.  Sources
+    that haven't been preprocessed are left to the preprocessing started when the draft was
+    saved."""
+    draft = await draft_service.get(draft_id)
+    draft_service.prefetch(doc_id, draft, preprocess=False)
+    return draft
+
+
+@router.post(
+    "/{doc_id}/drafts/{draft_id}/warm",
+    response_model=WarmDraftResult,
+    operation_id="warm_draft",
+)
+async def warm_draft(
+    doc_id: str,
+    draft_id: str,
+    draft_service: DraftService = Depends(get_draft_service),
+):
+    """Loads what generating the draft needs into the caches, preprocessing sources that haven't
+    been, and returns when it's done."""
+    draft = await draft_service.get(draft_id)
+    # Shielded, so the warm-up carries on if the client goes away.
+    return await asyncio.shield(draft_service.prefetch(doc_id, draft))
 
 
 @router.get(
     "/{doc_id}/drafts/{draft_id}/source/{source}/preprocessed",
+    response_model=str,
     operation_id="read_draft_preprocessed_source",
 )
 async def read_draft_preprocessed_source(
@@ -123,14 +160,24 @@ async def read_draft_preprocessed_source(
     draft_id: str,
     source: str,
     draft_service: DraftService = Depends(get_draft_service),
-) -> str:
+):
     draft = await draft_service.get(draft_id)
     generator_name = get_generator_name()
     generator = get_generator(generator_name)
-    preprocessed_data = await draft_service.get_preprocessed_file(
+    markdown = await draft_service.get_preprocessed_markdown_stream(
         source, draft.source_file_ids[source], generator, generator_name
     )
-    return preprocessed_data.as_markdown()
+    return StreamingResponse(
+        _json_string_stream(markdown), media_type="application/json"
+    )
+
+
+async def _json_string_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Streams the chunks as one JSON string, the same as returning their concatenation."""
+    yield '"'
+    async for chunk in chunks:
+        yield json.dumps(chunk, ensure_ascii=False)[1:-1]
+    yield '"'
 
 
 @router.put(
@@ -175,6 +222,36 @@ async def read_all_drafts(
     return await draft_service.list_by_doc_type(doc_id)
 
 
+@router.post(
+    "/{doc_id}/ingest/",
+    response_model=IngestJob,
+    operation_id="ingest_drafts",
+)
+async def ingest_drafts(
+    doc_id: str,
+    archive: UploadFile = File(...),
+    doc_type_service: DocumentTypeService = Depends(get_doc_type_service),
+    ingest_service: IngestService = Depends(get_ingest_service),
+):
+    """Creates drafts in bulk from a zip archive with a manifest.json.  The drafts are created in
+    the background, poll the returned job for progress."""
+    doc_type = await doc_type_service.get(doc_id)
+    return await ingest_service.start_ingest(doc_id, archive)
+
+
+@router.get(
+    "/{doc_id}/ingest/{job_id}",
+    response_model=IngestJob,
+    operation_id="read_ingest_job",
+)
+async def read_ingest_job(
+    doc_id: str,
+    job_id: str,
+    ingest_service: IngestService = Depends(get_ingest_service),
+):
+    return await ingest_service.get_for_doc_type(doc_id, job_id)
+
+
 @router.post(
     "/{doc_id}/drafts/{draft_id}/generate",
     response_model=GenerateDraftResult,
@@ -183,9 +260,11 @@ async def read_all_drafts(
 async def generate_draft(
     doc_id: str,
     draft_id: str,
+    debug: bool = False,
     draft_service: DraftService = Depends(get_draft_service),
 ):
-    return await draft_service.generate(doc_id, draft_id)
+    """Pass debug=true to get the timings of each stage of the generation."""
+    return await draft_service.generate(doc_id, draft_id, debug=debug)
 
 
 @router.post(
@@ -198,9 +277,42 @@ async def regenerate_draft(
     draft_id: str,
     previous_text: str,
     user_prompt: str,
+    debug: bool = False,
     draft_service: DraftService = Depends(get_draft_service),
 ):
-    return await draft_service.regenerate(doc_id, draft_id, previous_text, user_prompt)
+    """Pass debug=true to get the timings of each stage of the generation."""
+    return await draft_service.regenerate(
+        doc_id, draft_id, previous_text, user_prompt, debug=debug
+    )
+
+
+@router.post(
+    "/{doc_id}/batch-generations/",
+    response_model=BatchGenerationJob,
+    operation_id="create_batch_generation",
+)
+async def create_batch_generation(
+    doc_id: str,
+    batch: BatchGenerationCreate,
+    doc_type_service: DocumentTypeService = Depends(get_doc_type_service),
+    batch_service: BatchGenerationService = Depends(get_batch_generation_service),
+):
+    """Generates many drafts in the background, poll the returned job for progress."""
+    doc_type = await doc_type_service.get(doc_id)
+    return await batch_service.start_batch(doc_id, batch)
+
+
+@router.get(
+    "/{doc_id}/batch-generations/{job_id}",
+    response_model=BatchGenerationJob,
+    operation_id="read_batch_generation",
+)
+async def read_batch_generation(
+    doc_id: str,
+    job_id: str,
+    batch_service: BatchGenerationService = Depends(get_batch_generation_service),
+):
+    return await batch_service.get_for_doc_type(doc_id, job_id)
 
 
 @router.get(
@@ -1,9 +1,17 @@
+import asyncio
 import io
+import json
 import logging
+import zipfile
 
+import dspy
 import pytest
+from dspy.utils import DummyLM
 
+from snapdraft_server.benchmarks.corpus import make_docx, section_title
+from snapdraft_server.core.loop_watchdog import assert_loop_not_blocked
 from snapdraft_server.routes.app_fixture import client
+from snapdraft_server.services import model_service
 
 logger = logging.getLogger(__name__)
 
@@ -83,6 +91,437 @@ async def test_read_all_document_types(client):
         assert len(result_list["items"]) == 1
 
 
+@pytest.mark.asyncio
+async def test_ingest_drafts(client):
+    manifest = {
+        "drafts": [
+            {"name": "Study 1", "output": "study1/report.md"},
+            {"name": "Study 2", "output": "study2/missing.md"},
+        ]
+    }
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as f:
+        f.writestr("manifest.json", json.dumps(manifest))
+        f.writestr("study1/report.md", "# Summary\nThe study worked.\n")
+    archive.seek(0)
+
+    async with client as ac:
+        response = await ac.post("/document-types/", json={"name": "Test Document"})
+        document_id = response.json()["id"]
+
+        files = {"archive": ("drafts.zip", archive, "application/zip")}
+        response = await ac.post(f"/document-types/{document_id}/ingest/", files=files)
+        assert response.status_code == 200
+        job_id = response.json()["id"]
+
+        # The background task finishes before the test client returns.
+        response = await ac.get(f"/document-types/{document_id}/ingest/{job_id}")
+        job = response.json()
+        assert job["status"] == "Complete"
+        assert job["progress"] == 1.0
+        assert (job["completed"], job["failed"]) == (1, 1)
+        assert job["errors"][0]["draft_name"] == "Study 2"
+
+        response = await ac.post("/document-types/", json={"name": "Other"})
+        other_id = response.json()["id"]
+        response = await ac.get(f"/document-types/{other_id}/ingest/{job_id}")
+        assert response.status_code == 404
+
+        response = await ac.get(f"/document-types/{document_id}/drafts/")
+        drafts = response.json()["items"]
+        assert [_["name"] for _ in drafts] == ["Study 1"]
+        assert drafts[0]["output_file_md_id"] == drafts[0]["output_file_id"]
+
+
+@pytest.mark.asyncio
+async def test_batch_generation(client):
+    template = {
+        "title": "Summary",
+        "template_md": "# Findings\n",
+        "section_instructions": [{"section_id": [0], "source_sections": []}],
+    }
+    lm = DummyLM([{"reasoning": "r", "markdown": "Generated findings"}] * 4)
+
+    with dspy.context(lm=lm):
+        async with client as ac:
+            files = {
+                "file": ("template.json", json.dumps(template), "application/json")
+            }
+            response = await ac.post("/files/upload/", files=files)
+            template_file_id = response.json()["id"]
+            response = await ac.post(
+                "/document-types/",
+                json={"name": "Test Document", "template_file_id": template_file_id},
+            )
+            document_id = response.json()["id"]
+            for name in ["Draft 1", "Draft 2"]:
+                await ac.post(
+                    f"/document-types/{document_id}/drafts/", json={"name": name}
+                )
+
+            response = await ac.post(
+                f"/document-types/{document_id}/batch-generations/", json={}
+            )
+            assert response.status_code == 200
+            job_id = response.json()["id"]
+
+            response = await ac.get(
+                f"/document-types/{document_id}/batch-generations/{job_id}"
+            )
+            job = response.json()
+            assert job["status"] == "Complete"
+            assert (job["completed"], job["failed"]) == (2, 0)
+            assert set(job["generated_file_ids"]) == set(job["draft_ids"])
+
+            # The job isn't found under another document type.
+            response = await ac.post("/document-types/", json={"name": "Other"})
+            other_id = response.json()["id"]
+            response = await ac.get(
+                f"/document-types/{other_id}/batch-generations/{job_id}"
+            )
+            assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_generate_draft_debug(client):
+    template = {
+        "title": "Summary",
+        "template_md": "# Findings\n",
+        "section_instructions": [{"section_id": [0], "source_sections": []}],
+    }
+    lm = DummyLM([{"reasoning": "r", "markdown": "Generated findings"}])
+
+    with dspy.context(lm=lm):
+        async with client as ac:
+            files = {
+                "file": ("template.json", json.dumps(template), "application/json")
+            }
+            response = await ac.post("/files/upload/", files=files)
+            response = await ac.post(
+                "/document-types/",
+                json={
+                    "name": "Test Document",
+                    "template_file_id": response.json()["id"],
+                },
+            )
+            document_id = response.json()["id"]
+            response = await ac.post(
+                f"/document-types/{document_id}/drafts/", json={"name": "Draft"}
+            )
+            draft_id = response.json()["id"]
+
+            response = await ac.post(
+                f"/document-types/{document_id}/drafts/{draft_id}/generate",
+                params={"debug": True},
+                headers={"X-Request-ID": "request-1"},
+            )
+
+    assert response.headers["X-Request-ID"] == "request-1"
+    debug = response.json()["debug"]
+    assert debug["request_id"] == "request-1"
+    spans = {_["name"]: _ for _ in debug["spans"]}
+    assert {
+        "get_template",
+        "load_program",
+        "generate_section",
+        "lm_call",
+        "as_markdown",
+        "save_generation",
+        "regenerate",
+    } <= set(spans)
+    assert spans["lm_call"]["attributes"]["input_tokens"] > 0
+    assert spans["load_program"]["attributes"]["cache_hit"] is False
+
+
+@pytest.mark.asyncio
+async def test_generate_draft_again(client):
+    template = {
+        "title": "Summary",
+        "template_md": "# Findings\n",
+        "section_instructions": [{"section_id": [0], "source_sections": []}],
+    }
+    lm = DummyLM(
+        [
+            {"reasoning": "r", "markdown": "First findings"},
+            {"reasoning": "r", "markdown": "Second findings"},
+        ]
+    )
+
+    with dspy.context(lm=lm):
+        async with client as ac:
+            files = {
+                "file": ("template.json", json.dumps(template), "application/json")
+            }
+            response = await ac.post("/files/upload/", files=files)
+            response = await ac.post(
+                "/document-types/",
+                json={
+                    "name": "Test Document",
+                    "template_file_id": response.json()["id"],
+                },
+            )
+            document_id = response.json()["id"]
+            response = await ac.post(
+                f"/document-types/{document_id}/drafts/", json={"name": "Draft"}
+            )
+            draft_id = response.json()["id"]
+
+            url = f"/document-types/{document_id}/drafts/{draft_id}/generate"
+            first = await ac.post(url)
+            # Generating again writes the draft afresh rather than reusing the last one.
+            second = await ac.post(url)
+
+    assert "First findings" in first.json()["text"]
+    assert "Second findings" in second.json()["text"]
+
+
+@pytest.mark.asyncio
+async def test_generate_with_active_model(client, monkeypatch):
+    template = {
+        "title": "Summary",
+        "template_md": "# Findings\n",
+        "section_instructions": [{"section_id": [0], "source_sections": []}],
+    }
+    lm = DummyLM([{"reasoning": "r", "markdown": "Findings"}] * 4)
+
+    async def run_training(generator, doc_template, examples, config, on_progress):
+        program = generator.create_program()
+        program.authorer.predict.signature = (
+            program.authorer.predict.signature.with_instructions(
+                "Write like the trained model."
+            )
+        )
+        return json.dumps(program.dump_state())
+
+    monkeypatch.setattr(model_service, "run_training", run_training)
+
+    def load_program_span(response):
+        spans = {_["name"]: _ for _ in response.json()["debug"]["spans"]}
+        return spans["load_program"]["attributes"]
+
+    with dspy.context(lm=lm):
+        async with client as ac:
+            files = {
+                "file": ("template.json", json.dumps(template), "application/json")
+            }
+            response = await ac.post("/files/upload/", files=files)
+            response = await ac.post(
+                "/document-types/",
+                json={
+                    "name": "Test Document",
+                    "template_file_id": response.json()["id"],
+                },
+            )
+            document_id = response.json()["id"]
+            response = await ac.post(
+                f"/document-types/{document_id}/drafts/", json={"name": "Draft"}
+            )
+            draft_id = response.json()["id"]
+            url = f"/document-types/{document_id}/drafts/{draft_id}/generate"
+
+            response = await ac.post(url, params={"debug": True})
+            assert load_program_span(response)["cache_hit"] is False
+            response = await ac.post(url, params={"debug": True})
+            assert load_program_span(response)["cache_hit"] is True
+
+            # Trained in the background task of the request.
+            response = await ac.post(f"/document-types/{document_id}/models/", json={})
+            model_id = response.json()["id"]
+            response = await ac.post(
+                f"/document-types/{document_id}/models/{model_id}/default"
+            )
+            assert response.json()["status"] == "Ready"
+            assert "Write like the trained model." not in str(lm.history[-1])
+
+            response = await ac.post(url, params={"debug": True})
+            assert load_program_span(response)["cache_hit"] is False
+            assert "Write like the trained model." in str(lm.history[-1])
+
+
+@pytest.mark.asyncio
+async def test_activate_model_while_training(client, monkeypatch):
+    training = asyncio.Event()
+    activated = asyncio.Event()
+
+    async def run_training(generator, doc_template, examples, config, on_progress):
+        training.set()
+        await activated.wait()
+        await on_progress(0.5)
+        return json.dumps(generator.create_program().dump_state())
+
+    monkeypatch.setattr(model_service, "run_training", run_training)
+
+    async with client as ac:
+        response = await ac.post("/document-types/", json={"name": "Test Document"})
+        document_id = response.json()["id"]
+        models_url = f"/document-types/{document_id}/models/"
+        # Creates the default model.
+        await ac.get(models_url)
+
+        # Trained in the background task of the request.
+        create = asyncio.create_task(ac.post(models_url, json={}))
+        await training.wait()
+        response = await ac.get(models_url)
+        [model] = [_ for _ in response.json()["items"] if _["status"] == "Training"]
+        await ac.post(f"{models_url}{model['id']}/default")
+        activated.set()
+        await create
+
+        response = await ac.get(models_url)
+
+    models = {_["id"]: _ for _ in response.json()["items"]}
+    assert models[model["id"]]["is_active"] is True
+    assert models[model["id"]]["status"] == "Ready"
+    assert [_ for _ in models.values() if _["is_active"]] == [models[model["id"]]]
+
+
+@pytest.mark.asyncio
+async def test_generate_draft_does_not_block_loop(client):
+    template = {
+        "title": "Summary",
+        "template_md": "# Findings\n",
+        "section_instructions": [
+            {
+                "section_id": [0],
+                "source_sections": [
+                    {"doc_name": "source", "section_name": section_title(0)}
+                ],
+            }
+        ],
+    }
+    lm = DummyLM([{"reasoning": "r", "markdown": "Generated findings"}])
+
+    with dspy.context(lm=lm):
+        async with client as ac:
+            files = {
+                "file": ("template.json", json.dumps(template), "application/json")
+            }
+            response = await ac.post("/files/upload/", files=files)
+            response = await ac.post(
+                "/document-types/",
+                json={
+                    "name": "Test Document",
+                    "sources": [{"name": "source", "description": "The source"}],
+                    "template_file_id": response.json()["id"],
+                },
+            )
+            document_id = response.json()["id"]
+            files = {"file": ("source.docx", make_docx(50), "application/octet-stream")}
+            response = await ac.post("/files/upload/", files=files)
+            source_file_id = response.json()["id"]
+
+            # Preprocessing and generation run their slow parts in threads.
+            async with assert_loop_not_blocked(max_ms=250):
+                response = await ac.post(
+                    f"/document-types/{document_id}/drafts/",
+                    json={
+                        "name": "Draft",
+                        "source_file_ids": {"source": source_file_id},
+                    },
+                )
+                draft_id = response.json()["id"]
+                response = await ac.post(
+                    f"/document-types/{document_id}/drafts/{draft_id}/generate"
+                )
+                assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_read_draft_preprocessed_source(client):
+    async with client as ac:
+        response = await ac.post(
+            "/document-types/",
+            json={
+                "name": "Test Document",
+                "sources": [{"name": "source", "description": "The source"}],
+            },
+        )
+        document_id = response.json()["id"]
+        files = {"file": ("source.docx", make_docx(3), "application/octet-stream")}
+        response = await ac.post("/files/upload/", files=files)
+        response = await ac.post(
+            f"/document-types/{document_id}/drafts/",
+            json={
+                "name": "Draft",
+                "source_file_ids": {"source": response.json()["id"]},
+            },
+        )
+        draft_id = response.json()["id"]
+
+        # Streamed from the file saved when the draft was created.
+        response = await ac.get(
+            f"/document-types/{document_id}/drafts/{draft_id}/source/source/preprocessed"
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    markdown = response.json()
+    assert f"# {section_title(0)}\n" in markdown
+    assert f"# {section_title(2)}\n" in markdown
+
+
+@pytest.mark.asyncio
+async def test_warm_draft(client):
+    template = {
+        "title": "Summary",
+        "template_md": "# Findings\n",
+        "section_instructions": [
+            {
+                "section_id": [0],
+                "source_sections": [
+                    {"doc_name": "source", "section_name": section_title(0)}
+                ],
+            }
+        ],
+    }
+    lm = DummyLM([{"reasoning": "r", "markdown": "Generated findings"}])
+
+    with dspy.context(lm=lm):
+        async with client as ac:
+            files = {
+                "file": ("template.json", json.dumps(template), "application/json")
+            }
+            response = await ac.post("/files/upload/", files=files)
+            response = await ac.post(
+                "/document-types/",
+                json={
+                    "name": "Test Document",
+                    "sources": [{"name": "source", "description": "The source"}],
+                    "template_file_id": response.json()["id"],
+                },
+            )
+            document_id = response.json()["id"]
+            files = {"file": ("source.docx", make_docx(3), "application/octet-stream")}
+            response = await ac.post("/files/upload/", files=files)
+            response = await ac.post(
+                f"/document-types/{document_id}/drafts/",
+                json={
+                    "name": "Draft",
+                    "source_file_ids": {"source": response.json()["id"]},
+                },
+            )
+            draft_id = response.json()["id"]
+
+            response = await ac.post(
+                f"/document-types/{document_id}/drafts/{draft_id}/warm"
+            )
+            assert response.json() == {
+                "warmed": ["template", "program", "source"],
+                "failed": [],
+                "skipped": [],
+            }
+
+            response = await ac.post(
+                f"/document-types/{document_id}/drafts/{draft_id}/generate",
+                params={"debug": True},
+            )
+
+    spans = {_["name"]: _ for _ in response.json()["debug"]["spans"]}
+    assert spans["get_generation_source"]["attributes"]["cache_hit"] is True
+    assert spans["load_program"]["attributes"]["cache_hit"] is True
+    assert "get_preprocessed_file" not in spans
+
+
 # Need to mock preprocessing appropriately
 # @pytest.mark.asyncio
 # async def test_create_draft_doc(client):
@@ -3,7 +3,11 @@ import logging
 
 import pytest
 
-from snapdraft_server.routes.app_fixture import client
+from snapdraft_server.routes.app_fixture import (
+    METRICS_TOKEN,
+    client,
+    metrics_token_client,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -25,3 +29,38 @@ async def test_create_stored_file(client):
         logger.info(f"Response: {data}")
         assert data["id"] is not None
         assert data["metadata"]["original_filename"] == "test_file.txt"
+
+
+@pytest.mark.asyncio
+async def test_read_metrics(client):
+    async with client as ac:
+        files = {"file": ("test_file.txt", b"Test file content", "text/plain")}
+        response = await ac.post("/files/upload/", files=files)
+        file_id = response.json()["id"]
+        await ac.get(f"/files/{file_id}")
+        response = await ac.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+        assert (
+            'snapdraft_http_request_duration_seconds_count{method="POST",route="/files/upload/",status="200"}'
+            in text
+        )
+        assert 'route="/files/{file_id}"' in text
+        assert "snapdraft_http_requests_in_flight 1" in text
+        assert "snapdraft_local_cache_bytes" in text
+        assert 'snapdraft_background_jobs_running{kind="ingest"} 0' in text
+        assert "snapdraft_lm_rate_fraction 1" in text
+
+
+@pytest.mark.asyncio
+async def test_read_metrics_with_token(metrics_token_client):
+    async with metrics_token_client as ac:
+        response = await ac.get("/metrics")
+        assert response.status_code == 403
+
+        response = await ac.get(
+            "/metrics", headers={"Authorization": f"Bearer {METRICS_TOKEN}"}
+        )
+        assert response.status_code == 200
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import secrets
+from pathlib import Path
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from snapdraft_server.core.lm_limiter import get_lm_limiter
+from snapdraft_server.core.metrics import REGISTRY
+from snapdraft_server.routes.dependencies import (
+    get_local_cache_dir,
+    get_metrics_token,
+    get_mongo_client,
+)
+from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
+
+
+def verify_metrics_token(
+    authorization: str | None = Header(None),
+    metrics_token: str | None = Depends(get_metrics_token),
+):
+    if metrics_token is None:
+        return
+    if authorization is None or not secrets.compare_digest(
+        authorization.encode(), f"Bearer {metrics_token}".encode()
+    ):
+        raise HTTPException(status_code=403, detail="Metrics token required")
+
+
+router = APIRouter(dependencies=[Depends(verify_metrics_token)])
+
+LOCAL_CACHE_BYTES = REGISTRY.gauge(
+    "snapdraft_local_cache_bytes", "Size of the files in the local cache."
+)
+LOCAL_CACHE_FILES = REGISTRY.gauge(
+    "snapdraft_local_cache_files", "Number of files in the local cache."
+)
+LM_IN_FLIGHT = REGISTRY.gauge("snapdraft_lm_in_flight", "LM calls being made.")
+LM_RATE_FRACTION = REGISTRY.gauge(
+    "snapdraft_lm_rate_fraction",
+    "Fraction of the configured LM rates allowed, lowered after being rate limited.",
+)
+LM_RATE_LIMITED = REGISTRY.counter(
+    "snapdraft_lm_rate_limited_total", "LM calls rejected by the provider's rate limit."
+)
+LM_LIMITER_WAITS = REGISTRY.counter(
+    "snapdraft_lm_limiter_waits_total",
+    "LM calls that went through the rate limiter.",
+    ["priority"],
+)
+LM_LIMITER_WAIT_SECONDS = REGISTRY.counter(
+    "snapdraft_lm_limiter_wait_seconds_total",
+    "Time LM calls spent waiting for the rate limiter.",
+    ["priority"],
+)
+BACKGROUND_JOBS = REGISTRY.gauge(
+    "snapdraft_background_jobs_running", "Background jobs in progress.", ["kind"]
+)
+BACKGROUND_JOB_ITEMS = REGISTRY.gauge(
+    "snapdraft_background_job_items_pending",
+    "Drafts still to be processed by the running background jobs.",
+    ["kind"],
+)
+
+
+@router.get("", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics(
+    mongo_client: SnapdraftMongo = Depends(get_mongo_client),
+    local_cache_dir: Path = Depends(get_local_cache_dir),
+):
+    """Serves the metrics in the Prometheus text format."""
+    size, count = await asyncio.to_thread(_directory_size, local_cache_dir)
+    LOCAL_CACHE_BYTES.set(size)
+    LOCAL_CACHE_FILES.set(count)
+    _update_lm_limiter_metrics()
+    await _update_background_job_metrics(mongo_client)
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def _directory_size(path: Path) -> tuple[int, int]:
+    size = 0
+    count = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.stat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                continue
+            count += 1
+    return size, count
+
+
+def _update_lm_limiter_metrics():
+    limiter = get_lm_limiter()
+    LM_IN_FLIGHT.set(limiter.in_flight)
+    LM_RATE_FRACTION.set(limiter.rate_fraction)
+    LM_RATE_LIMITED.set_total(limiter.rate_limited_count)
+    for priority, stats in limiter.wait_stats.items():
+        LM_LIMITER_WAITS.set_total(stats.calls, priority=priority.name.lower())
+        LM_LIMITER_WAIT_SECONDS.set_total(
+            stats.total_wait_seconds, priority=priority.name.lower()
+        )
+
+
+async def _update_background_job_metrics(mongo_client: SnapdraftMongo):
+    db = mongo_client.db
+    for kind, collection, total in [
+        ("ingest", "ingest_job", {"$ifNull": ["$total", 0]}),
+        ("batch_generation", "batch_generation_job", {"$size": "$draft_ids"}),
+    ]:
+        running, pending = await _count_running_jobs(db[collection], total)
+        BACKGROUND_JOBS.set(running, kind=kind)
+        BACKGROUND_JOB_ITEMS.set(pending, kind=kind)
+    training = await db["model"].count_documents({"status": "Training"})
+    BACKGROUND_JOBS.set(training, kind="training")
+
+
+async def _count_running_jobs(collection, total: dict) -> tuple[int, int]:
+    """Returns the number of running jobs and the items they have left, counted in the
+    database so the jobs' documents aren't loaded."""
+    done = {"$add": [{"$ifNull": ["$completed", 0]}, {"$ifNull": ["$failed", 0]}]}
+    results = await collection.aggregate(
+        [
+            {"$match": {"status": "Running"}},
+            {
+                "$group": {
+                    "_id": None,
+                    "running": {"$sum": 1},
+                    "pending": {"$sum": {"$max": [{"$subtract": [total, done]}, 0]}},
+                }
+            },
+        ]
+    ).to_list(None)
+    if not results:
+        return 0, 0
+    return results[0]["running"], results[0]["pending"]
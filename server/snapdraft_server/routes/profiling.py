@@ -0,0 +1,48 @@
+import logging
+import secrets
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from snapdraft_server.core.profiler import Profiler, ProfileStore
+from snapdraft_server.core.tracing import get_request_id
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Snapdraft-Profile"
+
+
+class ProfilingMiddleware:
+    """Profiles requests sent with the admin token in the X-Snapdraft-Profile header.  The
+    profile is stored under the request id, which is returned in the X-Request-ID header.
+
+    Only added to the app when an admin token is configured, other requests only pay for
+    looking up the header."""
+
+    def __init__(self, app: ASGIApp, admin_token: str, profile_store: ProfileStore):
+        self.app = app
+        self.admin_token = admin_token
+        self.profile_store = profile_store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = PROFILE_HEADER.lower().encode()
+        token = next((v for k, v in scope["headers"] if k == header), None)
+        if token is None or not secrets.compare_digest(
+            token, self.admin_token.encode()
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = Profiler.for_running_loop(profile_id=get_request_id())
+        if not profiler.start():
+            logger.warning(
+                "Not profiling %s, a profile is already running", scope["path"]
+            )
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profile_store.add(profiler.stop())
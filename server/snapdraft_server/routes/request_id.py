@@ -0,0 +1,42 @@
+import uuid
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from snapdraft_server.core.tracing import request_id_context
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+
+class RequestIdMiddleware:
+    """Gives each request an id, used for its traces and returned in the X-Request-ID header.
+    The caller's id is used if it sent one.
+
+    Written as plain ASGI middleware, since BaseHTTPMiddleware runs the endpoint in another task
+    and the id is kept in a contextvar."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = REQUEST_ID_HEADER.lower().encode()
+        request_id = (
+            next(
+                (value.decode() for key, value in scope["headers"] if key == header),
+                None,
+            )
+            or uuid.uuid4().hex
+        )
+
+        async def send_with_request_id(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (header, request_id.encode()),
+                ]
+            await send(message)
+
+        with request_id_context(request_id):
+            await self.app(scope, receive, send_with_request_id)
@@ -0,0 +1,59 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from snapdraft_server.core.metrics import REGISTRY
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "snapdraft_http_request_duration_seconds",
+    "Time to handle each request, including its background tasks.",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "snapdraft_http_requests_in_flight", "Requests being handled."
+)
+
+
+class RequestMetricsMiddleware:
+    """Records the latency of each request by route template, so requests for different ids
+    share a series."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=route_template(scope),
+                status=status,
+            )
+
+
+def route_template(scope: Scope) -> str:
+    """Returns the path with the path parameters replaced by their names, like
+    /files/{file_id}.  The routes of included routers don't have the prefix, so the template is
+    rebuilt from the path parameters the router added to the scope."""
+    if "route" not in scope:
+        return "unmatched"
+    names = {str(v): k for k, v in scope.get("path_params", {}).items()}
+    return "/".join(
+        f"{{{names[_]}}}" if _ in names else _ for _ in scope["path"].split("/")
+    )
@@ -0,0 +1,168 @@
+import asyncio
+import datetime
+import logging
+from typing import Awaitable, Callable, Iterable, Type, TypeVar
+
+from bson import ObjectId
+from fastapi import BackgroundTasks, HTTPException
+from pydantic import BaseModel, Field, computed_field
+
+from snapdraft_server.services.base.base_collection import BaseCollection
+from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+HEARTBEAT_SECONDS = 30.0
+"""How often a running job records that it's still running."""
+STALE_HEARTBEAT_SECONDS = 5 * HEARTBEAT_SECONDS
+"""A running job without a heartbeat for this long is taken to have been interrupted."""
+
+
+class BackgroundJob(BaseModel):
+    """A job that processes the items of a document type in the background, recording how many
+    have been processed as they finish.
+
+    Jobs run in the server process that started them, so they stop if it does.  A running job
+    records a heartbeat, and jobs whose heartbeat stops are marked as failed by
+    fail_interrupted_jobs when the server starts."""
+
+    doc_type_id: str
+    status: str = Field(default="Running")
+    completed: int = 0
+    failed: int = 0
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.now)
+    heartbeat_at: datetime.datetime = Field(default_factory=datetime.datetime.now)
+    """When the job last recorded that it's running."""
+    id: str | None = None
+
+    def total_items(self) -> int:
+        raise NotImplementedError()
+
+    @computed_field
+    @property
+    def progress(self) -> float:
+        """Fraction of the items that have been processed, successfully or not."""
+        total = self.total_items()
+        return (self.completed + self.failed) / total if total else 1.0
+
+
+J = TypeVar("J", bound=BackgroundJob)
+
+
+async def fail_interrupted_jobs(collection) -> int:
+    """Marks the running jobs in the collection that stopped recording heartbeats as failed,
+    since the process running them stopped.  Returns the number of jobs marked."""
+    cutoff = datetime.datetime.now() - datetime.timedelta(
+        seconds=STALE_HEARTBEAT_SECONDS
+    )
+    result = await collection.update_many(
+        {
+            "status": "Running",
+            "$or": [
+                {"heartbeat_at": {"$lt": cutoff}},
+                {"heartbeat_at": {"$exists": False}},
+            ],
+        },
+        {"$set": {"status": "Failed"}},
+    )
+    if result.modified_count:
+        logger.warning(
+            "Marked %d interrupted jobs in %s as failed",
+            result.modified_count,
+            collection.name,
+        )
+    return result.modified_count
+
+
+async def run_bounded(
+    items: Iterable[T], process: Callable[[T], Awaitable[None]], concurrency: int
+):
+    """Calls process for each item, with a fixed number of workers pulling the items from a
+    bounded queue.  Only a few items are taken from the iterable ahead of the workers, however
+    many there are."""
+    queue: asyncio.Queue[T | None] = asyncio.Queue(maxsize=concurrency)
+
+    async def worker():
+        while (item := await queue.get()) is not None:
+            await process(item)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for item in items:
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for worker_task in workers:
+            worker_task.cancel()
+
+
+class BackgroundJobCollection(BaseCollection[J]):
+    """A collection of BackgroundJobs, with the helpers to run them and record their progress.
+    Jobs are run after the request that started them, with its BackgroundTasks."""
+
+    def __init__(
+        self,
+        client: SnapdraftMongo,
+        collection_name: str,
+        model_class: Type[J],
+        background_tasks: BackgroundTasks,
+        concurrency: int,
+    ):
+        super().__init__(client, collection_name, model_class)
+        self.background_tasks = background_tasks
+        self.concurrency = concurrency
+
+    async def get_for_doc_type(self, doc_type_id: str, id: str) -> J:
+        """Returns the job, raising a 404 if it isn't a job of the document type."""
+        job = await self.get(id)
+        if job.doc_type_id != doc_type_id:
+            raise HTTPException(
+                status_code=404, detail=f"{self.collection_name} {id} not found"
+            )
+        return job
+
+    async def _run_job(self, job: J, run: Callable[[], Awaitable[None]]):
+        """Runs the job, then sets its status to Complete, or Failed if run raises.  Errors of
+        individual items are expected to be recorded by run, rather than raised."""
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        status = "Complete"
+        try:
+            await run()
+        except Exception:
+            logger.exception("Problem running %s %s", self.collection_name, job.id)
+            status = "Failed"
+        finally:
+            heartbeat.cancel()
+        await self.collection.update_one(
+            {"_id": ObjectId(job.id)}, {"$set": {"status": status}}
+        )
+
+    async def _heartbeat(self, job: J):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await self.collection.update_one(
+                    {"_id": ObjectId(job.id)},
+                    {"$set": {"heartbeat_at": datetime.datetime.now()}},
+                )
+            except Exception:
+                logger.warning(
+                    "Couldn't record the heartbeat of %s", job.id, exc_info=True
+                )
+
+    async def _record_completed(self, job: J, update: dict):
+        """Counts an item as completed, applying the update to the job."""
+        await self.collection.update_one(
+            {"_id": ObjectId(job.id)}, {"$inc": {"completed": 1}, **update}
+        )
+
+    async def _record_failed(self, job: J, error: BaseModel):
+        """Counts an item as failed, adding the error to the job's errors."""
+        await self.collection.update_one(
+            {"_id": ObjectId(job.id)},
+            {"$inc": {"failed": 1}, "$push": {"errors": error.model_dump()}},
+        )
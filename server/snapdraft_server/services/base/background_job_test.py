@@ -0,0 +1,38 @@
+import datetime
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from snapdraft_server.services.base.background_job import fail_interrupted_jobs
+
+
+@pytest.mark.asyncio
+async def test_fail_interrupted_jobs():
+    collection = AsyncMongoMockClient()["snapdraft_unittest"]["ingest_job"]
+    now = datetime.datetime.now()
+    await collection.insert_many(
+        [
+            {
+                "_id": "stopped",
+                "status": "Running",
+                "heartbeat_at": now.replace(year=2000),
+            },
+            {"_id": "running", "status": "Running", "heartbeat_at": now},
+            {"_id": "unrecorded", "status": "Running"},
+            {
+                "_id": "complete",
+                "status": "Complete",
+                "heartbeat_at": now.replace(year=2000),
+            },
+        ]
+    )
+
+    assert await fail_interrupted_jobs(collection) == 2
+
+    statuses = {_["_id"]: _["status"] async for _ in collection.find()}
+    assert statuses == {
+        "stopped": "Failed",
+        "running": "Running",
+        "unrecorded": "Failed",
+        "complete": "Complete",
+    }
@@ -0,0 +1,50 @@
+import asyncio
+import contextvars
+import threading
+from typing import Callable, TypeVar
+
+from snapdraft_server.core.metrics import REGISTRY
+
+T = TypeVar("T")
+
+EXECUTOR_QUEUED = REGISTRY.gauge(
+    "snapdraft_executor_queued_tasks",
+    "Tasks waiting for a thread in the event loop's default executor.",
+    ["task"],
+)
+EXECUTOR_ACTIVE = REGISTRY.gauge(
+    "snapdraft_executor_active_tasks",
+    "Tasks running in the event loop's default executor.",
+    ["task"],
+)
+
+
+async def run_in_executor(task: str, func: Callable[[], T]) -> T:
+    """Runs func in the loop's default executor, counting the tasks that are waiting for a
+    thread and running by the task name.  The context is copied, so spans started by func are
+    nested under the caller's."""
+    context = contextvars.copy_context()
+    lock = threading.Lock()
+    queued = True
+
+    def leave_queue():
+        nonlocal queued
+        with lock:
+            if queued:
+                queued = False
+                EXECUTOR_QUEUED.dec(task=task)
+
+    def run():
+        leave_queue()
+        EXECUTOR_ACTIVE.inc(task=task)
+        try:
+            return context.run(func)
+        finally:
+            EXECUTOR_ACTIVE.dec(task=task)
+
+    EXECUTOR_QUEUED.inc(task=task)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+    finally:
+        # Tasks cancelled before they started never run.
+        leave_queue()
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class AsyncLruCache(Generic[K, V]):
+    """In memory LRU cache for values that are loaded asynchronously.
+
+    Caches that should be shared across requests need to be created once with the app, since
+    the services are created per request.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._values: OrderedDict[K, V] = OrderedDict()
+        self._loading: dict[K, asyncio.Future[V]] = {}
+
+    async def get(self, key: K, load: Callable[[], Awaitable[V]]) -> V:
+        """Returns the cached value for the key, calling load to create it on a miss.  Concurrent
+        misses for the same key wait for a single load."""
+        if key in self._values:
+            self._values.move_to_end(key)
+            return self._values[key]
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = asyncio.ensure_future(load())
+            self._loading[key] = loading
+            loading.add_done_callback(lambda _: self._loaded(key, loading))
+        return await asyncio.shield(loading)
+
+    def _loaded(self, key: K, loading: asyncio.Future[V]):
+        # A load that was invalidated, or replaced by a newer one, isn't stored.
+        if self._loading.get(key) is not loading:
+            return
+        del self._loading[key]
+        if loading.cancelled() or loading.exception() is not None:
+            return
+        self._values[key] = loading.result()
+        if len(self._values) > self.max_size:
+            evicted, _ = self._values.popitem(last=False)
+            logger.debug("%s evicted %s", type(self).__name__, evicted)
+
+    def invalidate(self, key: K):
+        """Drops the cached value for the key.  A load that is in progress still returns to its
+        waiters but isn't stored."""
+        self._values.pop(key, None)
+        self._loading.pop(key, None)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from snapdraft_server.services.base.lru_cache import AsyncLruCache
+
+
+@pytest.mark.asyncio
+async def test_get():
+    cache = AsyncLruCache[str, int](max_size=2)
+    loads = []
+
+    async def load(value: int) -> int:
+        loads.append(value)
+        await asyncio.sleep(0)
+        return value
+
+    values = await asyncio.gather(
+        cache.get("a", lambda: load(1)), cache.get("a", lambda: load(2))
+    )
+    assert values == [1, 1]
+    assert await cache.get("a", lambda: load(3)) == 1
+    assert loads == [1]
+
+    await cache.get("b", lambda: load(4))
+    await cache.get("c", lambda: load(5))
+    assert "a" not in cache
+    assert len(cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate_during_load():
+    cache = AsyncLruCache[str, str](max_size=2)
+    release_old = asyncio.Event()
+
+    async def load_old() -> str:
+        await release_old.wait()
+        return "old"
+
+    async def load_new() -> str:
+        return "new"
+
+    old = asyncio.create_task(cache.get("a", load_old))
+    await asyncio.sleep(0)
+    cache.invalidate("a")
+    new = asyncio.create_task(cache.get("a", load_new))
+    await asyncio.sleep(0)
+    assert await new == "new"
+    release_old.set()
+
+    # The old load still returns to its waiter, but doesn't replace the new value.
+    assert await old == "old"
+    assert await cache.get("a", load_old) == "new"
+
+    cache.invalidate("a")
+    release_old.clear()
+    old = asyncio.create_task(cache.get("a", load_old))
+    await asyncio.sleep(0)
+    cache.invalidate("a")
+    release_old.set()
+    assert await old == "old"
+    assert "a" not in cache
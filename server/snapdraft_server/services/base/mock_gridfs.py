@@ -2,7 +2,10 @@ import os
 from dataclasses import dataclass, field
 from pathlib import Path
 
+from bson import ObjectId
+
 from snapdraft_server.services.file_model import StoredFile
+from snapdraft_server.util.async_io import read_bytes, run_io, write, write_bytes
 
 
 @dataclass
@@ -16,8 +19,12 @@ class MockAsyncIOMotorGridFSBucket:
     dir: Path
     next_id: int = 0
     files: dict[str, MockFile] = field(default_factory=dict)
+    db: any = None
 
-    def __call__(self, *args, **kwargs):
+    def __call__(self, db, *args, **kwargs):
+        # Called with the database like AsyncIOMotorGridFSBucket, which is where the file
+        # documents are stored.
+        self.db = db
         return self
 
     def __post_init__(self):
@@ -27,6 +34,12 @@ class MockAsyncIOMotorGridFSBucket:
         id = hex(self.next_id)[2:].zfill(24)
         self.next_id += 1
         self.files[id] = MockFile(filename, metadata)
-        with open(self.dir / f"{id}", "wb") as f:
-            f.write(source.read())
+        await write_bytes(self.dir / f"{id}", await run_io(source.read))
+        if self.db is not None:
+            await self.db["fs.files"].insert_one(
+                {"_id": ObjectId(id), "filename": filename, "metadata": metadata}
+            )
         return id
+
+    async def download_to_stream(self, file_id: ObjectId, destination: any):
+        await write(destination, await read_bytes(self.dir / f"{file_id}"))
@@ -0,0 +1,27 @@
+from pydantic import BaseModel, Field
+
+from snapdraft_server.services.base.background_job import BackgroundJob
+
+
+class BatchGenerationCreate(BaseModel):
+    draft_ids: list[str] | None = None
+    """The drafts to generate.  All the drafts of the document type if not set."""
+    incremental: bool = False
+    """Only regenerate the sections whose sources changed since the last generation.  Off by
+    default, since batches are usually run after the template or model changes."""
+
+
+class BatchGenerationError(BaseModel):
+    draft_id: str
+    message: str
+
+
+class BatchGenerationJob(BackgroundJob):
+    draft_ids: list[str]
+    incremental: bool = False
+    generated_file_ids: dict[str, str] = Field(default_factory=dict)
+    """The id of the generated markdown file for each draft that was generated."""
+    errors: list[BatchGenerationError] = Field(default_factory=list)
+
+    def total_items(self) -> int:
+        return len(self.draft_ids)
@@ -0,0 +1,95 @@
+import functools
+import logging
+
+from fastapi import BackgroundTasks
+
+from snapdraft_server.core.lm_limiter import LmPriority, lm_priority
+from snapdraft_server.services.base.background_job import (
+    BackgroundJobCollection,
+    run_bounded,
+)
+from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
+from snapdraft_server.services.batch_generation_model import (
+    BatchGenerationCreate,
+    BatchGenerationError,
+    BatchGenerationJob,
+)
+from snapdraft_server.services.draft_service import DraftService
+
+logger = logging.getLogger(__name__)
+
+
+class BatchGenerationService(BackgroundJobCollection[BatchGenerationJob]):
+    """Generates many drafts of a document type as a background job.
+
+    A fixed number of workers generate drafts concurrently, pulling them from a bounded queue.
+    Every draft goes through DraftService.regenerate, so the batch shares the app-wide template
+    and program caches and the preprocessed sources already saved for each draft.  Each result is
+    saved to GridFS as the draft's generated file and recorded on the job as it finishes.
+    """
+
+    def __init__(
+        self,
+        client: SnapdraftMongo,
+        draft_service: DraftService,
+        background_tasks: BackgroundTasks,
+        concurrency: int = 4,
+    ):
+        super().__init__(
+            client,
+            "batch_generation_job",
+            BatchGenerationJob,
+            background_tasks,
+            concurrency,
+        )
+        self.draft_service = draft_service
+
+    async def start_batch(
+        self, doc_type_id: str, batch_create: BatchGenerationCreate
+    ) -> BatchGenerationJob:
+        draft_ids = batch_create.draft_ids
+        if draft_ids is None:
+            drafts = await self.draft_service.list_by_doc_type(doc_type_id)
+            draft_ids = [_.id for _ in drafts.items]
+        job = await self.create(
+            BatchGenerationJob(
+                doc_type_id=doc_type_id,
+                draft_ids=draft_ids,
+                incremental=batch_create.incremental,
+            )
+        )
+        self.background_tasks.add_task(self.run_batch, job)
+        return job
+
+    async def run_batch(self, job: BatchGenerationJob):
+        logger.info("Generating %d drafts for job %s", len(job.draft_ids), job.id)
+        await self._run_job(
+            job,
+            lambda: run_bounded(
+                job.draft_ids,
+                functools.partial(self._generate_draft, job),
+                self.concurrency,
+            ),
+        )
+
+    async def _generate_draft(self, job: BatchGenerationJob, draft_id: str):
+        try:
+            draft = await self.draft_service.get(draft_id)
+            if draft.doc_type_id != job.doc_type_id:
+                raise ValueError(f"Draft isn't a {job.doc_type_id} document")
+            # Interactive generation goes ahead of the batch when the LM is busy.
+            with lm_priority(LmPriority.BATCH):
+                await self.draft_service.regenerate(
+                    job.doc_type_id, draft_id, incremental=job.incremental
+                )
+            draft = await self.draft_service.get(draft_id)
+        except Exception as e:
+            logger.warning(
+                "Problem generating draft %s for job %s: %s", draft_id, job.id, e
+            )
+            error = BatchGenerationError(draft_id=draft_id, message=str(e))
+            await self._record_failed(job, error)
+            return
+        await self._record_completed(
+            job, {"$set": {f"generated_file_ids.{draft_id}": draft.generated_file_id}}
+        )
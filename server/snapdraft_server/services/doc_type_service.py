@@ -1,8 +1,49 @@
+import logging
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from snapdraft_server.core.doc_template import DocTemplate
+from snapdraft_server.core.hardcoded_template import template
 from snapdraft_server.services.base.base_collection import BaseCollection
 from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
 from snapdraft_server.services.doc_type_model import DocumentType
+from snapdraft_server.services.file_service import FileService
+from snapdraft_server.services.template_cache import TemplateCache
+from snapdraft_server.util.util import load_model_async
+
+logger = logging.getLogger(__name__)
 
 
 class DocumentTypeService(BaseCollection):
-    def __init__(self, client: SnapdraftMongo):
+    def __init__(
+        self,
+        client: SnapdraftMongo,
+        file_service: FileService,
+        template_cache: TemplateCache,
+    ):
         super().__init__(client, "document_type", DocumentType)
+        self.file_service = file_service
+        self.template_cache = template_cache
+
+    async def get_template(self, doc_type_id: str) -> DocTemplate:
+        """Returns the template for the document type.  Document types without a template file
+        use the default template."""
+        doc_type = await self.get(doc_type_id)
+        if doc_type.template_file_id is None:
+            return template
+        return await self.template_cache.get(
+            doc_type.template_file_id,
+            lambda: self._load_template(doc_type.template_file_id),
+        )
+
+    async def _load_template(self, template_file_id: str) -> DocTemplate:
+        logger.info("Loading template %s", template_file_id)
+        path = await self.file_service.get_local_path(template_file_id)
+        try:
+            return await load_model_async(path, DocTemplate)
+        except ValidationError as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Template {template_file_id} is invalid.  {e}",
+            )
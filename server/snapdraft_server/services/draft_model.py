@@ -1,5 +1,7 @@
 from pydantic import BaseModel, Field
 
+from snapdraft_server.core.tracing import Span
+
 
 class DraftBase(BaseModel):
     name: str
@@ -17,18 +19,57 @@ class DraftCreate(DraftBase):
     pass
 
 
+class GeneratedSection(BaseModel):
+    """Records the inputs and output of the last generation of a templated section."""
+
+    section_id: list[int]
+    source_file_ids: dict[str, str]
+    """The ids of the source files the section depends on, keyed by source name."""
+    output_hash: str
+    """Hash of the generated markdown for the section."""
+
+
 class Draft(DraftBase):
     doc_type_id: str
     id: str | None = None
     output_file_md_id: str | None = None
     """A version of the output file converted to markdown.  If the output is already markdown, 
     this will be the same as output_file_id"""
+    generated_file_id: str | None = None
+    """The markdown from the last time this draft was generated."""
+    generated_sections: list[GeneratedSection] = Field(default_factory=list)
+    """The state of each templated section in the last generation.  Used to only regenerate the
+    sections whose sources have changed."""
+    generated_template_file_id: str | None = None
+    """The template file of the last generation, None for the default template."""
+    generated_program_file_id: str | None = None
+    """The trained program of the last generation, None if the generator's defaults were used."""
+
+
+class GenerationDebug(BaseModel):
+    """Timings for a generation, for finding out where the time went."""
+
+    request_id: str | None
+    spans: list[Span]
+    """The spans for each stage, in the order they finished."""
 
 
 class GenerateDraftResult(BaseModel):
     text: str
+    debug: GenerationDebug | None = None
 
 
 class RegeneratedDraftResult(BaseModel):
     text: str
     message: str
+    debug: GenerationDebug | None = None
+    """Only set if debug output was requested."""
+
+
+class WarmDraftResult(BaseModel):
+    warmed: list[str]
+    """What was loaded into the caches: "template", "program" and the names of the sources."""
+    failed: list[str] = Field(default_factory=list)
+    """What couldn't be loaded, those are loaded again when generating."""
+    skipped: list[str] = Field(default_factory=list)
+    """Sources that weren't loaded because they haven't been preprocessed yet."""
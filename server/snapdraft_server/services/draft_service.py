@@ -1,30 +1,64 @@
 import asyncio
+import codecs
+import functools
+import hashlib
 import json
 import logging
 from io import BytesIO
+from pathlib import Path
+from typing import AsyncIterator
 
+from bson import ObjectId
 from fastapi import BackgroundTasks
 from pydantic import BaseModel
 
-from snapdraft_server.core.doc_generator import DocGenerator, SourceFile
+from snapdraft_server.core.doc_generator import (
+    DocGenerator,
+    SourceFile,
+    TrainingExample,
+)
 from snapdraft_server.core.doc_section import DocSection
-from snapdraft_server.core.hardcoded_template import template
+from snapdraft_server.core.doc_section_codec import (
+    encode_doc_section,
+    decode_doc_section,
+    is_encoded_doc_section,
+)
+from snapdraft_server.core.doc_section_view import DocSectionView
+from snapdraft_server.core.doc_template import DocTemplate
+from snapdraft_server.core.section_index import SectionIndex
+from snapdraft_server.core.tracing import Span, get_request_id, span, start_trace
 from snapdraft_server.services.base.base_collection import BaseCollection
+from snapdraft_server.services.base.executor import run_in_executor
 from snapdraft_server.services.doc_type_service import DocumentTypeService
 from snapdraft_server.services.draft_model import (
     DraftCreate,
     Draft,
     GenerateDraftResult,
+    GeneratedSection,
+    GenerationDebug,
     RegeneratedDraftResult,
+    WarmDraftResult,
 )
 from snapdraft_server.services.base.result_list import ResultList
 from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
 from snapdraft_server.services.file_model import StoredFileMetadata, StoredFile
 from snapdraft_server.services.file_service import FileService
-from snapdraft_server.util.util import load_model
+from snapdraft_server.services.model_model import Model
+from snapdraft_server.services.prefetcher import Prefetcher
+from snapdraft_server.services.program_cache import ProgramCache
+from snapdraft_server.services.source_cache import SourceCache
+from snapdraft_server.util.async_io import (
+    INLINE_MAX_BYTES,
+    read_bytes,
+    read_text,
+    run_io,
+)
+from snapdraft_server.util.util import load_json_async, load_model_async
 
 logger = logging.getLogger(__name__)
 
+MARKDOWN_CHUNK_BYTES = 1024 * 1024
+
 
 class PreprocessedFile(BaseModel):
     """Internal model used to cache preprocessed files."""
@@ -33,6 +67,8 @@ class PreprocessedFile(BaseModel):
     generator_name: str
     generator_version: str
     preprocessed_file_id: str
+    index_file_id: str | None = None
+    """The SectionIndex of the preprocessed file."""
     id: str | None = None
 
 
@@ -42,39 +78,63 @@ class DraftService(BaseCollection):
         client: SnapdraftMongo,
         doc_type_service: DocumentTypeService,
         file_service: FileService,
+        program_cache: ProgramCache,
+        source_cache: SourceCache,
+        prefetcher: Prefetcher,
         background_tasks: BackgroundTasks,
     ):
         super().__init__(client, "draft", Draft)
         self.background_tasks = background_tasks
         self.doc_type_service = doc_type_service
         self.file_service = file_service
+        self.program_cache = program_cache
+        self.source_cache = source_cache
+        self.prefetcher = prefetcher
         self.preprocessed_files = BaseCollection(
             client, "preprocessed_file", PreprocessedFile
         )
+        self.models = BaseCollection(client, "model", Model)
 
     async def list_by_doc_type(self, doc_type_id: str) -> ResultList[Draft]:
         cursor = self.collection.find({"doc_type_id": doc_type_id})
         return await self._cursor_to_result_list(cursor)
 
-    async def create(self, doc_type_id: str, draft_create: DraftCreate):
+    async def create(
+        self, doc_type_id: str, draft_create: DraftCreate, preprocess: bool = True
+    ):
+        """Creates the draft and preprocesses its files in the background.  Pass preprocess=False
+        if the caller will preprocess the files itself."""
         draft = self._setup_draft(doc_type_id, draft_create)
         draft = await super().create(draft)
-        self.background_tasks.add_task(self.preprocess_files, draft)
+        if preprocess:
+            self.background_tasks.add_task(self.preprocess_files, draft)
         return draft
 
     async def update(self, doc_type_id: str, draft_id: str, draft_create: DraftCreate):
-        draft = self._setup_draft(doc_type_id, draft_create)
+        existing = await self.get(draft_id)
+        # Keep the preprocessing and generation state, it's only reset for files that changed.
+        draft = existing.model_copy(
+            update={**draft_create.model_dump(), "doc_type_id": doc_type_id}
+        )
+        if draft.output_file_id != existing.output_file_id:
+            draft.output_file_md_id = None
         draft = await super().update(draft_id, draft)
-        self.background_tasks.add_task(self.preprocess_files, draft)
+        # A warm-up of the old sources is wasted work.
+        for preprocess in [True, False]:
+            self.prefetcher.cancel((draft_id, preprocess))
+        self.background_tasks.add_task(self.preprocess_files, draft, existing)
         return draft
 
     def _setup_draft(self, doc_type_id: str, draft_create: DraftCreate):
         # Really should validate the source files versus what's expected in the doc type here
         return Draft(**{**draft_create.model_dump(), "doc_type_id": doc_type_id})
 
-    async def generate(self, doc_type_id: str, draft_id: str):
-        ret = await self.regenerate(doc_type_id, draft_id)
-        return GenerateDraftResult(text=ret.text)
+    async def generate(self, doc_type_id: str, draft_id: str, debug: bool = False):
+        """Generates every section of the draft afresh."""
+        ret = await self.regenerate(
+            doc_type_id, draft_id, incremental=False, debug=debug
+        )
+        return GenerateDraftResult(text=ret.text, debug=ret.debug)
 
     async def regenerate(
         self,
@@ -82,32 +142,386 @@ class DraftService(BaseCollection):
         draft_id: str,
         previous_text: str | None = None,
         user_prompt: str | None = None,
+        incremental: bool = True,
+        debug: bool = False,
     ):
+        """Generates the draft.  If there is a previous version, only the sections affected by the
+        prompt or by changed sources are regenerated, unless incremental is False.
+
+        Each stage is timed in a span.  If debug is set, the spans are returned with the result.
+        """
+        with start_trace() as spans:
+            with span("regenerate", draft_id=draft_id, incremental=incremental):
+                result = await self._regenerate(
+                    doc_type_id, draft_id, previous_text, user_prompt, incremental
+                )
+        if debug:
+            result.debug = GenerationDebug(request_id=get_request_id(), spans=spans)
+        return result
+
+    async def _regenerate(
+        self,
+        doc_type_id: str,
+        draft_id: str,
+        previous_text: str | None,
+        user_prompt: str | None,
+        incremental: bool,
+    ) -> RegeneratedDraftResult:
         from snapdraft_server.routes.dependencies import (
             get_generator_name,
             get_generator,
         )
 
-        # doc_type = await self.doc_type_service.get(doc_type_id)
+        with span("get_template"):
+            doc_template = await self.doc_type_service.get_template(doc_type_id)
         generator_name = get_generator_name()
         generator = get_generator(generator_name)
         draft = await self.get(draft_id)
-        sources = {
-            name: await self.get_preprocessed_file(
-                name, source_file_id, generator, generator_name
+        template_file_id = (
+            await self.doc_type_service.get(doc_type_id)
+        ).template_file_id
+        active_model = await self._find_active_model(doc_type_id)
+        program_file_id = active_model.trained_model_file_id if active_model else None
+        changed_sources = None
+        if not incremental:
+            previous_text = None
+        elif previous_text is None:
+            previous_text = await self._load_last_generation(
+                draft, doc_template, template_file_id, program_file_id
+            )
+        if previous_text is not None and draft.generated_sections:
+            changed_sources = self._get_changed_sources(draft, doc_template)
+        if changed_sources is None or user_prompt:
+            needed_sources = draft.source_file_ids.keys()
+        else:
+            # Without a prompt, only the sections that use a changed source are regenerated.
+            needed_sources = {
+                ref.doc_name
+                for si in doc_template.section_instructions
+                if any(ref.doc_name in changed_sources for ref in si.source_sections)
+                for ref in si.source_sections
+            }
+        needed_sources = [_ for _ in needed_sources if _ in draft.source_file_ids]
+        sources = {}
+        source_indexes = {}
+        for name in needed_sources:
+            sources[name], source_indexes[name] = await self.get_generation_source(
+                name, draft.source_file_ids[name], generator, generator_name
+            )
+        program = await self._get_program(doc_type_id, generator)
+        # Generation makes blocking LM calls, so it's run in a thread to keep the loop responsive.
+        with span("generate"):
+            generated = await asyncio.to_thread(
+                generator.generate,
+                doc_template,
+                sources,
+                previous_version=previous_text,
+                user_prompt=user_prompt,
+                program=program,
+                changed_sources=changed_sources,
+                source_indexes=source_indexes,
+            )
+        with span("save_generation"):
+            await self._save_generation(
+                draft,
+                doc_template,
+                generated.markdown,
+                template_file_id,
+                program_file_id,
             )
-            for name, source_file_id in draft.source_file_ids.items()
-        }
-        generated = generator.generate(
-            template, sources, previous_version=previous_text, user_prompt=user_prompt
-        )
         return RegeneratedDraftResult(
             text=generated.markdown, message=generated.explanation_of_changes
         )
 
-    async def preprocess_files(self, draft: Draft):
+    def prefetch(
+        self, doc_type_id: str, draft: Draft, preprocess: bool = True
+    ) -> asyncio.Task[WarmDraftResult]:
+        """Starts warming the caches for the draft in the background, unless it's already being
+        warmed the same way.  Returns the task of the warm-up."""
+        return self.prefetcher.start(
+            (draft.id, preprocess), lambda: self.warm(doc_type_id, draft, preprocess)
+        )
+
+    async def warm(
+        self, doc_type_id: str, draft: Draft, preprocess: bool = True
+    ) -> WarmDraftResult:
+        """Loads what generating the draft needs into the app's caches: the template, the program
+        of the active model and the preprocessed sources with their indexes.  Sources that
+        haven't been preprocessed are preprocessed now, or skipped if preprocess is False.  The
+        loads run through the prefetcher, which bounds how many run at once."""
+        from snapdraft_server.routes.dependencies import (
+            get_generator_name,
+            get_generator,
+        )
+
+        generator_name = get_generator_name()
+        generator = get_generator(generator_name)
+        loads = [
+            ("template", lambda: self.doc_type_service.get_template(doc_type_id)),
+            ("program", lambda: self._get_program(doc_type_id, generator)),
+        ]
+        for name, source_file_id in draft.source_file_ids.items():
+            load = functools.partial(
+                self._warm_source,
+                name,
+                source_file_id,
+                generator,
+                generator_name,
+                preprocess,
+            )
+            loads.append((name, load))
+        with span("warm_draft", draft_id=draft.id):
+            results = await asyncio.gather(
+                *(self.prefetcher.run(load) for _, load in loads),
+                return_exceptions=True,
+            )
+        ret = WarmDraftResult(warmed=[])
+        for (name, _), result in zip(loads, results):
+            if isinstance(result, BaseException):
+                logger.warning(
+                    "Couldn't warm %s for draft %s", name, draft.id, exc_info=result
+                )
+                ret.failed.append(name)
+            elif result is False:
+                ret.skipped.append(name)
+            else:
+                ret.warmed.append(name)
+        return ret
+
+    async def _warm_source(
+        self,
+        source_name: str,
+        source_file_id: str,
+        generator: DocGenerator,
+        generator_name: str,
+        preprocess: bool,
+    ) -> bool:
+        """Loads the source into the source cache.  Returns False if it was skipped because it
+        hasn't been preprocessed."""
+        key = (source_file_id, generator_name, generator.get_version())
+        if not preprocess and key not in self.source_cache:
+            preprocessed_file = await self._find_preprocessed_file(
+                source_file_id, generator, generator_name
+            )
+            if preprocessed_file is None:
+                return False
+        await self.get_generation_source(
+            source_name, source_file_id, generator, generator_name
+        )
+        return True
+
+    async def get_generation_source(
+        self,
+        source_name: str,
+        source_file_id: str,
+        generator: DocGenerator,
+        generator_name: str,
+    ) -> tuple[DocSection | DocSectionView, SectionIndex]:
+        """Returns the preprocessed source and its SectionIndex for generation, from the source
+        cache.  Sources that were already preprocessed are loaded lazily."""
+        key = (source_file_id, generator_name, generator.get_version())
+        with span(
+            "get_generation_source",
+            source=source_name,
+            cache_hit=key in self.source_cache,
+        ):
+            return await self.source_cache.get(
+                key,
+                lambda: self._load_generation_source(
+                    source_name, source_file_id, generator, generator_name
+                ),
+            )
+
+    async def _load_generation_source(
+        self,
+        source_name: str,
+        source_file_id: str,
+        generator: DocGenerator,
+        generator_name: str,
+    ) -> tuple[DocSection | DocSectionView, SectionIndex]:
+        preprocessed_data = await self.get_preprocessed_file(
+            source_name, source_file_id, generator, generator_name, lazy=True
+        )
+        source_index = await self.get_source_index(
+            source_name, source_file_id, generator, generator_name
+        )
+        return preprocessed_data, source_index
+
+    async def _get_program(self, doc_type_id: str, generator: DocGenerator):
+        with span("load_program", cache_hit=doc_type_id in self.program_cache):
+            return await self.program_cache.get(
+                doc_type_id, lambda: self.load_active_program(doc_type_id, generator)
+            )
+
+    async def _load_last_generation(
+        self,
+        draft: Draft,
+        doc_template: DocTemplate,
+        template_file_id: str | None,
+        program_file_id: str | None,
+    ) -> str | None:
+        """Returns the markdown from the last generation, or None if every section needs to be
+        generated.  That's the case if it was generated from a different template or trained
+        program, or its sections don't match the recorded hashes."""
+        if draft.generated_file_id is None:
+            return None
+        if (draft.generated_template_file_id, draft.generated_program_file_id) != (
+            template_file_id,
+            program_file_id,
+        ):
+            return None
+        generated = {tuple(gs.section_id): gs for gs in draft.generated_sections}
+        if set(generated) != {
+            tuple(si.section_id) for si in doc_template.section_instructions
+        }:
+            return None
+        path = await self.file_service.get_local_path(draft.generated_file_id)
+        markdown = await read_text(path)
+        hashes = self._hash_sections(doc_template, markdown)
+        if any(hashes.get(k) != gs.output_hash for k, gs in generated.items()):
+            return None
+        return markdown
+
+    @staticmethod
+    def _get_changed_sources(draft: Draft, doc_template: DocTemplate) -> list[str]:
+        """Returns the names of the sources that have been replaced since they were used to
+        generate a section.  Sections that were never generated count all their sources as
+        changed."""
+        generated = {tuple(gs.section_id): gs for gs in draft.generated_sections}
+        changed = set()
+        for si in doc_template.section_instructions:
+            section = generated.get(tuple(si.section_id))
+            used_file_ids = section.source_file_ids if section else {}
+            for ref in si.source_sections:
+                if used_file_ids.get(ref.doc_name) != draft.source_file_ids.get(
+                    ref.doc_name
+                ):
+                    changed.add(ref.doc_name)
+        return sorted(changed)
+
+    async def _save_generation(
+        self,
+        draft: Draft,
+        doc_template: DocTemplate,
+        markdown: str,
+        template_file_id: str | None,
+        program_file_id: str | None,
+    ):
+        generated_file = await self.file_service.upload_text_file(
+            markdown,
+            StoredFileMetadata(original_filename=f"{draft.name}.md", extension="md"),
+        )
+        hashes = self._hash_sections(doc_template, markdown)
+        draft.generated_file_id = generated_file.id
+        draft.generated_template_file_id = template_file_id
+        draft.generated_program_file_id = program_file_id
+        draft.generated_sections = [
+            GeneratedSection(
+                section_id=si.section_id,
+                source_file_ids={
+                    ref.doc_name: draft.source_file_ids[ref.doc_name]
+                    for ref in si.source_sections
+                    if ref.doc_name in draft.source_file_ids
+                },
+                output_hash=hashes[tuple(si.section_id)],
+            )
+            for si in doc_template.section_instructions
+            if tuple(si.section_id) in hashes
+        ]
+        # Only the generation is saved, the draft may have been updated while generating.
+        await self.collection.update_one(
+            {"_id": ObjectId(draft.id)},
+            {
+                "$set": draft.model_dump(
+                    include={
+                        "generated_file_id",
+                        "generated_template_file_id",
+                        "generated_program_file_id",
+                        "generated_sections",
+                    }
+                )
+            },
+        )
+
+    @staticmethod
+    def _hash_sections(
+        doc_template: DocTemplate, markdown: str
+    ) -> dict[tuple[int, ...], str]:
+        """Hashes the text of each templated section found in the markdown."""
+        doc = DocSection.parse_markdown(doc_template.title, markdown)
+        ret = {}
+        for si in doc_template.section_instructions:
+            section_id = doc.get_section_id(
+                doc_template.parsed_doc.get_title_path(si.section_id)
+            )
+            if section_id is not None:
+                text = doc.find_section_by_id(section_id).intro_text
+                ret[tuple(si.section_id)] = hashlib.sha256(text.encode()).hexdigest()
+        return ret
+
+    async def load_active_program(self, doc_type_id: str, generator: DocGenerator):
+        """Loads the trained program for the active model of the document type.  Returns None
+        if the active model hasn't been trained, in which case the generator's defaults are used.
+        """
+        active_model = await self._find_active_model(doc_type_id)
+        if active_model is None or active_model.trained_model_file_id is None:
+            return None
+        logger.info("Loading trained program for model %s", active_model.id)
+        path = await self.file_service.get_local_path(
+            active_model.trained_model_file_id
+        )
+        program = generator.create_program()
+        program.load_state(await load_json_async(path))
+        return program
+
+    async def _find_active_model(self, doc_type_id: str) -> Model | None:
+        active_model = await self.models.collection.find_one(
+            {"doc_type_id": doc_type_id, "is_active": True}
+        )
+        if active_model is None:
+            return None
+        return self.models.to_model(active_model)
+
+    async def get_training_examples(
+        self, draft_ids: list[str], generator: DocGenerator, generator_name: str
+    ) -> list[TrainingExample]:
+        """Loads the preprocessed sources and final markdown for each training draft.  Drafts
+        without a markdown output are skipped."""
+        examples = []
+        for draft_id in draft_ids:
+            draft = await self.get(draft_id)
+            if draft.output_file_md_id is None:
+                logger.warning("Draft %s has no markdown output.  Skipping", draft_id)
+                continue
+            sources = {
+                name: await self.get_preprocessed_file(
+                    name, source_file_id, generator, generator_name
+                )
+                for name, source_file_id in draft.source_file_ids.items()
+            }
+            output_path = await self.file_service.get_local_path(
+                draft.output_file_md_id
+            )
+            examples.append(
+                TrainingExample(
+                    sources=sources, output_markdown=await read_text(output_path)
+                )
+            )
+        return examples
+
+    async def preprocess_files(self, draft: Draft, previous: Draft | None = None):
+        """Preprocesses the draft's output and source files.  If the previous version of the
+        draft is passed in, only the files that have changed are processed."""
+        previous_source_file_ids = previous.source_file_ids if previous else {}
+        changed_source_file_ids = {
+            name: id
+            for name, id in draft.source_file_ids.items()
+            if previous_source_file_ids.get(name) != id
+        }
         logger.info(
-            f"Preprocessing {len(draft.source_file_ids)} source files for {draft.id}"
+            "Preprocessing %d source files for %s",
+            len(changed_source_file_ids),
+            draft.id,
         )
         from snapdraft_server.routes.dependencies import (
             get_generator_name,
@@ -116,7 +530,7 @@ class DraftService(BaseCollection):
 
         generator_name = get_generator_name()
         generator = get_generator(generator_name)
-        if draft.output_file_id != None:
+        if draft.output_file_id != None and draft.output_file_md_id is None:
             output_file = await self.file_service.get(draft.output_file_id)
             if output_file.metadata.extension == "md":
                 draft.output_file_md_id = draft.output_file_id
@@ -132,8 +546,10 @@ class DraftService(BaseCollection):
                 )
                 draft.output_file_md_id = md_file.id
             draft = await super().update(draft.id, draft)
-        for name, id in draft.source_file_ids.items():
-            await self.get_preprocessed_file(name, id, generator, generator_name)
+        # Through the source cache, so a warm-up or generation running at the same time shares
+        # the conversion rather than converting the source again.
+        for name, id in changed_source_file_ids.items():
+            await self.get_generation_source(name, id, generator, generator_name)
 
     async def get_preprocessed_file(
         self,
@@ -141,42 +557,177 @@ class DraftService(BaseCollection):
         source_file_id: str,
         generator: DocGenerator,
         generator_name: str,
-    ):
+        lazy: bool = False,
+    ) -> DocSection | DocSectionView:
+        """Returns the preprocessed source, converting it if it hasn't been already.  If lazy is
+        set, the saved file is returned as a read-only DocSectionView that only reads the text of
+        the sections that are used.  Files saved as JSON by older versions are always loaded in
+        full."""
+        with span(
+            "get_preprocessed_file", source=source_name, lazy=lazy
+        ) as current_span:
+            return await self._get_preprocessed_file(
+                source_name,
+                source_file_id,
+                generator,
+                generator_name,
+                lazy,
+                current_span,
+            )
+
+    async def _get_preprocessed_file(
+        self,
+        source_name: str,
+        source_file_id: str,
+        generator: DocGenerator,
+        generator_name: str,
+        lazy: bool,
+        current_span: Span,
+    ) -> DocSection | DocSectionView:
         # Use existing file if we have one.
-        preprocessed_file = await self.preprocessed_files.collection.find_one(
-            {
-                "source_file_id": source_file_id,
-                "generator_name": generator_name,
-                "generator_version": generator.get_version(),
-            }
+        preprocessed_file = await self._find_preprocessed_file(
+            source_file_id, generator, generator_name
         )
+        current_span.set_attribute("cache_hit", preprocessed_file is not None)
         if preprocessed_file:
-            preprocessed_file = self.preprocessed_files.to_model(preprocessed_file)
             path = await self.file_service.get_local_path(
                 preprocessed_file.preprocessed_file_id
             )
-            preprocessed_data = load_model(path, DocSection)
+            with span("load_preprocessed_data"):
+                preprocessed_data = await self._load_preprocessed_data(path, lazy)
         else:
             preprocessed_data, original_filename = await self._convert_to_md(
                 generator, source_file_id, source_name
             )
-            preprocessed_json = json.dumps(preprocessed_data.model_dump())
-            preprocessed_file = await self.file_service.upload_text_file(
-                preprocessed_json,
+            preprocessed_file = await self.file_service.upload_from_stream(
+                BytesIO(encode_doc_section(preprocessed_data)),
                 StoredFileMetadata(
-                    original_filename=original_filename, extension="json"
+                    original_filename=original_filename, extension="sdds"
                 ),
             )
+            index_file = await self._upload_index(preprocessed_data, original_filename)
             await self.preprocessed_files.collection.insert_one(
                 PreprocessedFile(
                     source_file_id=source_file_id,
                     generator_name=generator_name,
                     generator_version=generator.get_version(),
                     preprocessed_file_id=preprocessed_file.id,
+                    index_file_id=index_file.id,
                 ).model_dump()
             )
+            if lazy:
+                # Callers asking for a view may keep it, like the source cache, so the saved
+                # file is mapped rather than holding on to the whole tree.
+                path = await self.file_service.get_local_path(preprocessed_file.id)
+                preprocessed_data = DocSectionView.open(path)
         return preprocessed_data
 
+    @staticmethod
+    async def _load_preprocessed_data(
+        path: Path, lazy: bool = False
+    ) -> DocSection | DocSectionView:
+        """Loads a preprocessed file.  Files are saved with encode_doc_section, but older ones
+        were saved as JSON and are always loaded in full.  Large files are read and decoded in
+        threads."""
+        with path.open("rb") as f:
+            encoded = is_encoded_doc_section(f.read(4))
+        if encoded and lazy:
+            # Only maps the file, the sections are read as they're used.
+            return DocSectionView.open(path)
+        data = await read_bytes(path)
+        decode = decode_doc_section if encoded else DocSection.model_validate_json
+        if len(data) <= INLINE_MAX_BYTES:
+            return decode(data)
+        return await run_in_executor("decode_preprocessed", lambda: decode(data))
+
+    async def get_preprocessed_markdown_stream(
+        self,
+        source_name: str,
+        source_file_id: str,
+        generator: DocGenerator,
+        generator_name: str,
+    ) -> AsyncIterator[str]:
+        """Returns the markdown of the preprocessed source in chunks.  The markdown is read from
+        the preprocessed file as it was rendered when preprocessing, so it's only rendered here
+        for sources preprocessed before the markdown was saved.
+        """
+        preprocessed_data = await self.get_preprocessed_file(
+            source_name, source_file_id, generator, generator_name, lazy=True
+        )
+        if isinstance(preprocessed_data, DocSectionView):
+            data = preprocessed_data.markdown_bytes()
+            if data is not None:
+                return _decode_chunks(data)
+        return _single_chunk(preprocessed_data.as_markdown())
+
+    async def get_source_index(
+        self,
+        source_name: str,
+        source_file_id: str,
+        generator: DocGenerator,
+        generator_name: str,
+    ) -> SectionIndex:
+        """Returns the SectionIndex for a preprocessed source file, preprocessing it if needed.
+        Files preprocessed before indexes were added are indexed now."""
+        with span("get_source_index", source=source_name):
+            return await self._get_source_index(
+                source_name, source_file_id, generator, generator_name
+            )
+
+    async def _get_source_index(
+        self,
+        source_name: str,
+        source_file_id: str,
+        generator: DocGenerator,
+        generator_name: str,
+    ) -> SectionIndex:
+        preprocessed_file = await self._find_preprocessed_file(
+            source_file_id, generator, generator_name
+        )
+        if preprocessed_file is None or preprocessed_file.index_file_id is None:
+            preprocessed_data = await self.get_preprocessed_file(
+                source_name, source_file_id, generator, generator_name
+            )
+            preprocessed_file = await self._find_preprocessed_file(
+                source_file_id, generator, generator_name
+            )
+            if preprocessed_file.index_file_id is None:
+                index_file = await self._upload_index(preprocessed_data, source_name)
+                await self.preprocessed_files.collection.update_one(
+                    {"_id": ObjectId(preprocessed_file.id)},
+                    {"$set": {"index_file_id": index_file.id}},
+                )
+                preprocessed_file.index_file_id = index_file.id
+        path = await self.file_service.get_local_path(preprocessed_file.index_file_id)
+        with span("load_source_index"):
+            return await load_model_async(path, SectionIndex)
+
+    async def _find_preprocessed_file(
+        self, source_file_id: str, generator: DocGenerator, generator_name: str
+    ) -> PreprocessedFile | None:
+        with span("find_preprocessed_file"):
+            preprocessed_file = await self.preprocessed_files.collection.find_one(
+                {
+                    "source_file_id": source_file_id,
+                    "generator_name": generator_name,
+                    "generator_version": generator.get_version(),
+                }
+            )
+        if preprocessed_file is None:
+            return None
+        return self.preprocessed_files.to_model(preprocessed_file)
+
+    async def _upload_index(
+        self, preprocessed_data: DocSection, original_filename: str
+    ):
+        index = await run_in_executor(
+            "build_index", lambda: SectionIndex.build(preprocessed_data)
+        )
+        return await self.file_service.upload_text_file(
+            json.dumps(index.model_dump()),
+            StoredFileMetadata(original_filename=original_filename, extension="json"),
+        )
+
     async def _convert_to_md(
         self, generator, source_file_id, source_name
     ) -> tuple[DocSection, str]:
@@ -187,14 +738,36 @@ class DraftService(BaseCollection):
             name=source_name,
             original_filename=stored_file.metadata.original_filename,
             path=saved_file_path,
+            cache_dir=self.file_service.local_cache_dir / "conversion",
         )
-        loop = asyncio.get_running_loop()
-        preprocessed_data = await loop.run_in_executor(
-            None, lambda: generator.parse_source_file(source_file)
-        )
+        with span(
+            "convert_to_md",
+            source=source_name,
+            extension=Path(source_file.original_filename).suffix,
+        ):
+            preprocessed_data = await run_in_executor(
+                "convert_to_md", lambda: generator.parse_source_file(source_file)
+            )
         return preprocessed_data, source_file.original_filename
 
 
+async def _decode_chunks(data: memoryview) -> AsyncIterator[str]:
+    # Chunks can end part way through a character.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for start in range(0, len(data), MARKDOWN_CHUNK_BYTES):
+        chunk = data[start : start + MARKDOWN_CHUNK_BYTES]
+        if len(chunk) <= INLINE_MAX_BYTES:
+            yield decoder.decode(chunk)
+        else:
+            # Reading the chunk from the mapped file can block on the disk.
+            yield await run_io(decoder.decode, chunk)
+    yield decoder.decode(b"", final=True)
+
+
+async def _single_chunk(text: str) -> AsyncIterator[str]:
+    yield text
+
+
 #
 # draft.source_files[0].file_id
 # prompt = get_processor_inputs(db, doc_id, inputs, upload_dir)
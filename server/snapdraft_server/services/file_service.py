@@ -7,8 +7,10 @@ from typing import AsyncGenerator
 from bson import ObjectId
 from starlette.responses import StreamingResponse
 
+from snapdraft_server.core.tracing import span
 from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
 from snapdraft_server.services.file_model import StoredFileMetadata, StoredFile
+from snapdraft_server.util.async_io import atomic_write
 
 logger = logging.getLogger(__name__)
 
@@ -56,15 +58,19 @@ class FileService:
         stream.close()
 
     async def get_local_path(self, file_id: str):
-        metadata = await self._get_metadata(file_id)
-        path = self.local_cache_dir / f"{file_id}.{metadata.extension}"
-        if not path.exists():
-            with path.open("wb") as f:
-                await self.client.gridfs.download_to_stream(ObjectId(file_id), f)
-            assert path.exists(), f"Path {path} wasn't created."
-        else:
-            logger.debug(f"Using existing locally cached file {path}")
-        return path
+        with span("get_local_path") as current_span:
+            metadata = await self._get_metadata(file_id)
+            path = self.local_cache_dir / f"{file_id}.{metadata.extension}"
+            current_span.set_attribute("cache_hit", path.exists())
+            if not path.exists():
+                # Written to a temporary file first, so concurrent requests for the same
+                # file never read a partial download.
+                async with atomic_write(path) as f:
+                    await self.client.gridfs.download_to_stream(ObjectId(file_id), f)
+                assert path.exists(), f"Path {path} wasn't created."
+            else:
+                logger.debug("Using existing locally cached file %s", path)
+            return path
 
     async def _get_metadata(self, file_id: str) -> StoredFileMetadata:
         file_document = await self.collection.find_one({"_id": ObjectId(file_id)})
@@ -0,0 +1,35 @@
+from pydantic import BaseModel, Field
+
+from snapdraft_server.services.base.background_job import BackgroundJob
+
+
+class IngestDraft(BaseModel):
+    """A draft in an ingest archive's manifest."""
+
+    name: str
+    use_for_training: bool = True
+    output: str | None = None
+    """The path of the output file in the archive."""
+    sources: dict[str, str] = Field(default_factory=dict)
+    """A dictionary of source names to the paths of the source files in the archive."""
+
+
+class IngestManifest(BaseModel):
+    drafts: list[IngestDraft]
+
+
+class IngestError(BaseModel):
+    draft_name: str
+    message: str
+    draft_id: str | None = None
+    """Set if the draft was created before the error, for example if preprocessing failed."""
+
+
+class IngestJob(BackgroundJob):
+    total: int = 0
+    draft_ids: list[str] = Field(default_factory=list)
+    """The drafts that were created and preprocessed."""
+    errors: list[IngestError] = Field(default_factory=list)
+
+    def total_items(self) -> int:
+        return self.total
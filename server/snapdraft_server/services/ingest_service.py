@@ -0,0 +1,140 @@
+import functools
+import logging
+import zipfile
+from pathlib import Path
+
+from bson import ObjectId
+from fastapi import BackgroundTasks, HTTPException, UploadFile
+from pydantic import ValidationError
+
+from snapdraft_server.services.base.background_job import (
+    BackgroundJobCollection,
+    run_bounded,
+)
+from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
+from snapdraft_server.services.draft_model import DraftCreate
+from snapdraft_server.services.draft_service import DraftService
+from snapdraft_server.services.file_model import StoredFileMetadata
+from snapdraft_server.services.file_service import FileService
+from snapdraft_server.services.ingest_model import (
+    IngestDraft,
+    IngestError,
+    IngestJob,
+    IngestManifest,
+)
+from snapdraft_server.util.async_io import atomic_write, write
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class IngestService(BackgroundJobCollection[IngestJob]):
+    """Creates drafts in bulk from a zip archive of existing documents.
+
+    The archive has a manifest.json listing the drafts, with the paths of their source and output
+    files in the archive.  Drafts are ingested in the background by a fixed number of workers, each
+    uploading the files for one draft, creating it and preprocessing its sources.  The drafts are
+    fed to the workers through a bounded queue, so only a few are in progress at a time no matter
+    how large the archive is.  Progress and the errors for individual drafts are recorded on the
+    IngestJob as each draft finishes.
+    """
+
+    def __init__(
+        self,
+        client: SnapdraftMongo,
+        draft_service: DraftService,
+        file_service: FileService,
+        background_tasks: BackgroundTasks,
+        concurrency: int = 4,
+    ):
+        super().__init__(client, "ingest_job", IngestJob, background_tasks, concurrency)
+        self.draft_service = draft_service
+        self.file_service = file_service
+
+    async def start_ingest(self, doc_type_id: str, upload: UploadFile) -> IngestJob:
+        # The upload is closed when the request ends, so it's saved to a local file for the
+        # background task.  It's copied in chunks to avoid reading it all into memory.
+        archive_dir = self.file_service.local_cache_dir / "ingest"
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_path = archive_dir / f"{ObjectId()}.zip"
+        async with atomic_write(archive_path) as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                await write(f, chunk)
+        try:
+            manifest = self._read_manifest(archive_path)
+        except (zipfile.BadZipFile, KeyError, ValidationError) as e:
+            archive_path.unlink()
+            raise HTTPException(status_code=400, detail=f"Invalid ingest archive: {e}")
+
+        job = await self.create(
+            IngestJob(doc_type_id=doc_type_id, total=len(manifest.drafts))
+        )
+        self.background_tasks.add_task(self.run_ingest, job, archive_path, manifest)
+        return job
+
+    @staticmethod
+    def _read_manifest(archive_path: Path) -> IngestManifest:
+        with zipfile.ZipFile(archive_path) as archive:
+            return IngestManifest.model_validate_json(archive.read(MANIFEST_NAME))
+
+    async def run_ingest(
+        self, job: IngestJob, archive_path: Path, manifest: IngestManifest
+    ):
+        logger.info("Ingesting %d drafts for job %s", len(manifest.drafts), job.id)
+
+        async def ingest():
+            with zipfile.ZipFile(archive_path) as archive:
+                await run_bounded(
+                    manifest.drafts,
+                    functools.partial(self._ingest_draft, job, archive),
+                    self.concurrency,
+                )
+
+        try:
+            await self._run_job(job, ingest)
+        finally:
+            archive_path.unlink(missing_ok=True)
+
+    async def _ingest_draft(
+        self, job: IngestJob, archive: zipfile.ZipFile, item: IngestDraft
+    ):
+        draft_id = None
+        try:
+            output_file_id = (
+                await self._upload(archive, item.output) if item.output else None
+            )
+            source_file_ids = {
+                name: await self._upload(archive, path)
+                for name, path in item.sources.items()
+            }
+            draft = await self.draft_service.create(
+                job.doc_type_id,
+                DraftCreate(
+                    name=item.name,
+                    use_for_training=item.use_for_training,
+                    output_file_id=output_file_id,
+                    source_file_ids=source_file_ids,
+                ),
+                preprocess=False,
+            )
+            draft_id = draft.id
+            await self.draft_service.preprocess_files(draft)
+        except Exception as e:
+            logger.warning(
+                "Problem ingesting draft %s for job %s: %s", item.name, job.id, e
+            )
+            error = IngestError(draft_name=item.name, message=str(e), draft_id=draft_id)
+            await self._record_failed(job, error)
+            return
+        await self._record_completed(job, {"$push": {"draft_ids": draft_id}})
+
+    async def _upload(self, archive: zipfile.ZipFile, path: str) -> str:
+        metadata = StoredFileMetadata(
+            original_filename=Path(path).name,
+            extension=Path(path).suffix.lstrip("."),
+        )
+        with archive.open(path) as stream:
+            stored_file = await self.file_service.upload_from_stream(stream, metadata)
+        return stored_file.id
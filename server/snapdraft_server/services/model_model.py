@@ -12,6 +12,8 @@ class Model(BaseModel):
     version: str
     generator: str = Field(default="Default")
     status: str = Field(default="Training")
+    progress: float = Field(default=0.0)
+    """Fraction of the training that has been completed."""
     is_active: bool = Field(default=False)
     created_at: datetime.datetime = Field(default_factory=datetime.datetime.now)
     draft_ids: list[str] = Field(default_factory=list)
@@ -1,16 +1,20 @@
-import asyncio
 import logging
 from http.client import HTTPException
 
+from bson import ObjectId
 from fastapi import BackgroundTasks
 
+from snapdraft_server.core.doc_generator import TrainingConfig
+from snapdraft_server.core.training_worker import run_training
 from snapdraft_server.services.base.base_collection import BaseCollection
 from snapdraft_server.services.base.result_list import ResultList
 from snapdraft_server.services.base.snapdraft_mongo import SnapdraftMongo
 from snapdraft_server.services.doc_type_service import DocumentTypeService
 from snapdraft_server.services.draft_service import DraftService
+from snapdraft_server.services.file_model import StoredFileMetadata
 from snapdraft_server.services.file_service import FileService
 from snapdraft_server.services.model_model import Model, ModelCreate
+from snapdraft_server.services.program_cache import ProgramCache
 
 logger = logging.getLogger(__name__)
 
@@ -22,18 +26,19 @@ class ModelService(BaseCollection):
         doc_type_service: DocumentTypeService,
         file_service: FileService,
         draft_service: DraftService,
+        program_cache: ProgramCache,
         background_tasks: BackgroundTasks,
     ):
         super().__init__(client, "model", Model)
         self.doc_type_service = doc_type_service
         self.file_service = file_service
         self.draft_service = draft_service
+        self.program_cache = program_cache
         self.background_tasks = background_tasks
 
     async def list_by_doc_type(self, doc_type_id: str) -> ResultList[Model]:
         cursor = self.collection.find({"doc_type_id": doc_type_id})
         results = await self._cursor_to_result_list(cursor)
-        logger.info(f"Models: {results}")
         if len(results.items) == 0:
             default = await self.create_default_model(doc_type_id)
             results = ResultList(items=[default])
@@ -68,10 +73,55 @@ class ModelService(BaseCollection):
         return new_model
 
     async def train_model(self, model: Model):
-        logger.info(f"Training model {model.id}")
-        await asyncio.sleep(5)
-        model.status = "Ready"
-        await self.update(model.id, model)
+        from snapdraft_server.routes.dependencies import (
+            get_generator_name,
+            get_generator,
+        )
+
+        logger.info("Training model %s", model.id)
+        generator_name = get_generator_name()
+        generator = get_generator(generator_name)
+
+        async def update_progress(progress: float):
+            model.progress = progress
+            await self._save_training(model)
+
+        try:
+            examples = await self.draft_service.get_training_examples(
+                model.draft_ids, generator, generator_name
+            )
+            doc_template = await self.doc_type_service.get_template(model.doc_type_id)
+            program_json = await run_training(
+                generator, doc_template, examples, TrainingConfig(), update_progress
+            )
+            trained_model_file = await self.file_service.upload_text_file(
+                program_json,
+                StoredFileMetadata(
+                    original_filename=f"model_{model.id}.json", extension="json"
+                ),
+            )
+            model.trained_model_file_id = trained_model_file.id
+            model.progress = 1.0
+            model.status = "Ready"
+        except Exception:
+            logger.exception("Problem training model %s", model.id)
+            model.status = "Failed"
+        await self._save_training(model)
+        # The model may have been made active while it was training, in which case the cache
+        # holds the untrained defaults for it.
+        self.program_cache.invalidate(model.doc_type_id)
+
+    async def _save_training(self, model: Model):
+        """Saves only the fields training updates, since others, like is_active, may change
+        while the model trains."""
+        await self.collection.update_one(
+            {"_id": ObjectId(model.id)},
+            {
+                "$set": model.model_dump(
+                    include={"progress", "status", "trained_model_file_id"}
+                )
+            },
+        )
 
     async def delete(self, id: str) -> dict:
         model = await self.get(id)
@@ -81,16 +131,13 @@ class ModelService(BaseCollection):
             )
         return await super().delete(id)
 
-    async def set_active_model(self, doc_id: str, model_id: str) -> dict:
-        existing_active = await self.collection.find_one(
-            {"doc_id": doc_id, "is_active": True}
+    async def set_active_model(self, doc_id: str, model_id: str) -> Model:
+        await self.collection.update_many(
+            {"doc_type_id": doc_id, "is_active": True}, {"$set": {"is_active": False}}
         )
-        if existing_active:
-            existing_active.is_active = False
-            await self.collection.replace_one(
-                {"_id": existing_active.id}, existing_active.dict()
-            )
 
         model = await self.get(model_id)
         model.is_active = True
-        return await self.update(model_id, model)
+        model = await self.update(model_id, model)
+        self.program_cache.invalidate(doc_id)
+        return model
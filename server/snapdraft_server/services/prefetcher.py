@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Prefetcher:
+    """Runs warm-ups of drafts in the background, so the app's caches are loaded before the
+    first generation needs them.
+
+    There is at most one warm-up per key, starting one while another runs returns the running
+    one.  The loads of all warm-ups run through run, which lets at most max_concurrency of them
+    run at once so warming doesn't crowd out requests.  Cancelling a warm-up stops it from
+    starting more loads, but loads that have started into an AsyncLruCache finish, since a
+    request may be waiting for them.
+
+    Like the caches, it needs to be created once with the app.
+    """
+
+    def __init__(self, max_concurrency: int = 4):
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+
+    def start(self, key: Hashable, warm: Callable[[], Awaitable[T]]) -> asyncio.Task[T]:
+        """Starts the warm-up for the key, unless one is already running."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(warm())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._done(key, task))
+        return task
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Warm-up of %s failed", key, exc_info=task.exception())
+
+    async def run(self, load: Callable[[], Awaitable[T]]) -> T:
+        async with self._semaphore:
+            return await load()
+
+    def cancel(self, key: Hashable):
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    async def close(self):
+        """Cancels the running warm-ups and waits for them to stop."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._tasks
@@ -0,0 +1,15 @@
+import dspy
+
+from snapdraft_server.services.base.lru_cache import AsyncLruCache
+
+
+class ProgramCache(AsyncLruCache[str, dspy.Module | None]):
+    """Cache of the trained DSPy program for each document type.
+
+    Entries are keyed by document type and hold the program for the active model, so they need
+    to be invalidated whenever the active model changes.  None is cached for document types with
+    no trained model.
+    """
+
+    def __init__(self, max_size: int = 16):
+        super().__init__(max_size)
@@ -0,0 +1,22 @@
+from snapdraft_server.core.doc_section import DocSection
+from snapdraft_server.core.doc_section_view import DocSectionView
+from snapdraft_server.core.section_index import SectionIndex
+from snapdraft_server.services.base.lru_cache import AsyncLruCache
+
+SourceKey = tuple[str, str, str]
+"""The source file id, generator name and generator version."""
+
+
+class SourceCache(
+    AsyncLruCache[SourceKey, tuple[DocSection | DocSectionView, SectionIndex]]
+):
+    """Cache of the preprocessed sources used for generation and their SectionIndexes.
+
+    Entries are keyed by the source file and the generator that preprocessed it.  Stored files
+    are never modified and a new generator version preprocesses sources again, so entries never
+    need invalidating.  Sources that were already preprocessed are held as DocSectionViews, which
+    only keep the document's structure in memory.
+    """
+
+    def __init__(self, max_size: int = 64):
+        super().__init__(max_size)
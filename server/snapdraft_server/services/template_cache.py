@@ -0,0 +1,15 @@
+from snapdraft_server.core.doc_template import DocTemplate
+from snapdraft_server.services.base.lru_cache import AsyncLruCache
+
+
+class TemplateCache(AsyncLruCache[str, DocTemplate]):
+    """Cache of validated DocTemplates keyed by the id of the file they were loaded from.
+
+    Stored files are never modified, changing a document type's template uploads a new file, so
+    the file id identifies the version of the template and entries never need invalidating.
+    The templates' parsed_doc is computed during validation, so cached templates are ready to
+    generate from.
+    """
+
+    def __init__(self, max_size: int = 64):
+        super().__init__(max_size)
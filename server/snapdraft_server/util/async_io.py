@@ -0,0 +1,88 @@
+"""Reads and writes of local files from async code.
+
+File I/O blocks the thread doing it, so large files are read and written in a dedicated thread
+pool.  It's separate from the loop's default executor, which runs CPU-bound work like markdown
+conversion, so I/O doesn't wait behind it.  Small files are read and written on the loop, since
+handing them to a thread costs more than the I/O, which is usually served by the page cache.
+"""
+
+import asyncio
+import functools
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, TypeVar
+
+T = TypeVar("T")
+
+INLINE_MAX_BYTES = 64 * 1024
+"""Reads and writes up to this size are done on the loop."""
+
+IO_THREADS = 8
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=IO_THREADS, thread_name_prefix="snapdraft-io"
+        )
+    return _executor
+
+
+async def run_io(func: Callable[..., T], *args) -> T:
+    """Runs blocking file I/O in the I/O thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(
+        get_io_executor(), functools.partial(func, *args)
+    )
+
+
+async def read_bytes(path: Path) -> bytes:
+    if path.stat().st_size <= INLINE_MAX_BYTES:
+        return path.read_bytes()
+    return await run_io(path.read_bytes)
+
+
+async def read_text(path: Path) -> str:
+    return (await read_bytes(path)).decode("utf-8")
+
+
+async def write(f: BinaryIO, data: bytes):
+    """Writes a chunk to a file opened for writing, like the one from atomic_write."""
+    if len(data) <= INLINE_MAX_BYTES:
+        f.write(data)
+    else:
+        await run_io(f.write, data)
+
+
+async def write_bytes(path: Path, data: bytes):
+    async with atomic_write(path) as f:
+        await write(f, data)
+
+
+@asynccontextmanager
+async def atomic_write(path: Path) -> AsyncIterator[BinaryIO]:
+    """Opens a temporary file for writing that replaces path when the block ends, so readers
+    never see a partial file.  If the block raises, the temporary file is removed."""
+    temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    f = await run_io(temp_path.open, "wb")
+    try:
+        yield f
+    except BaseException:
+        await run_io(_discard, f, temp_path)
+        raise
+    await run_io(_commit, f, temp_path, path)
+
+
+def _commit(f: BinaryIO, temp_path: Path, path: Path):
+    f.close()
+    os.replace(temp_path, path)
+
+
+def _discard(f: BinaryIO, temp_path: Path):
+    f.close()
+    temp_path.unlink(missing_ok=True)
@@ -0,0 +1,41 @@
+import pytest
+
+from snapdraft_server.util.async_io import (
+    INLINE_MAX_BYTES,
+    atomic_write,
+    read_bytes,
+    read_text,
+    write,
+    write_bytes,
+)
+from snapdraft_server.util.util import load_json_async
+
+
+@pytest.mark.parametrize("size", [10, INLINE_MAX_BYTES + 10])
+async def test_write_and_read(tmp_path, size):
+    path = tmp_path / "data.txt"
+    data = b"x" * size
+    await write_bytes(path, data)
+
+    assert await read_bytes(path) == data
+    assert await read_text(path) == data.decode()
+    assert [_.name for _ in tmp_path.iterdir()] == ["data.txt"]
+
+
+async def test_atomic_write_discards_on_error(tmp_path):
+    path = tmp_path / "data.txt"
+    with pytest.raises(ValueError):
+        async with atomic_write(path) as f:
+            await write(f, b"partial")
+            assert not path.exists()
+            raise ValueError()
+
+    assert list(tmp_path.iterdir()) == []
+
+
+async def test_load_json_async(tmp_path):
+    path = tmp_path / "data.json"
+    await write_bytes(path, b'{"items": [' + b"1," * INLINE_MAX_BYTES + b"2]}")
+
+    data = await load_json_async(path)
+    assert len(data["items"]) == INLINE_MAX_BYTES + 1
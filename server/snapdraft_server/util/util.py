@@ -1,6 +1,10 @@
+import asyncio
 import importlib
 import json
 import os
+from pathlib import Path
+
+from snapdraft_server.util.async_io import INLINE_MAX_BYTES, read_bytes
 
 
 def get_obj_by_name(name: str):
@@ -54,6 +58,20 @@ def load_model(file_path, cls):
     return cls(**data)
 
 
+async def load_json_async(file_path: Path):
+    """Like load_json, for async code.  Large files are read and parsed in threads, so they
+    don't block the event loop."""
+    data = await read_bytes(file_path)
+    if len(data) <= INLINE_MAX_BYTES:
+        return json.loads(data)
+    return await asyncio.to_thread(json.loads, data)
+
+
+async def load_model_async(file_path: Path, cls):
+    data = await load_json_async(file_path)
+    return cls(**data)
+
+
 def save_json(file, file_path):
     """
     Saves a dictionary to a JSON file at the specified file path.